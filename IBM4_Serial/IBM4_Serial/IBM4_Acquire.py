@@ -0,0 +1,188 @@
+"""
+Streaming acquisition from a single IBM4 analog input
+
+ReadMultipleVoltage takes at most 9999 samples and only returns once the whole burst has been read
+Stream_Acquire issues Read%d:%d bursts of a fixed size back-to-back and yields each burst as a numpy array as soon as it arrives
+Up to depth bursts are kept outstanding on the IBM4, so the next burst is already queued when the current one completes
+and the IBM4 does not sit idle while the host is parsing or storing the data
+
+Usage
+stream = IBM4_Acquire.Stream_Acquire(the_dev, 'A2', chunk_size = 1000)
+for chunk in stream:
+    ... # runs until the loop is broken, or until max_chunks chunks have been read
+print(stream.Stats())
+
+With stats = an IBM4_Stats.Running_Stats the chunks are also added to the running statistics, so a long acquisition can
+report its mean, standard error and percentiles without keeping the chunks
+"""
+
+# Gaps cannot be observed directly on the IBM4, they are estimated from the time between completed bursts
+# with back-to-back bursts that time is the burst duration, a longer interval means the IBM4 was left idle
+# Generators
+# https://docs.python.org/3/reference/expressions.html#generator-iterator-methods
+
+import time
+import collections
+import IBM4_Parse
+
+MOD_NAME_STR = "IBM4_Acquire"
+
+class Stream_Acquire(object):
+    """
+    class for continuous acquisition of fixed-size chunks of samples from one IBM4 analog input
+    """
+
+    def __init__(self, the_dev, input_channel, chunk_size = 1000, binary = False, depth = 2, max_chunks = None, gap_factor = 1.5, stats = None):
+        """
+        Constructor for the Stream_Acquire object
+
+        Inputs:
+        the_dev (type: IBM4_Lib.Ser_Iface) is the open IBM4
+        input_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
+        chunk_size (type: int) is the no. of samples in each chunk, in the range [1, 10000)
+        binary = True => chunks of integer samples from BRead, binary = False => chunks of voltage samples from Read
+        depth (type: int) is the max. no. of bursts outstanding on the IBM4 at any one time
+        max_chunks (type: int) is the no. of chunks after which the stream stops, None => stream until the loop is broken
+        gap_factor (type: float) an interval between chunks longer than gap_factor times the typical interval is counted as a gap
+        stats (type: IBM4_Stats.Running_Stats) is updated with every chunk, None => no running statistics
+        """
+
+        self.MOD_NAME_STR = MOD_NAME_STR
+        self.FUNC_NAME = ".Stream_Acquire()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        self.dev = the_dev
+        self.chunk_size = chunk_size
+        self.binary = binary
+        self.depth = max(1, depth)
+        self.max_chunks = max_chunks
+        self.gap_factor = gap_factor
+        self.stats = stats
+        self.valid = False
+        self.ResetStats()
+
+        try:
+            c1 = True if the_dev.instr_obj is not None and the_dev.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
+            c2 = True if input_channel in the_dev.Read_Chnnls else False # confirm that the input channel label is correct
+            c3 = True if chunk_size > 0 and chunk_size < 10000 else False # confirm that the chunk size is accepted by the IBM4
+
+            c10 = c1 and c2 and c3
+
+            if c10:
+                read_cmd = '%(v0)s%(v1)d:%(v2)d\r\n'%{"v0":'BRead' if binary else 'Read', "v1":the_dev.Read_Chnnls[input_channel], "v2":chunk_size}
+                self.cmd = str.encode(read_cmd)
+                self.valid = True
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nNo comms established'
+                if not c2:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A2, A3, A4, A5, D2}'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nchunk_size outside range [1, 10000)'
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def ResetStats(self):
+        """
+        Reset the acquisition statistics
+        """
+
+        self.chunks = 0 # no. of chunks yielded
+        self.samples = 0 # no. of samples yielded
+        self.t_start = None # time.perf_counter() value when the first burst was written
+        self.t_last = None # time.perf_counter() value when the last chunk was received
+        self.t_chunk = None # time.time() value when the last chunk was received, for logging
+        self.interval = None # moving average of the time between chunks, units of second
+        self.max_interval = 0.0 # longest time between chunks, units of second
+        self.gaps = 0 # no. of intervals that were longer than gap_factor times the moving average
+        self.gap_time = 0.0 # total time by which the gaps exceeded the moving average, units of second
+
+    def _Update(self, t, n):
+        """
+        Update the statistics with a chunk of n samples received at time t
+        """
+
+        if self.t_last is not None:
+            dt = t - self.t_last
+            self.max_interval = max(self.max_interval, dt)
+            if self.interval is None:
+                self.interval = dt
+            elif dt > self.gap_factor * self.interval:
+                self.gaps = self.gaps + 1
+                self.gap_time = self.gap_time + dt - self.interval # gaps are kept out of the moving average
+            else:
+                self.interval = 0.9 * self.interval + 0.1 * dt
+        self.t_last = t
+        self.t_chunk = time.time()
+        self.chunks = self.chunks + 1
+        self.samples = self.samples + n
+
+    def Stats(self):
+        """
+        Return the acquisition statistics
+
+        Outputs:
+        res (type: dict) contains the no. of chunks and samples, the elapsed time in units of second, the achieved sample rate
+        in samples/s, the typical and the longest interval between chunks in units of second and the no. and total length of the gaps
+        """
+
+        elapsed = 0.0 if self.t_start is None or self.t_last is None else self.t_last - self.t_start
+        return {"chunks":self.chunks, "samples":self.samples, "elapsed":elapsed, "rate":self.samples / elapsed if elapsed > 0 else 0.0,
+                "interval":self.interval, "max_interval":self.max_interval, "gaps":self.gaps, "gap_time":self.gap_time}
+
+    def __iter__(self):
+        """
+        Generator that yields each chunk as a numpy array as it is received
+        Outstanding bursts are read and discarded when the loop over the stream ends
+        """
+
+        if not self.valid:
+            return
+
+        dev = self.dev
+        parse = IBM4_Parse.ParseInts if self.binary else IBM4_Parse.ParseFloats
+        completed = collections.deque() # replies that have been read but not yet yielded
+        inflight = 0
+        issued = 0
+        try:
+            self.t_start = time.perf_counter() if self.t_start is None else self.t_start
+            while self.max_chunks is None or self.chunks < self.max_chunks:
+                # keep depth bursts outstanding, the next burst is written before the current one is parsed
+                batch = bytearray()
+                while inflight < self.depth and (self.max_chunks is None or issued < self.max_chunks):
+                    dev.framer.Expect(self.cmd, 1)
+                    batch += self.cmd
+                    inflight = inflight + 1
+                    issued = issued + 1
+                if len(batch) > 0:
+                    dev.instr_obj.write(batch)
+                    if dev.framer.metrics is not None:
+                        dev.framer.MarkWritten()
+
+                if len(completed) == 0:
+                    completed.extend( dev._ReadReplies(1, timeout = dev._ReadTimeout(self.chunk_size)) )
+                tag, lines = completed.popleft()
+                inflight = inflight - 1
+                t = time.perf_counter()
+                vals = parse(lines[-1], self.chunk_size)
+                self._Update(t, len(vals))
+                if self.stats is not None:
+                    self.stats.Update(vals)
+                yield vals
+        finally:
+            # the replies to bursts that are still outstanding are read so that the port stays in step
+            inflight = inflight - len(completed)
+            if inflight > 0:
+                try:
+                    dev._ReadReplies(inflight, timeout = dev._ReadTimeout(self.chunk_size * inflight))
+                except TimeoutError:
+                    pass # _ReadReplies has already cleared the framer and the input buffer
+
+def StreamVoltage(the_dev, input_channel, chunk_size = 1000, max_chunks = None, depth = 2):
+    """
+    Generator that yields chunks of voltage samples from input_channel, see Stream_Acquire
+    """
+
+    yield from Stream_Acquire(the_dev, input_channel, chunk_size, False, depth, max_chunks)
@@ -0,0 +1,429 @@
+"""
+asyncio counterpart to IBM4_Lib.Ser_Iface
+Every read / write / differential read / PWM operation is a coroutine, so waiting for the IBM4 never blocks the event loop
+This allows one process to drive several IBM4s and other instruments at once without a thread per device
+"""
+
+# Notes on asyncio
+# https://docs.python.org/3/library/asyncio-eventloop.html#watching-file-descriptors
+# https://docs.python.org/3/library/asyncio-task.html#asyncio.wait_for
+# https://docs.python.org/3/library/asyncio-sync.html#asyncio.Semaphore
+
+# The port is opened with timeout = 0 so that reads never block
+# On POSIX the event loop watches the port file descriptor and the reply bytes are fed to a Reply_Framer as they arrive
+# On Windows the selector loop cannot watch a COM port, so a task polls in_waiting instead
+# Replies are matched to the requests in the order the commands were written, exactly as in Cmd_Pipeline
+# Several coroutines can therefore have requests outstanding on the same port at once
+
+import re
+import sys
+import asyncio
+import serial # this package is actually called pyserial, install using py -m pip install pyserial
+import numpy
+import IBM4_Lib
+import IBM4_Parse
+
+MOD_NAME_STR = "IBM4_Async"
+
+# no. of samples requested by a read command, e.g. b'Read0:100', b'Diff_BRead0:1:100', b'Average2:50' -> 100, 100, 50
+SAMPLES_PATTERN = re.compile(rb'^(?:Diff_)?(?:B?Read|Average)[\d:]*?:(\d+)$')
+
+class AsyncSer_Iface(object):
+    """
+    class for interfacing to an IBM4 from an asyncio event loop
+    """
+
+    def __init__(self, port_name, depth = 16):
+        """
+        Constructor for the asyncio IBM4 Serial Interface
+        No I/O is performed here, call await OpenComms() or use async with to open the link
+
+        port_name is the name of the COM port to which the IBM4 is attached
+        depth (type: int) is the max. no. of commands outstanding on the IBM4 at any one time
+        """
+
+        self.MOD_NAME_STR = MOD_NAME_STR
+
+        # Dictionaries for the Read, Write, PWM Channels, same as Ser_Iface
+        self.Read_Chnnls = {"A2":0, "A3":1, "A4":2, "A5":3, "D2":4}
+        self.Write_Chnnls = {"A0":0, "A1":1}
+        self.PWM_Chnnls = {"D0":0, "D1":1, "D7":7, "D9":9, "D10":10, "D11":11, "D12":12, "D13":13}
+        self.Read_Modes = {"DC":0, "AC":1}
+        self.Read_Dtype = numpy.dtype( [(k, numpy.float64) for k in self.Read_Chnnls] )
+
+        # Voltage Bounding Values
+        self.VMAX = 3.3 # Max output voltage from IBM4
+        self.VMIN = 0.0 # Min output voltage from IBM4
+        self.DELTA_VMIN = 0.01 # Min voltage increment from IBM4
+
+        self.IBM4Port = port_name
+        self.baud_rate = 9600 # serial comms baud_rate
+        self.read_timeout = 3 # default timeout for each reply, units of second
+        self.sample_timeout = 1.0e-3 # additional timeout allowed per sample requested, units of second, see _ReadTimeout
+        self.write_timeout = 0.5 # timeout for writing data to the IBM4, units of second
+        self.poll_interval = 0.002 # interval between checks of the port when it cannot be watched by the loop, units of second
+        self.depth = max(1, depth)
+        self.instr_obj = None
+
+        self.Reply_Lines = {b'a0':0, b'b0':0, b'l':2}
+        self.framer = IBM4_Lib.Reply_Framer()
+        self._loop = None
+        self._window = None # bounds the no. of commands outstanding on the IBM4
+        self._poll_task = None
+
+    def __str__(self):
+        """
+        return a string the describes the class
+        """
+
+        return "class for interfacing to an IBM4 from an asyncio event loop"
+
+    async def __aenter__(self):
+        await self.OpenComms()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.CloseComms()
+
+    def CommsStatus(self, loud = False):
+        """
+        investigate the status of the serial comms link
+        """
+
+        if self.instr_obj is not None and self.instr_obj.isOpen():
+            if loud: print('Communication with:',self.instr_obj.name,' is open')
+            return True
+        else:
+            if loud: print('Communication with: IBM4 is not open')
+            return False
+
+    async def OpenComms(self, read_mode = 'DC'):
+        """
+        open a serial link to the IBM4, set the read mode and ground the outputs
+        """
+
+        self._loop = asyncio.get_running_loop()
+        self._window = asyncio.Semaphore(self.depth)
+        self.instr_obj = serial.Serial(self.IBM4Port, self.baud_rate, timeout = 0, write_timeout = self.write_timeout, stopbits=serial.STOPBITS_ONE)
+
+        if sys.platform.startswith('win'):
+            self._poll_task = self._loop.create_task( self._PollReader() )
+        else:
+            self._loop.add_reader(self.instr_obj.fileno(), self._OnReadable)
+
+        # mode and zeroing commands are written back-to-back, the replies are awaited together
+        await asyncio.gather( self.SetMode(read_mode), self.ZeroIBM4() )
+        self.CommsStatus(loud = True)
+
+    async def CloseComms(self):
+        """
+        ground the outputs of the IBM4 and close the serial link
+        """
+
+        if self.CommsStatus():
+            print('Closing Serial link with:',self.instr_obj.name)
+            await self.ZeroIBM4()
+            if self._poll_task is not None:
+                self._poll_task.cancel()
+                self._poll_task = None
+            else:
+                self._loop.remove_reader(self.instr_obj.fileno())
+            self._Resync( ConnectionError('IBM4 link closed') )
+            self.instr_obj.close()
+
+    # protected methods for exchanging framed commands and replies with the IBM4
+
+    def _OnReadable(self):
+        """
+        Feed the bytes waiting at the port to the framer and complete the futures of any finished replies
+        """
+
+        try:
+            waiting = self.instr_obj.in_waiting
+            self.framer.Feed( self.instr_obj.read(waiting if waiting > 0 else 1) ) # port timeout is 0, read never blocks
+        except (OSError, serial.SerialException) as e:
+            self._Resync(e)
+            return
+
+        for (fut, parser), lines in self.framer.Replies():
+            self._window.release()
+            if not fut.done(): # the request may have been cancelled while its reply was in flight
+                try:
+                    fut.set_result(parser(lines) if parser is not None else lines)
+                except Exception as e:
+                    fut.set_exception(e)
+
+    async def _PollReader(self):
+        """
+        Poll the port for reply bytes when the event loop cannot watch it directly
+        """
+
+        while True:
+            if self.instr_obj.in_waiting > 0:
+                self._OnReadable()
+                await asyncio.sleep(0) # a long reply must not hold the event loop
+            else:
+                await asyncio.sleep(self.poll_interval)
+
+    def _Resync(self, exc):
+        """
+        Abandon every outstanding reply, used when a reply is lost and later replies can no longer be matched
+        """
+
+        for entry in self.framer.pending:
+            fut = entry[2][0]
+            self._window.release()
+            if not fut.done():
+                fut.set_exception(exc)
+        self.framer.Clear()
+        if self.CommsStatus():
+            self.instr_obj.reset_input_buffer()
+
+    async def _Transact(self, cmd, no_lines = None, parser = None, timeout = None):
+        """
+        Write a command to the IBM4 and await its reply
+
+        If the coroutine is cancelled the reply is still consumed when it arrives, so the port stays in step
+        If the reply does not arrive before the timeout, every outstanding reply is abandoned and asyncio.TimeoutError is raised
+        The default timeout is extended for the samples requested by this command and by the commands outstanding ahead of it,
+        so that an ordinary long read does not time out and abort the other requests
+
+        Inputs:
+        cmd (type: bytes) is the command including the terminating \\r\\n
+        no_lines (type: int) is the no. of result lines expected after the echo, default is taken from Reply_Lines
+        parser is an optional callable applied to the list of result lines
+        timeout (type: float) is the time allowed for the reply, default is given by _ReadTimeout, units of second
+        """
+
+        if no_lines is None:
+            no_lines = self.Reply_Lines.get(cmd.strip(), 1)
+        await self._window.acquire()
+        if timeout is None:
+            timeout = self._ReadTimeout( self._Samples(cmd.strip()) + sum( self._Samples(entry[0]) for entry in self.framer.pending ) )
+        fut = self._loop.create_future()
+        self.framer.Expect(cmd, no_lines, (fut, parser)) # Expect and write with no await between, so replies stay in order
+        try:
+            self.instr_obj.write(cmd)
+        except (OSError, serial.SerialException) as e:
+            self._Resync(e)
+            raise
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self._Resync( asyncio.TimeoutError('IBM4 reply to %(v1)s not received'%{"v1":cmd.strip()}) )
+            raise
+
+    def _Samples(self, cmd):
+        """
+        Return the no. of samples requested by the command cmd, stripped of its \\r\\n, 0 for commands that are not reads
+        """
+
+        m = SAMPLES_PATTERN.match(cmd)
+        return 0 if m is None else int(m.group(1))
+
+    def _ReadTimeout(self, no_samples):
+        """
+        Return the time allowed for a reply that follows no_samples samples, the fixed read_timeout is extended by sample_timeout per sample
+        """
+
+        return self.read_timeout + no_samples * self.sample_timeout
+
+    def _LastFloat(self, lines):
+        return float( IBM4_Parse.ParseFloats(lines[-1])[-1] )
+
+    def _LastInt(self, lines):
+        return int( IBM4_Parse.ParseInts(lines[-1])[-1] )
+
+    def _Fail(self, ERR_STATEMENT):
+        """
+        report a request that could not be made
+        """
+
+        print(ERR_STATEMENT)
+        return None
+
+    # coroutines for writing data to the IBM4
+
+    async def SetMode(self, read_mode = 'DC', timeout = None):
+        """
+        read_mode = 'DC' =>  IBM4 assumes analog inputs in the range [0, 3.3)
+        read_mode = 'AC' =>  IBM4 assumes analog inputs in the range [-8, +8]
+        """
+
+        ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + ".SetMode()"
+        if read_mode not in self.Read_Modes:
+            return self._Fail(ERR_STATEMENT + '\nCould not write to instrument\nInvalid read mode specified')
+        write_cmd = 'Mode%(v1)d\r\n'%{"v1":self.Read_Modes[read_mode]}
+        await self._Transact( str.encode(write_cmd), timeout = timeout )
+
+    async def ZeroIBM4(self, timeout = None):
+        """
+        zero the analog and PWM outputs of the IBM4, the commands are written back-to-back
+        """
+
+        cmds = [b'a0\r\n', b'b0\r\n'] + [ str.encode('PWM%(v1)d:0\r\n'%{"v1":v}) for v in self.PWM_Chnnls.values() ]
+        await asyncio.gather( *[ self._Transact(cmd, timeout = timeout) for cmd in cmds ] )
+
+    async def IdentifyIBM4(self, timeout = None):
+        """
+        Extract the IBM4 identity string and version number
+        """
+
+        lines = await self._Transact(b'*IDN\r\n', timeout = timeout)
+        matching = [s for s in lines if b'ISBY' in s]
+        return matching[0] if len(matching) > 0 else None
+
+    async def WriteVoltage(self, output_channel, set_voltage = 0.0, timeout = None):
+        """
+        output a voltage on one of the analog output pins of the IBM4
+
+        output_channel is one of A0, A1
+        set_voltage must be in the range [0.0, 3.3]
+        """
+
+        ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + ".WriteVoltage()"
+        if output_channel not in self.Write_Chnnls:
+            return self._Fail(ERR_STATEMENT + '\nCould not write to instrument\noutput_channel outside range {A0, A1}')
+        if not ( set_voltage >= self.VMIN and set_voltage < self.VMAX or abs(set_voltage - self.VMAX) < self.DELTA_VMIN ):
+            return self._Fail(ERR_STATEMENT + '\nCould not write to instrument\nset_voltage %(v1)0.3f outside range [0.0, 3.3]'%{"v1":set_voltage})
+        write_cmd = 'Write%(v1)d:%(v2)0.2f\r\n'%{"v1":self.Write_Chnnls[output_channel], "v2":set_voltage}
+        await self._Transact( str.encode(write_cmd), timeout = timeout )
+
+    async def WritePWM(self, percentage, timeout = None):
+        """
+        set the PWM output on pin D9, percentage must be in the range [0, 100]
+        """
+
+        await self.WriteAnyPWM('D9', percentage, timeout)
+
+    async def WriteAnyPWM(self, pinOut, percentage, timeout = None):
+        """
+        set the PWM output on any PWM pin 'D0', 'D1', 'D7', 'D9', 'D10'-'D13', percentage must be in the range [0, 100]
+        """
+
+        ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + ".WriteAnyPWM()"
+        if pinOut not in self.PWM_Chnnls:
+            return self._Fail(ERR_STATEMENT + '\nCould not write to instrument\npinOut is not a PWM channel')
+        if not ( percentage >= 0 and percentage < 101 ):
+            return self._Fail(ERR_STATEMENT + '\nCould not write to instrument\npercentage outside range [0, 100]')
+        write_cmd = 'PWM%(v1)d:%(v2)d\r\n'%{"v1":self.PWM_Chnnls[pinOut], "v2":percentage}
+        await self._Transact( str.encode(write_cmd), timeout = timeout )
+
+    # coroutines for obtaining data from the IBM4
+
+    def _ReadCmd(self, FUNC_NAME, cmd_name, input_channel, no_reads):
+        """
+        generate a single ended read command, returns None if the inputs are not valid
+        """
+
+        ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + FUNC_NAME
+        if input_channel not in self.Read_Chnnls:
+            return self._Fail(ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A2, A3, A4, A5, D2}')
+        if not ( no_reads > 0 and no_reads < 10000 ):
+            return self._Fail(ERR_STATEMENT + '\nCould not read from instrument\nno_reads outside range [1, 9999]')
+        return str.encode( '%(v0)s%(v1)d:%(v2)d\r\n'%{"v0":cmd_name, "v1":self.Read_Chnnls[input_channel], "v2":no_reads} )
+
+    def _DiffCmd(self, FUNC_NAME, cmd_name, pos_channel, neg_channel, no_reads):
+        """
+        generate a differential read command, returns None if the inputs are not valid
+        """
+
+        ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + FUNC_NAME
+        if pos_channel not in self.Read_Chnnls or neg_channel not in self.Read_Chnnls:
+            return self._Fail(ERR_STATEMENT + '\nCould not read from instrument\nchannel outside range {A2, A3, A4, A5, D2}')
+        if pos_channel == neg_channel:
+            return self._Fail(ERR_STATEMENT + '\nCould not read from instrument\npos_channel cannot be the same as neg_channel')
+        if not ( no_reads > 0 and no_reads < 10000 ):
+            return self._Fail(ERR_STATEMENT + '\nCould not read from instrument\nno_reads outside range [1, 9999]')
+        return str.encode( '%(v0)s%(v1)d:%(v2)d:%(v3)d\r\n'%{"v0":cmd_name, "v1":self.Read_Chnnls[pos_channel], "v2":self.Read_Chnnls[neg_channel], "v3":no_reads} )
+
+    def _Stats(self, vals):
+        """
+        return [mean, amplitude, values] in the same form as the Ser_Iface multiple read methods
+        """
+
+        return [numpy.mean(vals), 0.5*( numpy.max(vals) - numpy.min(vals) ), vals]
+
+    async def ReadSingleVoltage(self, input_channel, timeout = None):
+        read_cmd = self._ReadCmd(".ReadSingleVoltage()", 'Read', input_channel, 1)
+        if read_cmd is not None:
+            return await self._Transact(read_cmd, parser = self._LastFloat, timeout = timeout)
+
+    async def ReadSingleBinary(self, input_channel, timeout = None):
+        read_cmd = self._ReadCmd(".ReadSingleBinary()", 'BRead', input_channel, 1)
+        if read_cmd is not None:
+            return await self._Transact(read_cmd, parser = self._LastInt, timeout = timeout)
+
+    async def ReadAverageVoltage(self, input_channel, no_reads = 10, timeout = None):
+        read_cmd = self._ReadCmd(".ReadAverageVoltage()", 'Average', input_channel, no_reads)
+        if read_cmd is not None:
+            return await self._Transact(read_cmd, parser = self._LastFloat, timeout = timeout)
+
+    async def ReadMultipleVoltage(self, input_channel, no_reads = 10, timeout = None):
+        """
+        returns [average, amplitude, numpy array of voltage readings]
+        """
+
+        read_cmd = self._ReadCmd(".ReadMultipleVoltage()", 'Read', input_channel, no_reads)
+        if read_cmd is not None:
+            vals = await self._Transact(read_cmd, parser = lambda lines: IBM4_Parse.ParseFloats(lines[-1], no_reads), timeout = timeout)
+            return self._Stats(vals)
+
+    async def ReadMultipleBinary(self, input_channel, no_reads = 10, timeout = None):
+        read_cmd = self._ReadCmd(".ReadMultipleBinary()", 'BRead', input_channel, no_reads)
+        if read_cmd is not None:
+            return await self._Transact(read_cmd, parser = lambda lines: IBM4_Parse.ParseInts(lines[-1], no_reads), timeout = timeout)
+
+    async def ReadAverageVoltageAllChnnl(self, no_reads = 10, timeout = None):
+        """
+        returns a numpy array of the averaged voltage at each analog input channel [A2, A3, A4, A5, D2]
+        the Average commands are written back-to-back
+        """
+
+        vals = await asyncio.gather( *[ self.ReadAverageVoltage(item, no_reads, timeout) for item in self.Read_Chnnls ] )
+        return numpy.array(vals, dtype = numpy.float64)
+
+    async def ReadAllChnnlSnapshot(self, no_repeats = 1, average = True, timeout = None):
+        """
+        read every analog input channel with the simple read command l, see Ser_Iface.ReadAllChnnlSnapshot
+        """
+
+        n_chnnls = len(self.Read_Chnnls)
+        parser = lambda lines: IBM4_Parse.ParseFloats( b' '.join(lines), n_chnnls )
+        scans = numpy.vstack( await asyncio.gather( *[ self._Transact(b'l\r\n', parser = parser, timeout = timeout) for i in range(0, no_repeats, 1) ] ) )
+        if average:
+            return numpy.array( tuple( numpy.mean(scans, axis = 0) ), dtype = self.Read_Dtype )
+        res = numpy.empty(no_repeats, dtype = self.Read_Dtype)
+        for k, v in self.Read_Chnnls.items():
+            res[k] = scans[:, v]
+        return res
+
+    async def DiffReadSingle(self, pos_channel, neg_channel, timeout = None):
+        read_cmd = self._DiffCmd(".DiffReadSingle()", 'Diff_Read', pos_channel, neg_channel, 1)
+        if read_cmd is not None:
+            return await self._Transact(read_cmd, parser = self._LastFloat, timeout = timeout)
+
+    async def DiffReadAverage(self, pos_channel, neg_channel, no_reads = 10, timeout = None):
+        read_cmd = self._DiffCmd(".DiffReadAverage()", 'Diff_Average', pos_channel, neg_channel, no_reads)
+        if read_cmd is not None:
+            return await self._Transact(read_cmd, parser = self._LastFloat, timeout = timeout)
+
+    async def DiffReadMultiple(self, pos_channel, neg_channel, no_reads = 10, timeout = None):
+        """
+        returns [average, amplitude, numpy array of differential readings]
+        """
+
+        read_cmd = self._DiffCmd(".DiffReadMultiple()", 'Diff_Read', pos_channel, neg_channel, no_reads)
+        if read_cmd is not None:
+            vals = await self._Transact(read_cmd, parser = lambda lines: IBM4_Parse.ParseFloats(lines[-1], no_reads), timeout = timeout)
+            return self._Stats(vals)
+
+    async def DiffReadSingleBinary(self, pos_channel, neg_channel, timeout = None):
+        read_cmd = self._DiffCmd(".DiffReadSingleBinary()", 'Diff_BRead', pos_channel, neg_channel, 1)
+        if read_cmd is not None:
+            return await self._Transact(read_cmd, parser = self._LastInt, timeout = timeout)
+
+    async def DiffReadMultipleBinary(self, pos_channel, neg_channel, no_reads = 10, timeout = None):
+        read_cmd = self._DiffCmd(".DiffReadMultipleBinary()", 'Diff_BRead', pos_channel, neg_channel, no_reads)
+        if read_cmd is not None:
+            return await self._Transact(read_cmd, parser = lambda lines: IBM4_Parse.ParseInts(lines[-1], no_reads), timeout = timeout)
@@ -0,0 +1,354 @@
+"""
+Benchmarks for the IBM4 serial interface
+Run this module directly to print the results
+
+Parse_Benchmark and Prepared_Benchmark time the host side of a call only
+Run_Suite measures the round-trip latency percentiles and throughput of every Ser_Iface operation against a real IBM4
+or against the IBM4_Simulator and writes the results as JSON so that they can be compared across commits
+
+py IBM4_Benchmark.py => run against the simulator
+py IBM4_Benchmark.py COM4 => run against the IBM4 attached at COM4
+py IBM4_Benchmark.py old.json new.json => compare two sets of results
+"""
+
+# Timing is done with time.perf_counter, which is the highest resolution clock available
+# https://docs.python.org/3/library/time.html#time.perf_counter
+# Percentiles
+# https://numpy.org/doc/stable/reference/generated/numpy.percentile.html
+
+import os
+import sys
+import re
+import json
+import time
+import platform
+import subprocess
+import numpy
+import IBM4_Parse
+import IBM4_Lib
+import IBM4_Simulator
+import Sweep_Interval
+
+MOD_NAME_STR = "IBM4_Benchmark"
+
+def Make_Reply(no_reads, binary = False):
+    """
+    Generate a reply of the form returned by a Read%d:%d or BRead%d:%d command
+
+    no_reads (type: int) is the no. of samples in the reply
+    binary = True => integer samples, binary = False => voltage samples
+    """
+
+    rng = numpy.random.default_rng(1)
+    if binary:
+        vals = rng.integers(0, 65536, no_reads)
+        return str.encode( ', '.join( '%(v1)d'%{"v1":v} for v in vals ) )
+    else:
+        vals = 3.3*rng.random(no_reads)
+        return str.encode( ', '.join( '%(v1)0.4f'%{"v1":v} for v in vals ) )
+
+def Time_Call(func, repeats):
+    """
+    Return the best time per call in units of second for func over repeats calls
+    the minimum is used because it is the least affected by other activity on the PC
+    """
+
+    best = float('inf')
+    for i in range(0, repeats, 1):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def Parse_Benchmark(no_reads = 10000, repeats = 20):
+    """
+    Compare the original str + re.findall parse of a multi-sample reply with the bytes-level parser in IBM4_Parse
+
+    Outputs:
+    res (type: dict) contains the time per parse in units of second for each method and the speedup
+    """
+
+    res = {}
+    for binary in [False, True]:
+        read_result = Make_Reply(no_reads, binary)
+        conv = numpy.int_ if binary else numpy.float64
+        old = lambda: conv( re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) )[-no_reads:] )
+        new = lambda: IBM4_Parse.ParseValues(read_result, no_reads, conv)
+
+        # confirm that both methods return the same values before timing them
+        if not numpy.array_equal(old(), new()):
+            raise Exception('Parse_Benchmark: parsers do not agree')
+
+        t_old = Time_Call(old, repeats)
+        t_new = Time_Call(new, repeats)
+        label = 'Binary' if binary else 'Voltage'
+        res[label] = {"regex":t_old, "bytes":t_new, "speedup":t_old / t_new}
+        print('%(v1)s reply, %(v2)d samples: regex %(v3)0.3f ms, bytes %(v4)0.3f ms, speedup x%(v5)0.1f'%{"v1":label, "v2":no_reads, "v3":1000*t_old, "v4":1000*t_new, "v5":t_old / t_new})
+    return res
+
+class Echo_Port(object):
+    """
+    class for an in-memory port that replies instantly to every command, used to time the host side of a call
+    every command is echoed and followed by the result line 1.2345, except a0 and b0 which have no result line
+    """
+
+    def __init__(self):
+        self.name = 'echo'
+        self.rx = bytearray()
+
+    def isOpen(self):
+        return True
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def write(self, data):
+        for cmd in bytes(data).split(b'\r\n')[:-1]:
+            self.rx += cmd + b'\r\n'
+            if cmd not in (b'a0', b'b0'):
+                self.rx += b'1.2345\r\n'
+        return len(data)
+
+    def read(self, size = 1):
+        data = bytes(self.rx[:size])
+        del self.rx[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self.rx.clear()
+
+    def close(self):
+        pass
+
+def Prepared_Benchmark(no_calls = 5000):
+    """
+    Compare the per-call cost of the Ser_Iface write / read methods with the equivalent Prepared_Cmd
+    The calls are made against an Echo_Port so that only the host side cost is measured
+
+    Outputs:
+    res (type: dict) contains the time per call in units of second for each method
+    """
+
+    the_dev = IBM4_Lib.Ser_Iface(instr_obj = Echo_Port())
+    write_cmd = the_dev.PrepareWriteVoltage('A0', 1.25)
+    read_cmd = the_dev.PrepareRead('A2', 'Single Voltage')
+
+    tests = {"WriteVoltage":lambda: the_dev.WriteVoltage('A0', 1.25),
+             "PreparedWrite":write_cmd.Execute,
+             "ReadSingleVoltage":lambda: the_dev.ReadSingleVoltage('A2'),
+             "PreparedRead":read_cmd.Execute}
+    res = {}
+    for k, func in tests.items():
+        start = time.perf_counter()
+        for i in range(0, no_calls, 1):
+            func()
+        res[k] = (time.perf_counter() - start) / no_calls
+        print('%(v1)s: %(v2)0.2f us per call'%{"v1":k.ljust(20), "v2":1.0e6*res[k]})
+    return res
+
+def Latency_Stats(times, samples_per_call = 1):
+    """
+    Summarise the round-trip times of repeated calls
+
+    Inputs:
+    times (type: numpy array) contains the time taken by each call, units of second
+    samples_per_call (type: int) is the no. of samples returned by each call
+
+    Outputs:
+    res (type: dict) contains the no. of calls, the mean, p50, p90, p99 and max times in units of second and the samples/s
+    """
+
+    p50, p90, p99 = numpy.percentile(times, [50, 90, 99])
+    return {"calls":len(times), "mean":float(numpy.mean(times)), "p50":float(p50), "p90":float(p90), "p99":float(p99),
+            "max":float(numpy.max(times)), "samples_per_s":samples_per_call * len(times) / float(numpy.sum(times))}
+
+def Time_Calls(func, no_calls, samples_per_call = 1):
+    """
+    Time no_calls calls of func, each call is timed separately so that the latency percentiles can be computed
+    """
+
+    times = numpy.zeros(no_calls)
+    for i in range(0, no_calls, 1):
+        start = time.perf_counter()
+        func()
+        times[i] = time.perf_counter() - start
+    return Latency_Stats(times, samples_per_call)
+
+def Print_Stats(label, stats):
+    print('%(v1)s p50 %(v2)9.3f ms, p90 %(v3)9.3f ms, p99 %(v4)9.3f ms, %(v5)10.1f samples/s'%{"v1":label.ljust(28), "v2":1000*stats["p50"], "v3":1000*stats["p90"], "v4":1000*stats["p99"], "v5":stats["samples_per_s"]})
+
+def Operation_Benchmark(the_dev, no_calls = 100, no_reads = 100):
+    """
+    Measure the round-trip latency of every Ser_Iface operation
+
+    Inputs:
+    the_dev (type: IBM4_Lib.Ser_Iface) is an open IBM4
+    no_calls (type: int) is the no. of calls made to each operation
+    no_reads (type: int) is the no. of samples taken by the multiple read and average operations
+
+    Outputs:
+    res (type: dict) contains the Latency_Stats of each operation
+    """
+
+    # each entry is (operation, samples returned per call)
+    ops = {"IdentifyIBM4":(lambda: the_dev.IdentifyIBM4(), 1),
+           "WriteVoltage":(lambda: the_dev.WriteVoltage('A0', 1.25), 1),
+           "WritePWM":(lambda: the_dev.WritePWM(50), 1),
+           "WriteAnyPWM":(lambda: the_dev.WriteAnyPWM('D7', 50), 1),
+           "ReadSingleVoltage":(lambda: the_dev.ReadSingleVoltage('A2'), 1),
+           "ReadSingleBinary":(lambda: the_dev.ReadSingleBinary('A2'), 1),
+           "ReadAverageVoltage":(lambda: the_dev.ReadAverageVoltage('A2', no_reads), no_reads),
+           "ReadMultipleVoltage":(lambda: the_dev.ReadMultipleVoltage('A2', no_reads), no_reads),
+           "ReadMultipleBinary":(lambda: the_dev.ReadMultipleBinary('A2', no_reads), no_reads),
+           "DiffReadSingle":(lambda: the_dev.DiffReadSingle('A2', 'A3'), 1),
+           "DiffReadAverage":(lambda: the_dev.DiffReadAverage('A2', 'A3', no_reads), no_reads),
+           "DiffReadMultiple":(lambda: the_dev.DiffReadMultiple('A2', 'A3', no_reads), no_reads),
+           "DiffReadSingleBinary":(lambda: the_dev.DiffReadSingleBinary('A2', 'A3'), 1),
+           "DiffReadMultipleBinary":(lambda: the_dev.DiffReadMultipleBinary('A2', 'A3', no_reads), no_reads),
+           "ReadAverageVoltageAllChnnl":(lambda: the_dev.ReadAverageVoltageAllChnnl(no_reads), no_reads * len(the_dev.Read_Chnnls)),
+           "ReadAllChnnlSnapshot":(lambda: the_dev.ReadAllChnnlSnapshot(), len(the_dev.Read_Chnnls))}
+
+    res = {}
+    for k, (func, samples) in ops.items():
+        func() # the first call is not timed
+        res[k] = Time_Calls(func, no_calls, samples)
+        Print_Stats(k, res[k])
+    the_dev.ZeroIBM4()
+    return res
+
+def No_Reads_Benchmark(the_dev, no_reads_list = [1, 3, 10, 30, 100, 300, 1000, 3000, 9999, 10000, 30000], no_calls = 20):
+    """
+    Measure how the latency and throughput of a multiple read scale with the no. of samples taken
+    no_reads = 1 uses the single read methods, the multiple read methods accept no_reads >= 3 and split no_reads > 9999 into chunks
+    the default no_reads_list ends with 10000 and 30000, which are read in chunks by ReadChunked, so the chunked path is timed as well
+
+    Outputs:
+    res (type: list) contains a dict for each no_reads with the Latency_Stats of the voltage and binary reads
+    """
+
+    res = []
+    for n in no_reads_list:
+        if n == 1:
+            volt = lambda: the_dev.ReadSingleVoltage('A2')
+            binary = lambda: the_dev.ReadSingleBinary('A2')
+        else:
+            volt = lambda: the_dev.ReadMultipleVoltage('A2', n)
+            binary = lambda: the_dev.ReadMultipleBinary('A2', n)
+        item = {"no_reads":n, "voltage":Time_Calls(volt, no_calls, n), "binary":Time_Calls(binary, no_calls, n)}
+        Print_Stats('Read voltage no_reads = %(v1)d'%{"v1":n}, item["voltage"])
+        Print_Stats('Read binary no_reads = %(v1)d'%{"v1":n}, item["binary"])
+        res.append(item)
+    return res
+
+def Sweep_Benchmark(the_dev, no_steps = 11, no_averages = 10):
+    """
+    Time SingleChannelSweepB end to end, this includes the settling delay applied at each step
+
+    Outputs:
+    res (type: dict) contains the total time, the time per step and the no. of steps, times in units of second
+    """
+
+    interval = Sweep_Interval.SweepSpace(no_steps, 0.0, 2.5)
+    start = time.perf_counter()
+    data = the_dev.SingleChannelSweepB('A0', interval, 0.0, no_averages)
+    total = time.perf_counter() - start
+    res = {"steps":no_steps, "no_averages":no_averages, "total":total, "per_step":total / no_steps, "rows":0 if data is None else len(data)}
+    print('SingleChannelSweepB %(v1)d steps: %(v2)0.3f s, %(v3)0.2f ms per step'%{"v1":no_steps, "v2":total, "v3":1000*res["per_step"]})
+    return res
+
+def Git_Commit():
+    """
+    Return the hash of the commit being benchmarked, None if it cannot be determined
+    """
+
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() if out.returncode == 0 else None
+    except OSError:
+        return None
+
+def Run_Suite(port_name = None, out_file = None, no_calls = 100, realtime = True):
+    """
+    Run every benchmark against a real IBM4 or against the IBM4_Simulator and save the results as JSON
+
+    Inputs:
+    port_name (type: str) is the port at which the IBM4 is attached, port_name = None => use the IBM4_Simulator
+    out_file (type: str) is the name of the JSON results file, out_file = None => IBM4_Benchmark_<time>.json
+    no_calls (type: int) is the no. of calls made to each operation
+    realtime = True => the simulator delays its replies using its latency model
+
+    Outputs:
+    res (type: dict) contains the results that were saved
+    """
+
+    FUNC_NAME = ".Run_Suite()" # use this in exception handling messages
+    ERR_STATEMENT = "Error: " + MOD_NAME_STR + FUNC_NAME
+
+    sim = None
+    the_dev = None
+    try:
+        if port_name is not None:
+            the_dev = IBM4_Lib.Ser_Iface(port_name)
+        elif sys.platform.startswith('win'):
+            the_dev = IBM4_Lib.Ser_Iface(instr_obj = IBM4_Simulator.Sim_Port(IBM4_Simulator.IBM4_Firmware(seed = 1), realtime))
+        else:
+            sim = IBM4_Simulator.Pty_Simulator(IBM4_Simulator.IBM4_Firmware(seed = 1), realtime)
+            the_dev = IBM4_Lib.Ser_Iface(sim.Start())
+
+        idn = the_dev.IdentifyIBM4()
+        res = {"meta":{"time":time.strftime('%Y-%m-%dT%H:%M:%S'), "commit":Git_Commit(), "python":platform.python_version(),
+                       "numpy":numpy.__version__, "platform":platform.platform(), "port":the_dev.IBM4Port,
+                       "idn":None if idn is None else idn.decode(errors = 'replace'), "simulated":port_name is None, "no_calls":no_calls}}
+        print('\nOperation latency')
+        res["operations"] = Operation_Benchmark(the_dev, no_calls)
+        print('\nLatency versus no_reads')
+        res["no_reads"] = No_Reads_Benchmark(the_dev, no_calls = max(1, no_calls // 5))
+        print('\nSweep')
+        res["sweep"] = Sweep_Benchmark(the_dev)
+
+        if out_file is None:
+            out_file = 'IBM4_Benchmark_%(v1)s.json'%{"v1":time.strftime('%Y%m%d_%H%M%S')}
+        with open(out_file, 'w') as f:
+            json.dump(res, f, indent = 2)
+        print('\nResults saved to',out_file)
+        return res
+    except Exception as e:
+        print(ERR_STATEMENT)
+        print(e)
+    finally:
+        the_dev = None # the link is closed before the simulator is stopped
+        if sim is not None:
+            sim.Stop()
+
+def Compare_Results(old_file, new_file):
+    """
+    Print the change in p50 latency of each operation between two Run_Suite results files
+
+    Outputs:
+    res (type: dict) contains the ratio new p50 / old p50 of each operation found in both files
+    """
+
+    with open(old_file, 'r') as f:
+        old = json.load(f)
+    with open(new_file, 'r') as f:
+        new = json.load(f)
+
+    print('Comparing',old["meta"]["commit"],'->',new["meta"]["commit"])
+    res = {}
+    for k, stats in new["operations"].items():
+        if k in old["operations"]:
+            res[k] = stats["p50"] / old["operations"][k]["p50"]
+            print('%(v1)s p50 %(v2)9.3f ms -> %(v3)9.3f ms, x%(v4)0.2f'%{"v1":k.ljust(28), "v2":1000*old["operations"][k]["p50"], "v3":1000*stats["p50"], "v4":res[k]})
+    return res
+
+def main():
+    if len(sys.argv) == 3:
+        Compare_Results(sys.argv[1], sys.argv[2])
+    else:
+        Parse_Benchmark()
+        Prepared_Benchmark()
+        Run_Suite(sys.argv[1] if len(sys.argv) == 2 else None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Discovery of the IBM4s attached to a PC
+Candidate ports are first filtered by USB VID / PID / serial number using the OS port enumeration,
+the remaining candidates are then probed with *IDN in parallel, with a bounded overall deadline
+
+The original FindIBM4 opened COM1..COM256 on Windows, or every /dev/tty* on Linux, one at a time
+and waited for a timeout on each, which is hundreds of sequential opens on a typical Linux host
+"""
+
+# pyserial port enumeration
+# https://pyserial.readthedocs.io/en/latest/tools.html#module-serial.tools.list_ports
+# Thread pools
+# https://docs.python.org/3/library/concurrent.futures.html#threadpoolexecutor
+
+import sys
+import glob
+import time
+import concurrent.futures
+import serial # this package is actually called pyserial, install using py -m pip install pyserial
+import serial.tools.list_ports
+import IBM4_Lib
+
+MOD_NAME_STR = "IBM4_Discovery"
+
+# The IBM4 is an Adafruit ItsyBitsy M4 running CircuitPython, Adafruit boards enumerate with the Adafruit USB vendor ID
+# The product ID depends on the firmware loaded onto the board, so by default any Adafruit PID is accepted
+IBM4_VID = 0x239A
+
+def ListCandidates(vid = IBM4_VID, pids = None, serial_number = None):
+    """
+    Use the OS port enumeration to list the ports that could have an IBM4 attached
+
+    Inputs:
+    vid (type: int) is the USB vendor ID to match, None => do not filter on USB metadata
+    pids (type: list) contains the USB product IDs to match, None => any product ID
+    serial_number (type: str) is the USB serial number to match, None => any serial number
+
+    Outputs:
+    ports (type: list) contains the serial.tools.list_ports ListPortInfo of each candidate
+    """
+
+    ports = []
+    for info in serial.tools.list_ports.comports():
+        if vid is not None and info.vid != vid:
+            continue
+        if pids is not None and info.pid not in pids:
+            continue
+        if serial_number is not None and info.serial_number != serial_number:
+            continue
+        ports.append(info)
+    return ports
+
+def ListAllPorts():
+    """
+    List every serial port name on the PC, used when no port carries the USB metadata of an IBM4
+    """
+
+    ports = [info.device for info in serial.tools.list_ports.comports()]
+    if len(ports) == 0:
+        # fall back on the port names that the original FindIBM4 tried
+        if sys.platform.startswith('win'):
+            ports = ['COM%s'%(i+1) for i in range(256)]
+        elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
+            ports = glob.glob('/dev/tty[A-Za-z]*') # this excludes your current terminal "/dev/tty"
+        elif sys.platform.startswith('darwin'):
+            ports = glob.glob('/dev/tty.*')
+    return ports
+
+def ProbePort(port, timeout = 0.5, baud_rate = 9600):
+    """
+    Ask the device on port to identify itself
+
+    Inputs:
+    port (type: str) is the name of the port
+    timeout (type: float) is the time allowed for the *IDN reply, units of second
+
+    Outputs:
+    idn (type: bytes) is the ISBY identity string of the IBM4, None if the device is not an IBM4 or did not reply
+    """
+
+    try:
+        s = serial.Serial(port, baud_rate, timeout = 0.02, write_timeout = 0.1, stopbits=serial.STOPBITS_ONE)
+    except (OSError, serial.SerialException):
+        return None # ignore the errors that arise from ports that cannot be opened
+
+    try:
+        framer = IBM4_Lib.Reply_Framer()
+        framer.Expect(b'*IDN\r\n', 1)
+        s.write(b'*IDN\r\n')
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            waiting = s.in_waiting
+            framer.Feed( s.read(waiting if waiting > 0 else 1) )
+            for tag, lines in framer.Replies():
+                matching = [line.strip() for line in lines if b'ISBY' in line]
+                return matching[0] if len(matching) > 0 else None
+        return None
+    except (OSError, serial.SerialException):
+        return None
+    finally:
+        s.close()
+
+def FindAllIBM4(vid = IBM4_VID, pids = None, serial_number = None, deadline = 3.0, probe_timeout = 0.5, max_workers = 16, loud = False):
+    """
+    Find every IBM4 attached to the PC
+
+    Ports whose USB metadata matches vid / pids / serial_number are probed first
+    If no port carries matching metadata, e.g. on a platform that does not report it, every port is probed
+    The probes run in parallel and any probe still running when the deadline passes is abandoned
+
+    Inputs:
+    vid, pids, serial_number are the USB filters, see ListCandidates
+    deadline (type: float) is the max. time allowed for the whole search, units of second
+    probe_timeout (type: float) is the time allowed for each *IDN reply, units of second
+    max_workers (type: int) is the max. no. of ports probed at once
+
+    Outputs:
+    found (type: list) contains a dict {"port", "idn", "serial_number"} for each IBM4, ordered by port name
+    """
+
+    FUNC_NAME = ".FindAllIBM4()" # use this in exception handling messages
+    ERR_STATEMENT = "Error: " + MOD_NAME_STR + FUNC_NAME
+
+    try:
+        start = time.monotonic()
+        candidates = ListCandidates(vid, pids, serial_number)
+        if len(candidates) > 0:
+            ports = {info.device:info.serial_number for info in candidates}
+        elif serial_number is None:
+            ports = {name:None for name in ListAllPorts()}
+        else:
+            ports = {} # a specific USB serial number was requested and no port reports it
+
+        found = []
+        if len(ports) == 0:
+            return found
+
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers = min(max_workers, len(ports)))
+        futs = {pool.submit(ProbePort, name, probe_timeout):name for name in ports}
+        done, not_done = concurrent.futures.wait(futs, timeout = max(0.0, deadline - (time.monotonic() - start)))
+        pool.shutdown(wait = False, cancel_futures = True) # abandon the probes that missed the deadline
+
+        for fut in done:
+            idn = fut.result()
+            if loud: print('Trying: ',futs[fut],'->',idn)
+            if idn is not None:
+                found.append({"port":futs[fut], "idn":idn, "serial_number":ports[futs[fut]]})
+        if loud and len(not_done) > 0:
+            print('Search deadline passed before',len(not_done),'ports were probed')
+
+        found.sort(key = lambda item: item["port"])
+        return found
+    except Exception as e:
+        print(ERR_STATEMENT)
+        print(e)
+        return []
@@ -66,13 +66,296 @@ R. Sheehan 11 - 6 - 2024
 from ast import Try
 import os
 import sys
-import glob
 import re
 import serial # this package is actually called pyserial, install using py -m pip install pyserial
 import time
 import numpy
 import Sweep_Interval
-import subprocess
+import IBM4_Parse
+import IBM4_Reader
+import IBM4_Discovery
+import IBM4_Registry
+import IBM4_Metrics
+import IBM4_Acquire
+import IBM4_Sweep
+import IBM4_Stats
+import collections
+import concurrent.futures
+import threading
+
+# The IBM4 echoes every command line that it receives and then prints the result of the command
+# The old approach of draining the echo using read_until(size=cmd.__sizeof__()) used the size of the python str object
+# rather than the no. of bytes in the command, so each read relied on the terminator or the timeout to stop
+# Any reply that did not fit the expected pattern left bytes behind that were swallowed by the next command, 
+# or caused a full read_timeout stall
+# Reply_Framer treats each reply as a frame: the echo line followed by a known no. of result lines, each terminated by \r\n
+# Lines that arrive ahead of the expected echo are left over from an earlier command and are discarded
+
+class Reply_Framer(object):
+    """
+    class for splitting the bytes received from an IBM4 into command replies
+    """
+
+    def __init__(self):
+        """
+        Constructor for the Reply_Framer object
+        """
+
+        self.buffer = bytearray() # bytes received that do not yet form a complete line
+        self.pending = collections.deque() # replies that are expected, in the order that their commands were written
+        self.discarded = 0 # no. of stale lines that have been discarded while looking for an echo
+        self.lock = threading.Lock() # the framer is shared between the caller and the reader thread when one is running
+        self.metrics = None # IBM4_Metrics.Cmd_Metrics, when set each reply carries a timing record
+        self.t_feed = 0.0 # time.perf_counter() value of the last Feed, only kept while metrics are enabled
+
+    def Expect(self, cmd, no_lines = 1, tag = None):
+        """
+        Register that a reply to a command is expected
+        Must be called before the command is written so that the reply cannot arrive before it is expected
+
+        cmd (type: bytes) is the command written to the IBM4, including the terminating \r\n
+        no_lines (type: int) is the no. of result lines that the IBM4 prints after the echo of cmd
+        tag is handed back with the completed reply so that the caller can match the reply to its request
+        """
+
+        # each entry is [echo, no. result lines, tag, result lines, timing], result lines is None until the echo has been seen
+        # timing is None unless metrics are enabled, see IBM4_Metrics.Cmd_Metrics
+        timing = None if self.metrics is None else [time.perf_counter(), 0.0, 0.0, 0.0, len(cmd)]
+        with self.lock:
+            self.pending.append([cmd.strip(), no_lines, tag, None, timing])
+
+    def MarkWritten(self):
+        """
+        Record that the commands expected so far have been written, only needed while metrics are enabled
+        """
+
+        now = time.perf_counter()
+        with self.lock:
+            for entry in self.pending:
+                if entry[4] is not None and entry[4][1] == 0.0:
+                    entry[4][1] = now
+
+    def Feed(self, data):
+        """
+        Append bytes received from the IBM4 to the buffer
+        """
+
+        with self.lock:
+            self.buffer += data
+            if self.metrics is not None and len(data) > 0:
+                self.t_feed = time.perf_counter()
+                # the first result byte of the reply in progress arrives in this chunk
+                if len(self.pending) > 0 and self.pending[0][3] is not None and self.pending[0][4] is not None and self.pending[0][4][3] == 0.0:
+                    self.pending[0][4][3] = self.t_feed
+
+    def Replies(self):
+        """
+        Generator that yields (tag, lines) for every reply that has been completed by the bytes fed so far
+        lines (type: list) contains the result lines of the reply as bytes, without their line terminators
+        """
+
+        while True:
+            with self.lock:
+                reply = self._NextReply()
+            if reply is None:
+                return
+            yield reply
+
+    def _NextReply(self):
+        """
+        Consume buffered lines until the next expected reply is complete, returns None if more bytes are needed
+        """
+
+        while True:
+            end = self.buffer.find(b'\n')
+            if end < 0:
+                return None # no complete line in the buffer
+            line = bytes(self.buffer[:end]).rstrip(b'\r')
+            del self.buffer[:end+1]
+
+            if len(self.pending) == 0:
+                self.discarded = self.discarded + 1 # nothing is expected, the line is stale
+                continue
+
+            entry = self.pending[0]
+            if entry[3] is None:
+                if line.strip().endswith(entry[0]):
+                    entry[3] = [] # echo found, result lines follow
+                    if entry[4] is not None:
+                        entry[4][2] = self.t_feed
+                        if len(self.buffer) > 0:
+                            entry[4][3] = self.t_feed # result bytes arrived with the echo
+                else:
+                    self.discarded = self.discarded + 1 # line left over from an earlier command
+                    continue
+            else:
+                entry[3].append(line)
+
+            if len(entry[3]) >= entry[1]:
+                self.pending.popleft()
+                if entry[4] is not None and self.metrics is not None:
+                    self.metrics.Complete(entry[0], entry[4], entry[3], self.t_feed)
+                return (entry[2], entry[3])
+
+    def Clear(self):
+        """
+        Forget all expected replies and any partially received line
+        """
+
+        with self.lock:
+            self._ClearLocked()
+
+    def _ClearLocked(self):
+        """
+        Clear the framer, the caller must hold lock
+
+        Outputs:
+        abandoned (type: list) contains the entries of the replies that were still expected
+        """
+
+        abandoned = list(self.pending)
+        if self.metrics is not None:
+            for entry in abandoned:
+                if entry[4] is not None:
+                    self.metrics.Abandoned(entry[0], entry[4])
+        self.buffer.clear()
+        self.pending.clear()
+        return abandoned
+
+# Sending one command and waiting for its full reply before sending the next costs one USB round trip per command
+# The IBM4 processes its input line by line, so commands can be written back-to-back and 
+# their replies will come back in the same order that the commands were written
+# Cmd_Pipeline keeps up to depth commands outstanding and hands each reply to a future in FIFO order
+
+class Cmd_Pipeline(object):
+    """
+    class for writing a queue of commands to an IBM4 back-to-back and matching the replies in FIFO order
+    """
+
+    def __init__(self, the_dev, depth = 16):
+        """
+        Constructor for the Cmd_Pipeline object
+
+        the_dev (type: Ser_Iface) is the open IBM4 that the commands are written to
+        depth (type: int) is the max. no. of commands outstanding on the IBM4 at any one time
+        depth is bounded so that the input buffer on the IBM4 cannot overflow
+        """
+
+        self.dev = the_dev
+        self.depth = max(1, depth)
+        self.queued = collections.deque() # [cmd, no_lines, future, parser] waiting to be written
+
+    def Queue(self, cmd, no_lines = None, parser = None):
+        """
+        Add a command to the pipeline, nothing is written until Execute is called
+
+        cmd (type: bytes) is the command including the terminating \r\n
+        no_lines (type: int) is the no. of result lines expected after the echo, default is taken from Reply_Lines
+        parser is an optional callable applied to the list of result lines, its return value becomes the result of the future
+
+        Outputs:
+        fut (type: concurrent.futures.Future) resolves to the reply of cmd once Execute has read it
+        """
+
+        if no_lines is None:
+            no_lines = self.dev.Reply_Lines.get(cmd.strip(), 1)
+        fut = concurrent.futures.Future()
+        self.queued.append([cmd, no_lines, fut, parser])
+        return fut
+
+    def Execute(self, timeout = None):
+        """
+        Write the queued commands and read back all of their replies
+
+        timeout (type: float) is the time allowed for each reply to arrive, default is read_timeout, units of second
+
+        Outputs:
+        results (type: list) contains the result of each queued command in the order they were queued
+        """
+
+        futures = [item[2] for item in self.queued]
+        inflight = collections.deque() # futures whose commands have been written
+        try:
+            while len(self.queued) > 0 or len(inflight) > 0:
+                # top up the commands outstanding on the IBM4 and send them in a single write
+                batch = bytearray()
+                while len(self.queued) > 0 and len(inflight) < self.depth:
+                    cmd, no_lines, fut, parser = self.queued.popleft()
+                    self.dev.framer.Expect(cmd, no_lines, (fut, parser))
+                    inflight.append(fut)
+                    batch += cmd
+                if len(batch) > 0:
+                    self.dev.instr_obj.write(batch)
+                    if self.dev.framer.metrics is not None:
+                        self.dev.framer.MarkWritten()
+
+                for (fut, parser), lines in self.dev._ReadReplies(1, timeout):
+                    inflight.popleft()
+                    try:
+                        fut.set_result(parser(lines) if parser is not None else lines)
+                    except Exception as e:
+                        fut.set_exception(e)
+        except Exception as e:
+            # replies that can no longer be matched, fail every future that has not completed
+            for fut in list(inflight) + [item[2] for item in self.queued]:
+                fut.set_exception(e)
+            inflight.clear()
+            self.queued.clear()
+            raise
+
+        return [fut.result() for fut in futures]
+
+# Every call to a Ser_Iface method rebuilds its error statement, checks isOpen(), validates the channel and value,
+# %-formats the command and encodes it as bytes, in tight control loops that overhead is measurable
+# A Prepared_Cmd holds the result of that work so that the command can be executed repeatedly with minimal per-call work
+
+class Prepared_Cmd(object):
+    """
+    class for a validated IBM4 command that can be executed repeatedly
+    """
+
+    def __init__(self, the_dev, cmd, no_lines = 1, parser = None, clears_zero = False):
+        """
+        Constructor for the Prepared_Cmd object, use the Ser_Iface Prepare methods rather than calling this directly
+
+        the_dev (type: Ser_Iface) is the open IBM4 that the command is written to
+        cmd (type: bytes) is the command including the terminating \r\n
+        no_lines (type: int) is the no. of result lines expected after the echo
+        parser is an optional callable applied to the list of result lines
+        clears_zero (type: bool) is True when the command sets a non-zero output on the IBM4
+        """
+
+        self.dev = the_dev
+        self.cmd = cmd
+        self.no_lines = no_lines
+        self.parser = parser
+        self.clears_zero = clears_zero
+
+    def Execute(self):
+        """
+        Write the command and read back its reply, no validation is performed
+
+        Outputs:
+        res is the value returned by the parser, None if the command has no parser
+        """
+
+        dev = self.dev
+        if self.clears_zero:
+            dev.zeroed = False
+        dev.framer.Expect(self.cmd, self.no_lines)
+        dev.instr_obj.write(self.cmd)
+        if dev.framer.metrics is not None:
+            dev.framer.MarkWritten()
+        lines = dev._ReadReplies(1)[0][1]
+        return self.parser(lines) if self.parser is not None else None
+
+# Ports whose IBM4 was left with all outputs grounded when its Ser_Iface was closed by this process
+# key is the port name, value is (USB serial number of the IBM4, read mode that the IBM4 was left in)
+# OpenComms(fast_open = True) uses this to skip the zeroing transaction when the same IBM4 is re-opened,
+# the serial number now reported at the port must match, so a different IBM4 on the same port is always zeroed
+# and an IBM4 that does not report a serial number is always zeroed
+# Entries are only valid while the IBM4 stays attached, it powers up with arbitrary output values
+KNOWN_ZEROED = {}
 
 # define the class for interfacing to an IBM4
 
@@ -86,16 +369,25 @@ class Ser_Iface(object):
     # constructor
     # opens a serial link to a known serial port      
     # define default arguments inside
-    def __init__(self, port_name = None, read_mode = 'DC'):
+    def __init__(self, port_name = None, read_mode = 'DC', fast_open = False, instr_obj = None, device_name = None):
         """
         Constructor for the IBM4 Serial Interface
         
         port_name is the name of the COM port to which the IBM4 is attached
         port_name = None => PC will search for 1st available IBM4
         
+        device_name is the name assigned to an IBM4 in the per-user IBM4_Registry, 
+        when it is given and port_name = None the PC will search for the IBM4 with that name
+        
         read_mode is the reading mode of the IBM4 
         read_mode = 'DC' =>  IBM4 assumes analog inputs in the range [0, 3.3)
         read_mode = 'AC' =>  IBM4 assumes analog inputs in the range [-8, +8]
+        
+        fast_open = True => set the mode and zero the outputs in a single batched transaction, 
+        skipped entirely if this process left the IBM4 zeroed in the same mode when it was last closed
+        
+        instr_obj is an optional port object that is already open and behaves like serial.Serial, 
+        e.g. one returned by serial.serial_for_url, when it is given port_name is taken from instr_obj.name
         """        
         try:
             self.MOD_NAME_STR = "IBM4_Lib"
@@ -112,6 +404,9 @@ class Ser_Iface(object):
             
             # Dictionary for Accessing the Different Read Types
             self.Read_Types = {"Single Binary":0, "Multiple Binary":1, "Single Voltage":2, "Multiple Voltage":3, "Average Voltage":4}
+            
+            # numpy record type with one field per analog input channel, allows a scan to be indexed by channel name, e.g. scan['A3']
+            self.Read_Dtype = numpy.dtype( [(k, numpy.float64) for k in self.Read_Chnnls] )
 
             # Voltage Bounding Values
             self.VMAX = 3.3 # Max output voltage from IBM4
@@ -121,17 +416,35 @@ class Ser_Iface(object):
             # # parameters to be passed to the serial open command
             self.baud_rate = 9600 # serial comms baud_rate
             self.read_timeout = 3 # timeout for reading data from the IBM4, units of second
+            self.sample_timeout = 1.0e-3 # additional read timeout allowed per sample requested, units of second, see _ReadTimeout
+            self.MAX_CHUNK = 9999 # largest no. of samples that the IBM4 returns for a single read command
             self.write_timeout = 0.5 # timeout for writing data to the IBM4, units of second
+            self.poll_timeout = 0.05 # longest time that a single read of the port may block, units of second, the reply deadline is set by read_timeout
             self.instr_obj = None # assign a default argument to the instrument object
+            self.read_mode = read_mode # reading mode that was last set on the IBM4
+            self.zeroed = False # True when all analog and PWM outputs are known to be grounded
+            self.open_time = 0.0 # time taken by OpenComms, units of second
+            
+            # Reply framing, the IBM4 prints one result line after the echo of most commands
+            # Reply_Lines lists the commands whose reply does not follow that pattern
+            self.Reply_Lines = {b'a0':0, b'b0':0, b'l':2}
+            self.framer = Reply_Framer()
+            self.reader = None # background Reader_Thread, see StartReader
+            self.metrics = None # per-command latency histograms, see EnableMetrics
+            self.last_sweep = None # IBM4_Sweep.Sweep_Engine of the last sweep, holds the settle time at each step
+            self.device_key = None # identity of the IBM4, see Identity
             
             # identify the port name
-            if port_name is not None:
+            if instr_obj is not None:
+                self.instr_obj = instr_obj # use the port object that has been supplied
+                self.IBM4Port = instr_obj.name
+            elif port_name is not None:
                 self.IBM4Port = port_name # string containing the port no. of the device
             else:
-                self.FindIBM4() # find the IBM4 port attached to the PC
+                self.FindIBM4(name = device_name) # find the IBM4 port attached to the PC
             
             # open the serial comms link to port_name
-            self.OpenComms(read_mode)
+            self.OpenComms(read_mode, fast_open)
         except TypeError as e:
             print(self.ERR_STATEMENT)
             print(e)
@@ -149,7 +462,11 @@ class Ser_Iface(object):
         if self.IBM4Port != '' and self.instr_obj.isOpen():
             # close the link to the instrument object when it goes out of scope
             print('Closing Serial link with:',self.instr_obj.name)
-            self.ZeroIBM4()
+            self.StopReader()
+            if not self.zeroed:
+                self.ZeroIBM4()
+            if self.zeroed:
+                KNOWN_ZEROED[self.IBM4Port] = (IBM4_Registry.PortSerialNumber(self.IBM4Port), self.read_mode) # record that the IBM4 has been left grounded
             self.instr_obj.close()
         else:
             # Do nothing, no link to IBM4 established
@@ -198,9 +515,16 @@ class Ser_Iface(object):
             if loud: print('Communication with: IBM4 is not open')
             return False
             
-    def OpenComms(self, read_mode = 'DC'):
+    def OpenComms(self, read_mode = 'DC', fast_open = False):
         """
         open a serial link to a COM port attached to an IBM4
+        
+        fast_open = True => the mode command and the zeroing commands are written as one batched transaction
+        and are skipped if this process left the IBM4 grounded in read_mode when it was last closed, 
+        the IBM4 is identified by its port and USB serial number, see KNOWN_ZEROED
+        
+        Outputs:
+        open_time (type: float) is the time taken to open the link, units of second
         """
         
         self.FUNC_NAME = ".OpenComms()" # use this in exception handling messages
@@ -208,17 +532,33 @@ class Ser_Iface(object):
 
         try:
             if self.IBM4Port is not None:
-                # open a serial link to a device
-                self.instr_obj = serial.Serial(self.IBM4Port, self.baud_rate, timeout = self.read_timeout, write_timeout = self.write_timeout, stopbits=serial.STOPBITS_ONE)
+                start = time.perf_counter()
+                
+                # open a serial link to a device, unless an open port object was supplied to the constructor
+                if self.instr_obj is None:
+                    self.instr_obj = serial.Serial(self.IBM4Port, self.baud_rate, timeout = self.poll_timeout, write_timeout = self.write_timeout, stopbits=serial.STOPBITS_ONE)
                 
-                # Specify the reading mode for the IBM4
-                self.SetMode(read_mode)
+                if fast_open:
+                    serial_number, known_mode = KNOWN_ZEROED.get(self.IBM4Port, (None, None))
+                    if known_mode == read_mode and read_mode in self.Read_Modes and serial_number is not None and serial_number == IBM4_Registry.PortSerialNumber(self.IBM4Port):
+                        # the same IBM4 was left grounded in this mode when it was last closed, nothing to do
+                        self.read_mode = read_mode
+                        self.zeroed = True
+                    else:
+                        self.SetMode(read_mode, zero = True) # mode and zeroing commands in one transaction
+                else:
+                    # Specify the reading mode for the IBM4
+                    self.SetMode(read_mode)
 
-                # zero the analog and PWM outputs
-                # this is necessary because when the IBM4 is connected the AO are set to arbitrary values
-                self.ZeroIBM4()
+                    # zero the analog and PWM outputs
+                    # this is necessary because when the IBM4 is connected the AO are set to arbitrary values
+                    self.ZeroIBM4()
+                
+                KNOWN_ZEROED.pop(self.IBM4Port, None) # the entry is re-made when the link is closed
+                self.open_time = time.perf_counter() - start
 
                 self.CommsStatus(loud = True)
+                return self.open_time
             else:
                 self.ERR_STATEMENT = self.ERR_STATEMENT + '\nNo IBM4 attached to PC'
                 raise Exception
@@ -236,19 +576,11 @@ class Ser_Iface(object):
 
         try:
             if self.instr_obj.isOpen():
-                 # Set all analog outputs to GND
-                self.instr_obj.write(b'a0\r\n')
-                read_result = self.instr_obj.read_until(size=4) # read_result returned as bytes and clear the input buffer  
-                self.instr_obj.write(b'b0\r\n')
-                read_result = self.instr_obj.read_until(size=4) # read_result returned as bytes and clear the input buffer  
-                #self.instr_obj.write(b'PWM9:0\r\n')
-                # Set all PWM outputs to GND
-                # PWM pins 5, 7, 9, 10, 11, 12, 13                
-                for k, v in self.PWM_Chnnls.items():
-                    PWM_cmd = 'PWM%(v1)d:0\r\n'%{"v1":v}
-                    self.instr_obj.write( str.encode( PWM_cmd ) )
-                    read_result = self.instr_obj.read_until(size=PWM_cmd.__sizeof__()) # read_result returned as bytes and clear the input buffer  
-                    read_result = self.instr_obj.read_until(b'\n', size=None) # read_result returned as bytes and clear the input buffer
+                # all of the zeroing commands are written back-to-back in a single transaction
+                pipe = self.Pipeline()
+                self._QueueZero(pipe)
+                pipe.Execute()
+                self.zeroed = True
             else:
                 # Do nothing, no link to IBM4 established
                 pass
@@ -256,6 +588,20 @@ class Ser_Iface(object):
             print(self.ERR_STATEMENT)
             print(e)
             
+    def _QueueZero(self, pipe):
+        """
+        Queue the commands that ground the analog and PWM outputs of the IBM4 onto a Cmd_Pipeline
+        """
+        
+        # Set all analog outputs to GND
+        pipe.Queue(b'a0\r\n') # a0, b0 are echoed but print no result line, see Reply_Lines
+        pipe.Queue(b'b0\r\n')
+        # Set all PWM outputs to GND
+        # PWM pins 5, 7, 9, 10, 11, 12, 13
+        for k, v in self.PWM_Chnnls.items():
+            PWM_cmd = 'PWM%(v1)d:0\r\n'%{"v1":v}
+            pipe.Queue( str.encode( PWM_cmd ) )
+            
     def IdentifyIBM4(self):
         
         """
@@ -267,9 +613,7 @@ class Ser_Iface(object):
 
         try:
             if self.instr_obj.isOpen():
-                self.instr_obj.write(b'*IDN\r\n')
-                response = self.instr_obj.read_until('\n',size=None)
-                Code=response.rsplit(b'\r\n')
+                Code = self._Transact(b'*IDN\r\n') # list of the result lines that follow the echo
 
                 #return Code[1] if len(Code) > 1 else None
 
@@ -294,86 +638,422 @@ class Ser_Iface(object):
         except Exception as e:
             print(self.ERR_STATEMENT)
             print(e)
+    
+    def Identity(self):
+        
+        """
+        Return the identity of the IBM4, i.e. IBM4_Registry.Device_Registry.Key(idn, serial_number, port)
+        The identity is stored in the sweep metadata so that a checkpoint is only resumed on the IBM4 that saved it
+        it is obtained with *IDN the first time it is needed, None if the IBM4 does not respond
+        """
+        
+        if self.device_key is None:
+            func_name, err_statement = self.FUNC_NAME, self.ERR_STATEMENT # IdentifyIBM4 must not replace the error message of the caller
+            idn = self.IdentifyIBM4()
+            self.FUNC_NAME, self.ERR_STATEMENT = func_name, err_statement
+            if idn is not None:
+                self.device_key = IBM4_Registry.Device_Registry.Key(idn, IBM4_Registry.PortSerialNumber(self.IBM4Port), self.IBM4Port)
+        return self.device_key
            
-    def FindIBM4(self, loud = False):
+    def FindIBM4(self, loud = False, name = None):
+        """
+        Looks for an IBM4 attached to the PC
+        The ports held in the per-user IBM4_Registry are validated with a single *IDN first,
+        otherwise the ports are searched in parallel by IBM4_Discovery.FindAllIBM4 and the IBM4s found are registered
+        Once a port is found, IBM4Port is set to the port name, IBM4Port = None if no IBM4 is found
+        
+        name (type: str) is the name assigned to an IBM4 using IBM4_Registry.Device_Registry.Name, None => any IBM4
+        FHP 30 - 5 - 2024
+        """
+    
+        self.FUNC_NAME = self.FUNC_NAME + ".FindIBM4()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+    
+        try:
+            registry = IBM4_Registry.Device_Registry()
+            self.IBM4Port = registry.Locate(name = name, loud = loud)
+            
+            if self.IBM4Port is not None:
+                if loud: print(f'IBM4 found at {self.IBM4Port}')
+            elif name is not None:
+                self.ERR_STATEMENT = self.ERR_STATEMENT + '\nNo IBM4 named ' + name + ' is attached to PC'
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+            
+    # protected methods for exchanging framed commands and replies with the IBM4
+
+    def _Transact(self, cmd, no_lines = None, timeout = None):
+        """
+        Write a command to the IBM4 and read back its reply
+
+        Inputs:
+        cmd (type: bytes) is the command including the terminating \r\n
+        no_lines (type: int) is the no. of result lines expected after the echo, default is taken from Reply_Lines
+        timeout (type: float) is the time allowed for the full reply to arrive, default is read_timeout, units of second
+
+        Outputs:
+        lines (type: list) contains the result lines of the reply as bytes
+        """
+
+        if no_lines is None:
+            no_lines = self.Reply_Lines.get(cmd.strip(), 1)
+        self.framer.Expect(cmd, no_lines) # register the reply before writing so it cannot be missed
+        self.instr_obj.write(cmd)
+        if self.framer.metrics is not None:
+            self.framer.MarkWritten()
+        return self._ReadReplies(1, timeout)[0][1]
+
+    def _ReadReplies(self, no_replies = 1, timeout = None):
+        """
+        Read from the port until no_replies expected replies have been completed
+
+        Only the bytes that are already waiting are read, or a single byte if none are waiting, 
+        so the read never waits for bytes beyond the end of the expected replies
+        If the deadline passes the expected replies are abandoned and the input buffer is cleared
+
+        Outputs:
+        replies (type: list) contains (tag, lines) for each completed reply, in the order the commands were written
+        """
+
+        deadline = time.monotonic() + (self.read_timeout if timeout is None else timeout)
+        if self.reader is not None:
+            return self.reader.WaitReplies(no_replies, deadline) # the reader thread owns the port reads
+        replies = []
+        while True:
+            replies.extend( self.framer.Replies() )
+            if len(replies) >= no_replies:
+                return replies
+            if time.monotonic() > deadline:
+                self.framer.Clear()
+                self.instr_obj.reset_input_buffer()
+                raise TimeoutError('IBM4 reply not received within %(v1)0.2f s'%{"v1":self.read_timeout if timeout is None else timeout})
+            waiting = self.instr_obj.in_waiting
+            self.framer.Feed( self.instr_obj.read(waiting if waiting > 0 else 1) ) # read(1) blocks for at most poll_timeout
+
+    def _ReadTimeout(self, no_samples):
+        """
+        Return the time allowed for a reply containing no_samples samples, the fixed read_timeout is extended by sample_timeout per sample
+        """
+
+        return self.read_timeout + no_samples * self.sample_timeout
+
+    def _LastFloat(self, lines):
+        """
+        Parse the last numeric value of a reply as a float
+        """
+
+        return float( re.findall(r'[-+]?\d+[\.]?\d*', str(lines[-1]) )[-1] )
+
+    def EnableMetrics(self):
+        """
+        Start recording the latency, bytes moved and timeouts of every command in per-command histograms
+        The recorded values are available from the metrics attribute, e.g. the_dev.metrics.Print() or the_dev.metrics.Summary()
+        
+        Outputs:
+        metrics (type: IBM4_Metrics.Cmd_Metrics) is the object that holds the recorded values
+        """
+        
+        if self.metrics is None:
+            self.metrics = IBM4_Metrics.Cmd_Metrics()
+        self.framer.metrics = self.metrics
+        return self.metrics
+        
+    def DisableMetrics(self):
+        """
+        Stop recording command metrics, the values recorded so far are kept in the metrics attribute
+        """
+        
+        self.framer.metrics = None
+
+    def Stream(self, input_channel, chunk_size = 1000, binary = False, depth = 2, max_chunks = None):
+        """
+        Continuous acquisition from a single analog input, see IBM4_Acquire.Stream_Acquire
+        
+        Inputs:
+        input_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
+        chunk_size (type: int) is the no. of samples in each chunk, in the range [1, 10000)
+        binary = True => integer samples, binary = False => voltage samples
+        depth (type: int) is the max. no. of bursts outstanding on the IBM4 at any one time
+        max_chunks (type: int) is the no. of chunks after which the stream stops, None => stream until the loop is broken
+        
+        Outputs:
+        stream (type: IBM4_Acquire.Stream_Acquire) yields each chunk as a numpy array when iterated, stream.Stats() gives the 
+        achieved sample rate and the gaps between chunks
+        """
+        
+        return IBM4_Acquire.Stream_Acquire(self, input_channel, chunk_size, binary, depth, max_chunks)
+
+    def StartReader(self, ring_size = 1000000, depth = 4):
+        """
+        Start a background thread that continuously drains the serial port
+        
+        While the reader is running every command still works as normal, the replies are collected by the reader thread
+        Samples requested with RequestSamples are parsed by the reader thread into a preallocated ring buffer of 
+        timestamped samples and are collected with ReadSamples
+        
+        ring_size (type: int) is the no. of samples held by the ring buffer
+        depth (type: int) is the max. no. of RequestSamples commands outstanding on the IBM4 at any one time
+        """
+        
+        self.FUNC_NAME = ".StartReader()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            if self.instr_obj.isOpen() and self.reader is None:
+                self.reader = IBM4_Reader.Reader_Thread(self, ring_size, depth)
+                self.reader.start()
+            else:
+                self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not start reader\nNo comms established or reader already running'
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+            
+    def StopReader(self):
+        """
+        Stop the background reader thread, samples still in the ring buffer are discarded
+        """
+        
+        if self.reader is not None:
+            self.reader.Stop()
+            self.reader = None
+            
+    def RequestSamples(self, input_channel, no_reads = 1000, binary = False):
+        """
+        Ask the IBM4 for no_reads samples from input_channel, the samples are stored in the reader ring buffer
+        The method returns as soon as the command has been written, unless depth requests are already outstanding
+        
+        Inputs:
+        input_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
+        no_reads (type: int) is the num. of readings to be taken
+        binary = True => BRead%d:%d is used and the samples are integers
+        """
+        
+        self.FUNC_NAME = ".RequestSamples()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            c1 = True if self.reader is not None else False # confirm that the reader is running
+            c2 = True if input_channel in self.Read_Chnnls else False # confirm that the input channel label is correct
+            c3 = True if no_reads > 0 and no_reads < 10000 else False # confirm that no. reads being taken is a sensible value
+            
+            c10 = c1 and c2 and c3 # if all conditions are true then read can proceed
+            
+            if c10:
+                read_cmd = '%(v0)s%(v1)d:%(v2)d\r\n'%{"v0":'BRead' if binary else 'Read', "v1":self.Read_Chnnls[input_channel], "v2":no_reads} # generate the read command
+                if not self.reader.slots.acquire( timeout = self.read_timeout ):
+                    raise TimeoutError('Outstanding sample requests have not completed')
+                self.framer.Expect( str.encode(read_cmd), 1, IBM4_Reader.Sample_Request(no_reads, binary) )
+                self.instr_obj.write( str.encode(read_cmd) )
+                if self.framer.metrics is not None:
+                    self.framer.MarkWritten()
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nReader is not running, call StartReader'
+                if not c2:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A2, A3, A4, A5, D2}'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads outside range [1, 9999]'
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+            
+    def ReadSamples(self, max_n = None):
+        """
+        Collect the samples that the reader thread has stored in the ring buffer
+        
+        Outputs:
+        res (type: numpy structured array) has fields 't' (time.monotonic() at which the reply arrived) and 'v' (sample value)
+        """
+        
+        return self.reader.ring.Pop(max_n) if self.reader is not None else None
+            
+    # methods for preparing commands that are executed repeatedly
+
+    def PrepareWriteVoltage(self, output_channel, set_voltage = 0.0):
+        """
+        Validate a WriteVoltage command once and return it as a Prepared_Cmd
+        cmd.Execute() then performs the write with no further validation
+        
+        Inputs: 
+        output_channel is one of A0, A1
+        set_voltage must be in the range [0.0, 3.3]
+        """
+
+        self.FUNC_NAME = ".PrepareWriteVoltage()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
+            c2 = True if output_channel in self.Write_Chnnls else False # confirm that the output channel label is correct
+            c3 = True if set_voltage >= self.VMIN and set_voltage < self.VMAX or abs(set_voltage - self.VMAX) < self.DELTA_VMIN else False # confirm that the set voltage value is in range
+            c10 = c1 and c2 and c3 # if all conditions are true then write can proceed
+        
+            if c10:
+                write_cmd = 'Write%(v1)d:%(v2)0.2f\r\n'%{"v1":self.Write_Chnnls[output_channel], "v2":set_voltage}
+                return Prepared_Cmd(self, str.encode(write_cmd), clears_zero = set_voltage != 0)
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
+                if not c2:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\noutput_channel outside range {A0, A1}'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nset_voltage %(v1)0.3f outside range [0.0, 3.3]'%{"v1":set_voltage}
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+            
+    def PrepareWritePWM(self, pinOut, percentage):
+        """
+        Validate a WriteAnyPWM command once and return it as a Prepared_Cmd
+        
+        Inputs: 
+        pinOut (type: str) is one of the labels for the PWM output channels 'D0', 'D1', 'D7', 'D9', 'D10'-'D13'
+        percentage (type: float) must be in the range [0.0, 100]
+        """
+
+        self.FUNC_NAME = ".PrepareWritePWM()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
+            c3 = True if percentage >= 0 and percentage < 101 else False # confirm that PWM percentage is a sensible value
+            c4 = True if pinOut in self.PWM_Chnnls else False # confirm that the pintOut channel label is correct
+        
+            c10 = c1 and c3 and c4 # if all conditions are true then write can proceed
+            if c10:
+                write_cmd = 'PWM%(v1)d:%(v2)d\r\n'%{"v1":self.PWM_Chnnls[pinOut], "v2":percentage}
+                return Prepared_Cmd(self, str.encode(write_cmd), clears_zero = percentage != 0)
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\npercentage outside range [0, 100]'
+                if not c4:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\npinOut is not a PWM channel'
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def PrepareRead(self, input_channel, read_type = 'Single Voltage', no_reads = 10):
+        """
+        Validate a read command once and return it as a Prepared_Cmd
+        cmd.Execute() returns the same value as the corresponding read method, 
+        except that 'Multiple Voltage' returns only the numpy array of readings
+        
+        Inputs:
+        input_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
+        read_type is one of the keys of Read_Types
+        no_reads (type: int) is the num. of readings for the multiple and average read types
+        """
+
+        self.FUNC_NAME = ".PrepareRead()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
+            c2 = True if input_channel in self.Read_Chnnls else False # confirm that the input channel label is correct
+            c3 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c4 = True if read_type in self.Read_Types else False # confirm that the read_type has been chosen correctly
+        
+            c10 = c1 and c2 and c3 and c4 # if all conditions are true then read can proceed
+            
+            if c10:
+                # command name, no. of reads and parser for each read type
+                cmd_name, n, parser = {
+                    'Single Voltage':('Read', 1, self._LastFloat),
+                    'Single Binary':('BRead', 1, lambda lines: int( IBM4_Parse.ParseInts(lines[-1])[-1] )),
+                    'Average Voltage':('Average', no_reads, self._LastFloat),
+                    'Multiple Voltage':('Read', no_reads, lambda lines: IBM4_Parse.ParseFloats(lines[-1], no_reads)),
+                    'Multiple Binary':('BRead', no_reads, lambda lines: IBM4_Parse.ParseInts(lines[-1], no_reads))}[read_type]
+                read_cmd = '%(v0)s%(v1)d:%(v2)d\r\n'%{"v0":cmd_name, "v1":self.Read_Chnnls[input_channel], "v2":n} # generate the read command
+                return Prepared_Cmd(self, str.encode(read_cmd), parser = parser)
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nNo comms established'
+                if not c2:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A2, A3, A4, A5, D2}'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads outside range [3, 10001]'
+                if not c4:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nread_type incorrectly specified'
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def PrepareDiffRead(self, pos_channel, neg_channel, read_type = 'Single Voltage', no_reads = 10):
         """
-        Goes through all listed serial ports looking for an IBM4
-        Once a port is found, return the port name
-        FHP 30 - 5 - 2024
+        Validate a differential read command once and return it as a Prepared_Cmd
+        cmd.Execute() returns the same value as the corresponding differential read method, 
+        except that 'Multiple Voltage' returns only the numpy array of readings
+        
+        Inputs:
+        pos_channel, neg_channel (type: str) are different labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
+        read_type is one of 'Single Voltage', 'Single Binary', 'Average Voltage', 'Multiple Voltage', 'Multiple Binary'
+        no_reads (type: int) is the num. of readings for the multiple and average read types
         """
-    
-        self.FUNC_NAME = self.FUNC_NAME + ".FindIBM4()" # use this in exception handling messages
+
+        self.FUNC_NAME = ".PrepareDiffRead()" # use this in exception handling messages
         self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
-    
+
         try:
-            if sys.platform.startswith('win'):
-                ports = ['COM%s'%(i+1) for i in range(256)]
-            elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-                # this excludes your current terminal "/dev/tty"
-                ports = glob.glob('/dev/tty[A-Za-z]*')
-            elif sys.platform.startswith('darwin'):
-                ports = glob.glob('/dev/tty.*')
+            c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
+            c2 = True if pos_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
+            c3 = True if neg_channel in self.Read_Chnnls else False # confirm that the negative channel label is correct
+            c4 = True if neg_channel != pos_channel else False # confirm that the channels are different
+            c5 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c6 = True if read_type in self.Read_Types else False # confirm that the read_type has been chosen correctly
+        
+            c10 = c1 and c2 and c3 and c4 and c5 and c6 # if all conditions are true then read can proceed
+            
+            if c10:
+                # command name, no. of reads and parser for each read type
+                cmd_name, n, parser = {
+                    'Single Voltage':('Diff_Read', 1, self._LastFloat),
+                    'Single Binary':('Diff_BRead', 1, lambda lines: int( IBM4_Parse.ParseInts(lines[-1])[-1] )),
+                    'Average Voltage':('Diff_Average', no_reads, self._LastFloat),
+                    'Multiple Voltage':('Diff_Read', no_reads, lambda lines: IBM4_Parse.ParseFloats(lines[-1], no_reads)),
+                    'Multiple Binary':('Diff_BRead', no_reads, lambda lines: IBM4_Parse.ParseInts(lines[-1], no_reads))}[read_type]
+                read_cmd = '%(v0)s%(v1)d:%(v2)d:%(v3)d\r\n'%{"v0":cmd_name, "v1":self.Read_Chnnls[pos_channel], "v2":self.Read_Chnnls[neg_channel], "v3":n}
+                return Prepared_Cmd(self, str.encode(read_cmd), parser = parser)
             else:
-                self.ERR_STATEMENT = self.ERR_STATEMENT + '\nUnsupported platform'
-                raise EnvironmentError('Unsupported platform')
-        
-            baud_rate = 9600
-
-            path = ".portdata"
-            if os.path.exists(path):
-                if sys.platform.startswith('win'):
-                    subprocess.run(f'attrib -h "{path}"', shell=True)   
-                with open(path, "r") as f:
-                    port = f.read()
-                    #print(f'the saved port is {port}')
-                    ports.insert(0, port)
-            else: 
-                self.IBM4Port = None # assign IBM4Port to None 
-
-            for port in ports:
-                try:
-                    if loud: print('Trying: ',port)
-                    s = serial.Serial(port, baud_rate, timeout = 0.05, write_timeout = 0.1, inter_byte_timeout = 0.1, stopbits=serial.STOPBITS_ONE)
-                    s.write(b'*IDN\r\n')
-                    response = s.read_until('\n',size=None)
-                    Code=response.rsplit(b'\r\n')
-                    if len(Code) > 2:
-                        #if Code[1]==b'ISBY-UCC-RevA.1':
-                        # test to see if Code[1] contains 'ISBY' this is more generic
-                        # will allow for updated rev. no. without necessitating a change in code
-                        # Must encode the test string as bytes because Python 3.X is really pedantic
-                        #print(type('ISBY')) # type str
-                        #print(type(Code[1])) # type bytes
-                        if b'ISBY' in Code[1]:
-                            if loud: print(f'IBM4 found at {port}')
-                            self.IBM4Port = port
-                            s.close()
-                            #save port to hidden file:
-                            path = ".portdata"
-                            if sys.platform.startswith('win'):
-                                if os.path.exists(path):
-                                    subprocess.run(f'attrib -h "{path}"', shell=True)
-                            with open(path, "w") as f:
-                                f.write(port)
-                            #then make file hidden in Windows (already hidden in MacOS)
-                            if sys.platform.startswith('win'):
-                                subprocess.run(["attrib", "+h", path])
-
-                            break # stop the search for an IBM4 at the first one you find   
-                except(OSError, serial.SerialException):
-                    # print("Error:", e)
-                    # Ignore the errors that arise from non-IBM4 serial ports
-                    pass
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nNo comms established'
+                if not c2:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\npos_channel outside range {A2, A3, A4, A5, D2}'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nneg_channel outside range {A2, A3, A4, A5, D2}'
+                if not c4:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\npos_channel cannot be the same as neg_channel'
+                if not c5:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads outside range [3, 10000]'
+                if not c6:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nread_type incorrectly specified'
+                raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
             print(e)
-        except EnvironmentError as e:
-            print(self.ERR_STATEMENT)
-            print(e)
             
+    def Pipeline(self, depth = 16):
+        """
+        Return a Cmd_Pipeline for this IBM4
+        Commands queued on the pipeline are written back-to-back when Execute is called 
+        and the replies are matched to the commands in the order they were queued
+
+        depth (type: int) is the max. no. of commands outstanding on the IBM4 at any one time
+        """
+
+        return Cmd_Pipeline(self, depth)
+
     # methods for writing data to the IBM4
     
-    def SetMode(self, read_mode = 'DC'):
+    def SetMode(self, read_mode = 'DC', zero = False):
         """
         read_mode is the reading mode of the IBM4 
         
@@ -381,6 +1061,7 @@ class Ser_Iface(object):
         read_mode = 'DC' =>  IBM4 assumes analog inputs in the range [0, 3.3)
         read_mode = 'AC' =>  IBM4 assumes analog inputs in the range [-8, +8]
         read_mode = 'AC' requires BP2UP board be used with IBM4
+        zero = True => ground all outputs in the same batched transaction as the mode command
         """
         
         self.FUNC_NAME = ".SetMode()" # use this in exception handling messages
@@ -393,9 +1074,15 @@ class Ser_Iface(object):
             c10 = c1 and c3 # if all conditions are true then write can proceed
             if c10:
                 write_cmd = 'Mode%(v1)d\r\n'%{"v1":self.Read_Modes[read_mode]}
-                self.instr_obj.write( str.encode(write_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=write_cmd.__sizeof__()) # read_result returned as bytes and clear the input buffer 
-                read_result = self.instr_obj.read_until(b'\n', size=None) # read_result returned as bytes and clear the input buffer                  
+                if zero:
+                    pipe = self.Pipeline()
+                    pipe.Queue( str.encode(write_cmd) )
+                    self._QueueZero(pipe)
+                    pipe.Execute()
+                    self.zeroed = True
+                else:
+                    self._Transact( str.encode(write_cmd) ) # when using serial str must be encoded as bytes, _Transact consumes the echo and the result line
+                self.read_mode = read_mode
             else:
                 if not c1:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
@@ -429,9 +1116,8 @@ class Ser_Iface(object):
         
             if c10:
                 write_cmd = 'Write%(v1)d:%(v2)0.2f\r\n'%{"v1":self.Write_Chnnls[output_channel], "v2":set_voltage}
-                self.instr_obj.write( str.encode(write_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=write_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result to clear the input buffer  
+                self.zeroed = self.zeroed and set_voltage == 0 # any non-zero output means the IBM4 is no longer grounded
+                self._Transact( str.encode(write_cmd) ) # when using serial str must be encoded as bytes, _Transact consumes the echo and the result line
             else:
                 if not c1:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
@@ -466,9 +1152,8 @@ class Ser_Iface(object):
             if c10:
                 output_channel = self.PWM_Chnnls["D9"] # when using the IBM4 enhancement board the PWM is fixed to D9
                 write_cmd = 'PWM%(v1)d:%(v2)d\r\n'%{"v1":output_channel, "v2":percentage}
-                self.instr_obj.write( str.encode(write_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=write_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result to clear the input buffer  
+                self.zeroed = self.zeroed and percentage == 0 # any non-zero output means the IBM4 is no longer grounded
+                self._Transact( str.encode(write_cmd) ) # when using serial str must be encoded as bytes, _Transact consumes the echo and the result line
             else:
                 if not c1:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
@@ -505,9 +1190,8 @@ class Ser_Iface(object):
             if c10:
                 output_channel = self.PWM_Chnnls[pinOut] # when using the IBM4 enhancement board the PWM is fixed to D9
                 write_cmd = 'PWM%(v1)d:%(v2)d\r\n'%{"v1":output_channel, "v2":percentage}
-                self.instr_obj.write( str.encode(write_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=write_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result to clear the input buffer  
+                self.zeroed = self.zeroed and percentage == 0 # any non-zero output means the IBM4 is no longer grounded
+                self._Transact( str.encode(write_cmd) ) # when using serial str must be encoded as bytes, _Transact consumes the echo and the result line
             else:
                 if not c1:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
@@ -539,7 +1223,7 @@ class Ser_Iface(object):
         try:
             c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
             c2 = True if input_channel in self.Read_Chnnls else False # confirm that the input channel label is correct
-            c3 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c3 = True if no_reads > 2 else False # confirm that no. averages being taken is a sensible value, large no_reads are split into chunks
             c4 = True if read_type in self.Read_Types else False # confirm that the read_type has been chosen correctly
         
             c10 = c1 and c2 and c3 and c4 # if all conditions are true then write can proceed
@@ -563,7 +1247,7 @@ class Ser_Iface(object):
                 if not c2:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A0, A1}'
                 if not c3:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads outside range [3, 10001]'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
                 if not c4:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nread_type incorrectly specified'
                 raise Exception
@@ -593,7 +1277,7 @@ class Ser_Iface(object):
             c2 = True if pos_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
             c3 = True if neg_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
             c4 = True if neg_channel != pos_channel else False # confirm that the positive channel label is correct
-            c5 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c5 = True if no_reads > 2 else False # confirm that no. averages being taken is a sensible value, large no_reads are split into chunks
         
             c10 = c1 and c2 and c3 and c4 and c5 # if all conditions are true then write can proceed
             
@@ -620,7 +1304,7 @@ class Ser_Iface(object):
                 if not c4:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\npos_channel cannot be the same as neg_channel'
                 if not c5:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_averages outside range [3, 10000]'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
                 raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
@@ -654,9 +1338,7 @@ class Ser_Iface(object):
             if c10:
                 no_reads = 1 # 
                 read_cmd = 'Read%(v1)d:%(v2)d\r\n'%{"v1":self.Read_Chnnls[input_channel], "v2":no_reads} # generate the read command
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes                
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
+                read_result = self._Transact( str.encode(read_cmd) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
                 vals = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list
                 res = float(vals[-1])
                 if loud: 
@@ -698,9 +1380,7 @@ class Ser_Iface(object):
             if c10:
                 no_reads = 1 # 
                 read_cmd = 'BRead%(v1)d:%(v2)d\r\n'%{"v1":self.Read_Chnnls[input_channel], "v2":no_reads} # generate the read command
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes                
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
+                read_result = self._Transact( str.encode(read_cmd) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
                 vals = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list
                 res = int(vals[-1])
                 if loud: 
@@ -722,7 +1402,7 @@ class Ser_Iface(object):
         """        
         This method interfaces with the IBM4 to perform a read operation on a single read channel. The input channel must be between 0 and 3, 
         and the number of readings should be greater than zero. At some point the number of reading will be too high and will cause a timeout error. This should 
-        only happen for numbers larger than 10000. The output will be a single Voltage (floating point) value representing the average of the multiple readings.
+        only happen for numbers larger than 10000, so larger numbers of readings are taken in chunks by ReadChunked. The output will be a single Voltage (floating point) value representing the average of the multiple readings.
         Alternate read operations exist covering binary or floating point, single reading, multiple readings, and an average of multiple readings (floating point only).
             
         Inputs:
@@ -770,15 +1450,15 @@ class Ser_Iface(object):
         try:
             c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
             c2 = True if input_channel in self.Read_Chnnls else False # confirm that the input channel label is correct
-            c3 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c3 = True if no_reads > 2 else False # confirm that no. averages being taken is a sensible value
         
             c10 = c1 and c2 and c3 # if all conditions are true then write can proceed
             
-            if c10:
+            if c10 and no_reads > self.MAX_CHUNK:
+                return self.ReadChunked(input_channel, no_reads, keep_samples = False, loud = loud)[0] # too many readings for a single Average command
+            elif c10:
                 read_cmd = 'Average%(v1)d:%(v2)d\r\n'%{"v1":self.Read_Chnnls[input_channel], "v2":no_reads} # generate the read command
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes                
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
+                read_result = self._Transact( str.encode(read_cmd), timeout = self._ReadTimeout(no_reads) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
                 vals = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list
                 res = float(vals[-1])
                 if loud: 
@@ -791,7 +1471,7 @@ class Ser_Iface(object):
                 if not c2:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A0, A1}'
                 if not c3:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads outside range [3, 10001]'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
                 raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
@@ -820,12 +1500,15 @@ class Ser_Iface(object):
             c10 = c1 and c3 # if all conditions are true then write can proceed
         
             if c10:
-                read_vals = numpy.array([]) # instantiate an empty numpy array
+                # queue one Average command per channel and write them back-to-back
+                # this takes a single round trip rather than one round trip per channel
+                pipe = self.Pipeline()
                 for item in self.Read_Chnnls:
-                    value = self.ReadAverageVoltage(item, no_reads, loud)
-                    read_vals = numpy.append(read_vals, value)
-                    if loud: 
-                        print('Voltages at AI: ',read_vals)
+                    read_cmd = 'Average%(v1)d:%(v2)d\r\n'%{"v1":self.Read_Chnnls[item], "v2":no_reads} # generate the read command
+                    pipe.Queue( str.encode(read_cmd), parser = self._LastFloat )
+                read_vals = numpy.array( pipe.Execute(), dtype = numpy.float64 )
+                if loud: 
+                    print('Voltages at AI: ',read_vals)
                 return read_vals
             else:
                 if not c1:
@@ -837,17 +1520,84 @@ class Ser_Iface(object):
             print(self.ERR_STATEMENT)
             print(e)
             
-    def ReadMultipleVoltage(self, input_channel, no_reads = 10, loud = False):
+    def _ParseScan(self, lines):
+        """
+        Parse the reply to the simple read command l as a numpy array of voltages ordered as Read_Chnnls
+        """
+
+        vals = IBM4_Parse.ParseFloats( b' '.join(lines), len(self.Read_Chnnls) )
+        if len(vals) < len(self.Read_Chnnls):
+            raise ValueError('Simple read reply contains %(v1)d values, expected %(v2)d'%{"v1":len(vals), "v2":len(self.Read_Chnnls)})
+        return vals
+
+    def ReadAllChnnlSnapshot(self, no_repeats = 1, average = True, loud = False):
+    
+        """
+        This method interfaces with the IBM4 to read every analog input channel using the simple read command l
+        The IBM4 returns all of the channels in one reply, so a full scan takes a single round trip, 
+        and the channels are sampled much closer together in time than with one Average command per channel
+        Repeated scans are written back-to-back using a Cmd_Pipeline
+        
+        Inputs: 
+        no_repeats (type: int) is the no. of scans to be made
+        average (type: bool) average = True => return the mean of the scans, average = False => return every scan
+        
+        Outputs: 
+        res (type: numpy structured array) has one field per analog input channel [A2, A3, A4, A5, D2], e.g. res['A3']
+        average = True => res has shape () and holds the channel means
+        average = False => res has shape (no_repeats,) and holds one row per scan
+        """
+        
+        # The simple read method was originally implemented as ReadSimple
+        # It printed the reply rather than returning the values
+        # R. Sheehan 18 - 3 - 2024
+
+        self.FUNC_NAME = ".ReadAllChnnlSnapshot()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
+            c3 = True if no_repeats > 0 and no_repeats < 10000 else False # confirm that no. repeats being taken is a sensible value
+        
+            c10 = c1 and c3 # if all conditions are true then read can proceed
+        
+            if c10:
+                pipe = self.Pipeline()
+                for i in range(0, no_repeats, 1):
+                    pipe.Queue(b'l\r\n', parser = self._ParseScan)
+                scans = numpy.vstack( pipe.Execute() ) # shape (no_repeats, no. channels)
+                
+                if average:
+                    res = numpy.array( tuple( numpy.mean(scans, axis = 0) ), dtype = self.Read_Dtype )
+                else:
+                    res = numpy.empty(no_repeats, dtype = self.Read_Dtype)
+                    for k, v in self.Read_Chnnls.items():
+                        res[k] = scans[:, v]
+                if loud: 
+                    print('Voltages at AI: ',res)
+                return res
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nNo comms established'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_repeats outside range [1, 9999]'
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def ReadMultipleVoltage(self, input_channel, no_reads = 10, loud = False, stats = None):
         
         """
         This method interfaces with the IBM4 to perform a read operation.
-        The number of readings should be greater than zero. At some point the number of reading will be too high and will cause a timeout error. 
-        This should only happen for numbers larger than 10000. The output will be an array of floating point (Voltage) values.
+        The number of readings should be greater than two. The IBM4 returns at most 9999 readings per read command, 
+        larger numbers of readings are split into chunks by ReadChunked. The output will be an array of floating point (Voltage) values.
         Alternate read operations exist covering binary or floating point, single reading, multiple readings, and an average of multiple readings (floating point only).
         
         Inputs:
         input_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
         no_reads (type: int) is the num. of readings that are to be averaged
+        stats (type: IBM4_Stats.Running_Stats) is updated with the readings, e.g. to accumulate statistics over many calls without keeping the readings
         
         Outputs: 
         res (type: list) contains three elements
@@ -862,20 +1612,23 @@ class Ser_Iface(object):
         try:
             c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
             c2 = True if input_channel in self.Read_Chnnls else False # confirm that the input channel label is correct
-            c3 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c3 = True if no_reads > 2 else False # confirm that no. averages being taken is a sensible value
         
             c10 = c1 and c2 and c3 # if all conditions are true then write can proceed
             
-            if c10:
+            if c10 and no_reads > self.MAX_CHUNK:
+                return self.ReadChunked(input_channel, no_reads, loud = loud, stats = stats)[0:3] # too many readings for a single read command
+            elif c10:
                 read_cmd = 'Read%(v1)d:%(v2)d\r\n'%{"v1":self.Read_Chnnls[input_channel], "v2":no_reads} # generate the read command
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes                
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
-                vals_str = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list
-                vals_flt = numpy.float64(vals_str[-no_reads:]) # convert the list of strings to floats using numpy, save as numpy array (better)
+                read_result = self._Transact( str.encode(read_cmd), timeout = self._ReadTimeout(no_reads) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
+                vals_flt = IBM4_Parse.ParseFloats(read_result, no_reads) # parse the last no_reads values of read_result directly from the bytes into a numpy array
+                if len(vals_flt) != no_reads: # a short reply would otherwise be returned without any error
+                    raise ValueError('Reply contains %(v1)d readings, expected %(v2)d'%{"v1":len(vals_flt), "v2":no_reads})
                 vals_mean = numpy.mean(vals_flt) # compute the average of all the diff_reads
                 vals_delta = 0.5*( numpy.max(vals_flt) - numpy.min(vals_flt) ) # compute the range of the diff_read
                 res = [vals_mean, vals_delta, vals_flt]
+                if stats is not None:
+                    stats.Update(vals_flt)
                 if loud: 
                     print(read_result)
                     print(vals_flt) # print the parsed values
@@ -886,22 +1639,23 @@ class Ser_Iface(object):
                 if not c2:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A0, A1}'
                 if not c3:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_averages outside range [3, 10001]'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
                 raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
             print(e)
             
-    def ReadMultipleBinary(self, input_channel, no_reads = 10, loud = False):
+    def ReadMultipleBinary(self, input_channel, no_reads = 10, loud = False, stats = None):
         
         """
-        This VI interfaces with the IBM4 to perform a read operation. The number of readings should be greater than zero. At some point the 
-        number of reading will be too high and will cause a timeout error. This should only happen for numbers larger than 10000. The output will be an array of integer 
+        This VI interfaces with the IBM4 to perform a read operation. The number of readings should be greater than two. The IBM4 returns at most 
+        9999 readings per read command, larger numbers of readings are split into chunks by ReadChunked. The output will be an array of integer 
         values. Alternate read operations exist covering binary or floating point, single reading, multiple readings, and an average of multiple readings (floating point only).
         
         Inputs:
         input_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
         no_reads (type: int) is the num. of readings that are to be averaged
+        stats (type: IBM4_Stats.Running_Stats) is updated with the readings
         
         Outputs: 
         vals_int (type: numpy array) contains binary read values
@@ -913,17 +1667,20 @@ class Ser_Iface(object):
         try:
             c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
             c2 = True if input_channel in self.Read_Chnnls else False # confirm that the input channel label is correct
-            c3 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c3 = True if no_reads > 2 else False # confirm that no. averages being taken is a sensible value
         
             c10 = c1 and c2 and c3 # if all conditions are true then write can proceed
             
-            if c10:
+            if c10 and no_reads > self.MAX_CHUNK:
+                return self.ReadChunked(input_channel, no_reads, binary = True, loud = loud, stats = stats)[2] # too many readings for a single read command
+            elif c10:
                 read_cmd = 'BRead%(v1)d:%(v2)d\r\n'%{"v1":self.Read_Chnnls[input_channel], "v2":no_reads} # generate the read command
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes                
-                # Working
-                read_result = self.instr_obj.read_until('\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                
-                vals_str = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list
-                vals_int = numpy.int_(vals_str[-no_reads:]) # convert the list of strings to ints using numpy, save as numpy array (better)
+                read_result = self._Transact( str.encode(read_cmd), timeout = self._ReadTimeout(no_reads) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
+                vals_int = IBM4_Parse.ParseInts(read_result, no_reads) # parse the last no_reads values of read_result directly from the bytes into a numpy array
+                if len(vals_int) != no_reads: # a short reply would otherwise be returned without any error
+                    raise ValueError('Reply contains %(v1)d readings, expected %(v2)d'%{"v1":len(vals_int), "v2":no_reads})
+                if stats is not None:
+                    stats.Update(vals_int)
                 if loud: 
                     print(read_result)
                     print(vals_int) # print the parsed values
@@ -934,12 +1691,128 @@ class Ser_Iface(object):
                 if not c2:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A0, A1}'
                 if not c3:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_averages outside range [3, 10001]'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
+                raise Exception
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+            
+    def ReadChunked(self, input_channel, no_reads, binary = False, chunk_size = None, keep_samples = True, loud = False, neg_channel = None, stats = None):
+        
+        """
+        This method interfaces with the IBM4 to take an arbitrary no. of readings at a single analog input, or differential readings
+        between two analog inputs
+        The readings are split into chunks of at most 9999 readings, the chunks are written back-to-back using a Cmd_Pipeline 
+        and each chunk is parsed as it arrives, the time allowed for each chunk scales with its size, see _ReadTimeout
+        The statistics are computed incrementally with an IBM4_Stats.Running_Stats, so with keep_samples = False the memory used 
+        does not depend on no_reads
+        
+        Inputs:
+        input_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
+        no_reads (type: int) is the num. of readings to be taken, must be at least 3
+        binary = True => integer readings from BRead, binary = False => voltage readings from Read
+        chunk_size (type: int) is the max. no. of readings per read command, None => 9999, the readings are split into the fewest chunks
+        of this size and the chunks are made as equal in size as possible
+        keep_samples = True => return every reading, keep_samples = False => return the statistics only
+        neg_channel (type: str) is the negative input of differential readings from Diff_Read / Diff_BRead, None => single ended readings
+        stats (type: IBM4_Stats.Running_Stats) is updated with the readings, e.g. to accumulate statistics over many calls
+        
+        Outputs: 
+        res (type: list) contains five elements
+        res[0] = average of all readings
+        res[1] = amplitude of the readings
+        res[2] = numpy array with all the readings, None if keep_samples = False
+        res[3] = variance of the readings
+        res[4] = standard error of the average
+        """
+        
+        self.FUNC_NAME = ".ReadChunked()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            c1 = True if self.instr_obj.isOpen() else False # confirm that the instrument object has been instantiated
+            c2 = True if input_channel in self.Read_Chnnls else False # confirm that the input channel label is correct
+            c3 = True if no_reads > 2 else False # confirm that no. reads being taken is a sensible value
+            c4 = True if chunk_size is None or (chunk_size > 0 and chunk_size <= self.MAX_CHUNK) else False # confirm that the chunk size is accepted by the IBM4
+            c5 = True if neg_channel is None or (neg_channel in self.Read_Chnnls and neg_channel != input_channel) else False # confirm that the negative channel label is correct
+        
+            c10 = c1 and c2 and c3 and c4 and c5 # if all conditions are true then read can proceed
+            
+            if c10:
+                # the fewest chunks that the IBM4 accepts, made as equal in size as possible
+                no_chunks = -(-no_reads // (self.MAX_CHUNK if chunk_size is None else chunk_size))
+                size = -(-no_reads // no_chunks)
+                vals = numpy.empty(no_reads, dtype = numpy.int_ if binary else numpy.float64) if keep_samples else None
+                chunk_stats = IBM4_Stats.Running_Stats() # statistics of this read, the chunks are combined using the parallel form of Welford's algorithm
+                
+                def parse_chunk(lines, start, n):
+                    chunk = IBM4_Parse.ParseInts(lines[-1], n) if binary else IBM4_Parse.ParseFloats(lines[-1], n)
+                    if len(chunk) != n:
+                        raise ValueError('Chunk contains %(v1)d readings, expected %(v2)d'%{"v1":len(chunk), "v2":n})
+                    if vals is not None:
+                        vals[start:start+n] = chunk
+                    chunk_stats.Update(chunk)
+                    if stats is not None:
+                        stats.Update(chunk)
+                    if loud: print('Chunk of',n,'readings starting at',start,'received')
+                
+                pipe = self.Pipeline(depth = 2) # one chunk is queued on the IBM4 while the previous one is being returned
+                cmd_name = 'BRead' if binary else 'Read'
+                if neg_channel is None:
+                    cmd_chnnls = '%(v1)d'%{"v1":self.Read_Chnnls[input_channel]}
+                else:
+                    cmd_name = 'Diff_' + cmd_name
+                    cmd_chnnls = '%(v1)d:%(v2)d'%{"v1":self.Read_Chnnls[input_channel], "v2":self.Read_Chnnls[neg_channel]}
+                for start in range(0, no_reads, size):
+                    n = min(size, no_reads - start)
+                    read_cmd = '%(v0)s%(v1)s:%(v2)d\r\n'%{"v0":cmd_name, "v1":cmd_chnnls, "v2":n}
+                    pipe.Queue( str.encode(read_cmd), parser = lambda lines, start = start, n = n: parse_chunk(lines, start, n) )
+                pipe.Execute( timeout = self._ReadTimeout(size) )
+                
+                return [chunk_stats.mean, chunk_stats.Amplitude(), vals, chunk_stats.Variance(), chunk_stats.StdErr()]
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nNo comms established'
+                if not c2:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\ninput_channel outside range {A2, A3, A4, A5, D2}'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
+                if not c4:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nchunk_size outside range [1, 9999]'
+                if not c5:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nneg_channel incorrect or the same as input_channel'
                 raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
             print(e)
     
+    def RunningStats(self, binary = False, differential = False, sketch = True):
+        
+        """
+        Return an empty IBM4_Stats.Running_Stats for the readings of this IBM4, to be passed as stats to the multiple read methods
+        The range of the percentile sketch is the input range of the current read mode
+        
+        Inputs:
+        binary = True => statistics of integer readings, binary = False => statistics of voltage readings
+        differential = True => statistics of differential readings, which can be negative
+        sketch = True => percentiles are estimated with an IBM4_Stats.Range_Sketch, sketch = False => no percentiles
+        
+        Outputs:
+        stats (type: IBM4_Stats.Running_Stats)
+        """
+        
+        if not sketch:
+            return IBM4_Stats.Running_Stats()
+        if binary:
+            lo, hi = 0.0, 65535.0 # binary readings are 16 bit
+        elif self.read_mode == 'AC':
+            lo, hi = -8.0, 8.0
+        else:
+            lo, hi = 0.0, self.VMAX
+        if differential:
+            lo, hi = lo - hi, hi - lo
+        return IBM4_Stats.Running_Stats( IBM4_Stats.Range_Sketch(lo, hi) )
+    
     # differential voltage reading methods
 
     def DiffReadSingle(self, pos_channel, neg_channel, loud = False):
@@ -972,9 +1845,7 @@ class Ser_Iface(object):
             if c10:
                 no_reads = 1
                 read_cmd = 'Diff_Read%(v1)d:%(v2)d:%(v3)d\r\n'%{"v1":self.Read_Chnnls[pos_channel], "v2":self.Read_Chnnls[neg_channel], "v3":no_reads}
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
+                read_result = self._Transact( str.encode(read_cmd) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
                 vals_str = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list of strings
                 res = float(vals_str[-1])
                 if loud: 
@@ -1001,7 +1872,7 @@ class Ser_Iface(object):
         This method interfaces with the IBM4 to perform a differential read operation.
         The input channels must be between 0 and 4, and the number of readings to be averaged should be greater than zero. 
         At some point the number of readings will be too high and will cause a timeout error. This should only happen for numbers 
-        larger than 10000. The output will be a single Voltage (floating point) value representing the average of the multiple readings.
+        larger than 10000, so larger numbers of readings are taken in chunks by ReadChunked. The output will be a single Voltage (floating point) value representing the average of the multiple readings.
     
         Inputs:
         pos_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
@@ -1020,15 +1891,15 @@ class Ser_Iface(object):
             c2 = True if pos_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
             c3 = True if neg_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
             c4 = True if neg_channel != pos_channel else False # confirm that the positive channel label is correct
-            c5 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c5 = True if no_reads > 2 else False # confirm that no. averages being taken is a sensible value
         
             c10 = c1 and c2 and c3 and c4 and c5 # if all conditions are true then write can proceed
             
-            if c10:
+            if c10 and no_reads > self.MAX_CHUNK:
+                return self.ReadChunked(pos_channel, no_reads, keep_samples = False, loud = loud, neg_channel = neg_channel)[0] # too many readings for a single Diff_Average command
+            elif c10:
                 read_cmd = 'Diff_Average%(v1)d:%(v2)d:%(v3)d\r\n'%{"v1":self.Read_Chnnls[pos_channel], "v2":self.Read_Chnnls[neg_channel], "v3":no_reads}
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
+                read_result = self._Transact( str.encode(read_cmd), timeout = self._ReadTimeout(no_reads) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
                 vals_str = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list of strings
                 res = float(vals_str[-1])
                 if loud: 
@@ -1045,24 +1916,25 @@ class Ser_Iface(object):
                 if not c4:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\npos_channel cannot be the same as neg_channel'
                 if not c5:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_averages outside range [3, 10000]'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
                 raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
             print(e) 
             
-    def DiffReadMultiple(self, pos_channel, neg_channel, no_reads = 10, loud = False):
+    def DiffReadMultiple(self, pos_channel, neg_channel, no_reads = 10, loud = False, stats = None):
         
         """
         This method interfaces with the IBM4 to perform a differential read operation.
         The input channels must be between 0 and 4, and the number of readings to be averaged should be greater than zero. 
         At some point the number of readings will be too high and will cause a timeout error. This should only happen for numbers 
-        larger than 10000. The output will be an array of Voltage (floating point) values.
+        larger than 10000, so larger numbers of readings are split into chunks by ReadChunked. The output will be an array of Voltage (floating point) values.
     
         Inputs:
         pos_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
         neg_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2', accepting that it is not the same as pos_channel    
         no_reads (type: int) is the num. of readings to be taken at the analog input channel
+        stats (type: IBM4_Stats.Running_Stats) is updated with the differential readings
         
         Outputs:
         res (type: list) contains three elements
@@ -1079,25 +1951,27 @@ class Ser_Iface(object):
             c2 = True if pos_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
             c3 = True if neg_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
             c4 = True if neg_channel != pos_channel else False # confirm that the positive channel label is correct
-            c5 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c5 = True if no_reads > 2 else False # confirm that no. averages being taken is a sensible value
         
             c10 = c1 and c2 and c3 and c4 and c5 # if all conditions are true then write can proceed
             
-            if c10:
+            if c10 and no_reads > self.MAX_CHUNK:
+                return self.ReadChunked(pos_channel, no_reads, loud = loud, neg_channel = neg_channel, stats = stats)[0:3] # too many readings for a single read command
+            elif c10:
                 read_cmd = 'Diff_Read%(v1)d:%(v2)d:%(v3)d\r\n'%{"v1":self.Read_Chnnls[pos_channel], "v2":self.Read_Chnnls[neg_channel], "v3":no_reads}
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
-                vals_str = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list of strings
-                #vals_flt = [float(x) for x in vals_str] # convert the list of strings to floats, save as a list
-                # only interested in the last no_reads values so read backwards into the vals_str list using list-slice operator
-                vals_flt = numpy.float64(vals_str[-no_reads:]) # convert the list of strings to floats using numpy, save as numpy array (better)
+                read_result = self._Transact( str.encode(read_cmd), timeout = self._ReadTimeout(no_reads) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
+                # only interested in the last no_reads values, parse them directly from the bytes into a numpy array
+                vals_flt = IBM4_Parse.ParseFloats(read_result, no_reads)
+                if len(vals_flt) != no_reads: # a short reply would otherwise be returned without any error
+                    raise ValueError('Reply contains %(v1)d readings, expected %(v2)d'%{"v1":len(vals_flt), "v2":no_reads})
                 if loud: 
                     print(read_result)
                     print(vals_flt) # print the parsed values
                 vals_mean = numpy.mean(vals_flt) # compute the average of all the diff_reads
                 vals_delta = 0.5*( numpy.max(vals_flt) - numpy.min(vals_flt) ) # compute the range of the diff_read
                 res = [vals_mean, vals_delta, vals_flt]
+                if stats is not None:
+                    stats.Update(vals_flt)
                 return res # return the relevant numerical values
             else:
                 if not c1:
@@ -1109,7 +1983,7 @@ class Ser_Iface(object):
                 if not c4:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\npos_channel cannot be the same as neg_channel'
                 if not c5:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_averages outside range [3, 10000]'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
                 raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
@@ -1146,9 +2020,7 @@ class Ser_Iface(object):
             if c10:
                 no_reads = 1
                 read_cmd = 'Diff_BRead%(v1)d:%(v2)d:%(v3)d\r\n'%{"v1":self.Read_Chnnls[pos_channel], "v2":self.Read_Chnnls[neg_channel], "v3":no_reads}
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
+                read_result = self._Transact( str.encode(read_cmd) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
                 vals_str = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list of strings
                 res = int(vals_str[-1])
                 if loud: 
@@ -1169,18 +2041,19 @@ class Ser_Iface(object):
             print(self.ERR_STATEMENT)
             print(e)
             
-    def DiffReadMultipleBinary(self, pos_channel, neg_channel, no_reads = 10, loud = False):
+    def DiffReadMultipleBinary(self, pos_channel, neg_channel, no_reads = 10, loud = False, stats = None):
         
         """
         This method interfaces with the IBM4 to perform a differential read operation.
         The input channels must be between 0 and 4, and the number of readings to be averaged should be greater than zero. 
         At some point the number of readings will be too high and will cause a timeout error. This should only happen for numbers 
-        larger than 10000. The output will be an array of integer values.
+        larger than 10000, so larger numbers of readings are split into chunks by ReadChunked. The output will be an array of integer values.
     
         Inputs:
         pos_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2'
         neg_channel (type: str) is one of the labels for the analog input channels 'A2', 'A3', 'A4', 'A5', 'D2', accepting that it is not the same as pos_channel    
         no_reads (type: int) is the num. of readings to be taken at the analog input channel
+        stats (type: IBM4_Stats.Running_Stats) is updated with the differential readings
         
         Outputs:
         vals_int (type: int) numpy array with all differential read values
@@ -1194,19 +2067,21 @@ class Ser_Iface(object):
             c2 = True if pos_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
             c3 = True if neg_channel in self.Read_Chnnls else False # confirm that the positive channel label is correct
             c4 = True if neg_channel != pos_channel else False # confirm that the positive channel label is correct
-            c5 = True if no_reads > 2 and no_reads < 10000 else False # confirm that no. averages being taken is a sensible value
+            c5 = True if no_reads > 2 else False # confirm that no. averages being taken is a sensible value
         
             c10 = c1 and c2 and c3 and c4 and c5 # if all conditions are true then write can proceed
             
-            if c10:
+            if c10 and no_reads > self.MAX_CHUNK:
+                return self.ReadChunked(pos_channel, no_reads, binary = True, loud = loud, neg_channel = neg_channel, stats = stats)[2] # too many readings for a single read command
+            elif c10:
                 read_cmd = 'Diff_BRead%(v1)d:%(v2)d:%(v3)d\r\n'%{"v1":self.Read_Chnnls[pos_channel], "v2":self.Read_Chnnls[neg_channel], "v3":no_reads}
-                self.instr_obj.write( str.encode(read_cmd) ) # when using serial str must be encoded as bytes
-                read_result = self.instr_obj.read_until(size=read_cmd.__sizeof__()) # read_result returned as bytes and clear the return message  
-                read_result = self.instr_obj.read_until(b'\n',size=None) # read_result returned as bytes, must be cast to str before being parsed                    
-                vals_str = re.findall(r'[-+]?\d+[\.]?\d*', str(read_result) ) # parse the numeric values of read_result into a list of strings
-                #vals_flt = [float(x) for x in vals_str] # convert the list of strings to floats, save as a list
-                # only interested in the last no_reads values so read backwards into the vals_str list using list-slice operator
-                vals_int = numpy.int_(vals_str[-no_reads:]) # convert the list of strings to floats using numpy, save as numpy array (better)
+                read_result = self._Transact( str.encode(read_cmd), timeout = self._ReadTimeout(no_reads) )[-1] # when using serial str must be encoded as bytes, read_result is the result line that follows the echo
+                # only interested in the last no_reads values, parse them directly from the bytes into a numpy array
+                vals_int = IBM4_Parse.ParseInts(read_result, no_reads)
+                if len(vals_int) != no_reads: # a short reply would otherwise be returned without any error
+                    raise ValueError('Reply contains %(v1)d readings, expected %(v2)d'%{"v1":len(vals_int), "v2":no_reads})
+                if stats is not None:
+                    stats.Update(vals_int)
                 if loud: 
                     print(read_result)
                     print(vals_int) # print the parsed values                
@@ -1221,7 +2096,7 @@ class Ser_Iface(object):
                 if not c4:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\npos_channel cannot be the same as neg_channel'
                 if not c5:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_averages outside range [3, 10000]'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not read from instrument\nno_reads must be at least 3'
                 raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
@@ -1390,7 +2265,47 @@ class Ser_Iface(object):
         print('Differential Read Value = %(v1)0.3f +/- %(v2)0.3f (V)'%{"v1":diff_res[0], "v2":diff_res[1]})
         
     # methods for initiating voltage sweeps
-    def SingleChannelSweepA(self, swp_channel, v_strt, v_end, no_steps, v_fixed = 0.0, no_averages = 10):
+    def _SettlePoll(self, channel = None):
+        """
+        Return a function that makes a single read of the inputs polled while settling
+        channel = None => every input is read in one round trip with the simple read command l
+        """
+
+        if channel is None:
+            return lambda: self._ParseScan( self._Transact(b'l\r\n') )
+        read_cmd = str.encode( 'Read%(v1)d:1\r\n'%{"v1":self.Read_Chnnls[channel]} )
+        return lambda: [ self._LastFloat( self._Transact(read_cmd) ) ]
+
+    def _SweepWrite(self, output_channel, set_voltage):
+        """
+        Output set_voltage at output_channel during a sweep
+        unlike WriteVoltage, which prints its error, a rejected or lost write raises so that the step is not counted as completed
+        and a checkpointed sweep resumes from that step
+        """
+
+        if not ( set_voltage >= self.VMIN and set_voltage < self.VMAX or abs(set_voltage - self.VMAX) < self.DELTA_VMIN ):
+            raise ValueError('set_voltage %(v1)0.3f outside range [0.0, 3.3]'%{"v1":set_voltage})
+        write_cmd = 'Write%(v1)d:%(v2)0.2f\r\n'%{"v1":self.Write_Chnnls[output_channel], "v2":set_voltage}
+        self.zeroed = self.zeroed and set_voltage == 0 # any non-zero output means the IBM4 is no longer grounded
+        self._Transact( str.encode(write_cmd) ) # raises TimeoutError when the reply is not received
+
+    def _SweepEngine(self, swp_channel, no_averages, delay, stream_file = None, settle = None, checkpoint_file = None, meta = None):
+        """
+        Return an IBM4_Sweep.Sweep_Engine that sweeps the voltage at swp_channel and reads the averaged voltage at every analog input
+        settle (type: IBM4_Sweep.Settle_Criterion) replaces the fixed delay by adaptive settling, None => wait the fixed delay
+        checkpoint_file (type: str) is the file in which the completed steps are saved, the sweep resumes from a checkpoint with the same meta
+        """
+
+        if settle is not None and settle.channel is not None and settle.channel not in self.Read_Chnnls:
+            raise Exception('settle.channel outside range {A2, A3, A4, A5, D2}')
+        engine = IBM4_Sweep.Sweep_Engine(lambda v: self._SweepWrite(swp_channel, v), lambda: self.ReadAverageVoltageAllChnnl(no_averages), 
+                                         list(self.Read_Chnnls), delay, stream_file, settle, None if settle is None else self._SettlePoll(settle.channel), 
+                                         checkpoint_file, meta)
+        self.last_sweep = engine
+        return engine
+
+    def SingleChannelSweepA(self, swp_channel, v_strt, v_end, no_steps, v_fixed = 0.0, no_averages = 10, stream_file = None, settle = None, 
+                            checkpoint_file = None):
     
         """
         Enable the microcontroller to perform a linear sweep of measurements using a single channel
@@ -1402,10 +2317,17 @@ class Ser_Iface(object):
         v_end is the final voltage
         no_steps is the number of voltage steps
         v_fixed is the constant voltage to be output by the channel that is NOT being swept
-        caveat emptor no_steps is constrained by fact that smallest voltage increment is 0.01V
+        caveat emptor no_steps is constrained by fact that smallest voltage increment is 0.01V, fewer steps are taken when 
+        (v_end - v_strt) / (no_steps - 1) < 0.01V, no_steps must be at least 4
+        stream_file is the name of a CSV file to which each step is written as soon as it is measured, None => no file is written
+        settle is an IBM4_Sweep.Settle_Criterion, when it is given the inputs are polled after each write until they settle
+        instead of waiting the fixed delay, the settle time at each step is available from self.last_sweep.settle_times
+        checkpoint_file is the name of a file in which the completed steps are saved periodically and when the sweep stops,
+        calling the sweep again with the same arguments, e.g. after reconnecting, resumes it from the first step not completed
 
         Output is a numpy array of the form
         [v_set, A2, A3, A4, A5, D2]
+        the array is allocated before the sweep starts, see IBM4_Sweep.Sweep_Engine
         """
 
         # R. Sheehan 30 - 5 - 2024
@@ -1425,7 +2347,7 @@ class Ser_Iface(object):
             c4 = True if v_end > v_strt and v_end <= self.VMAX else False # confirm that the voltage sweep bounds are in range
             c5 = True if (v_end - v_strt) > self.DELTA_VMIN else False # confirm that the voltage sweep bounds are in range
             c8 = True if v_fixed >= self.VMIN and v_fixed <= self.VMAX else False # confirm that the fixed voltage is in range
-            c6 = True if no_steps > 2 else False # confirm that the no. of steps is appropriate
+            c6 = True if no_steps > 3 else False # confirm that the no. of steps is appropriate, see Sweep_Interval.SweepSpace
             c7 = True if no_averages > 3 and no_averages < 103 else False # confirm that no. averages being taken is a sensible value
             c10 = c1 and c2 and c3 and c4 and c5 and c6 and c7 and c8
         
@@ -1434,31 +2356,19 @@ class Ser_Iface(object):
                 fixed_channel = 'A1' if swp_channel == 'A0' else 'A0'
                 self.WriteVoltage(fixed_channel, v_fixed)
                 # Proceed with the single channel linear voltage sweep
-                DELAY = 0.25 # timed delay value in units of seconds
-                voltage_data = numpy.array([]) # instantiate an empty numpy array to store the sweep data
-                delta_v = max( (v_end - v_strt) / float(no_steps - 1), self.DELTA_VMIN) # Determine the sweep voltage increment, this is bounded below by delta_v_min
-                v_set = v_strt # initialise the set-voltage
+                DELAY = 0.25 # timed delay value in units of seconds, only used when settle = None
+                # set-voltage at each step of the sweep, when the increment is bounded below by DELTA_VMIN the no. of steps is reduced
+                # so that no set-voltage lies past v_end, see Sweep_Interval.SweepSpace
+                v_set_values = Sweep_Interval.SweepSpace(no_steps, v_strt, v_end).Points()
                 # perform the sweep
                 print('\nLinear Sweep in Progress')
                 print('Sweeping voltage on Analog Output:',swp_channel)
                 print('Fixed voltage of',v_fixed,'(V) on Analog Output:',fixed_channel,'\n')
-                count = 0
-                #while v_set < v_end:
-                for i in range(0, no_steps, 1):
-                    step_data = numpy.array([]) # instantiate an empty numpy array to hold the data for each step of the sweep
-                    self.WriteVoltage(swp_channel, v_set) # set the voltage at the analog output channel
-                    time.sleep(DELAY) # Apply a fixed delay
-                    chnnl_values = self.ReadAverageVoltageAllChnnl(no_averages) # read the averaged voltages at all analog input channels
-                    # save the data
-                    step_data = numpy.append(step_data, v_set) # store the set-voltage value for this step
-                    step_data = numpy.append(step_data, chnnl_values) # store the  measured voltage values from all channels for this step
-                    # store the  set-voltage and the measured voltage values from all channels for this step
-                    # use append on the first step to initialise the voltage_data array
-                    # use vstack on subsequent steps to build up the 2D array of data
-                    voltage_data = numpy.append(voltage_data, step_data) if count == 0 else numpy.vstack([voltage_data, step_data])
-                    v_set = v_set + delta_v # increment the set-voltage
-                    count = count + 1 if count == 0 else count # only need to increment count once to build up the array
+                meta = {"sweep":"SingleChannelSweepA", "device":self.Identity(), "swp_channel":swp_channel, "v_fixed":v_fixed, "no_averages":no_averages}
+                engine = self._SweepEngine(swp_channel, no_averages, DELAY, stream_file, settle, checkpoint_file, meta)
+                voltage_data = engine.Run(v_set_values) # each row is [v_set, A2, A3, A4, A5, D2]
                 print('Sweep complete')
+                engine.PrintSettle()
                 self.ZeroIBM4() # ground the analog outputs
                 return voltage_data
             else:
@@ -1469,7 +2379,7 @@ class Ser_Iface(object):
                 if not c3 or not c4 or not c5:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nvoltage sweep bounds not appropriate for range [0.0, 3.3]'
                 if not c6:
-                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nn_steps not defined correctly'
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nno_steps must be at least 4'
                 if not c7:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nn_averages not defined correctly'
                 if not c8:
@@ -1479,7 +2389,8 @@ class Ser_Iface(object):
             print(self.ERR_STATEMENT)
             print(e)    
             
-    def SingleChannelSweepB(self, swp_channel, voltage_interval:Sweep_Interval.SweepSpace, v_fixed = 0.0, no_averages = 10):
+    def SingleChannelSweepB(self, swp_channel, voltage_interval:Sweep_Interval.SweepSpace, v_fixed = 0.0, no_averages = 10, stream_file = None, settle = None, 
+                            checkpoint_file = None):
     
         """
         Enable the microcontroller to perform a linear sweep of measurements using a single channel
@@ -1490,9 +2401,15 @@ class Ser_Iface(object):
         voltage_interval describes the voltage sweep space
         v_fixed is the constant voltage to be output by the channel that is NOT being swept
         caveat emptor no_steps is constrained by fact that smallest voltage increment is 0.01V
+        stream_file is the name of a CSV file to which each step is written as soon as it is measured, None => no file is written
+        settle is an IBM4_Sweep.Settle_Criterion, when it is given the inputs are polled after each write until they settle
+        instead of waiting the fixed delay, the settle time at each step is available from self.last_sweep.settle_times
+        checkpoint_file is the name of a file in which the completed steps are saved periodically and when the sweep stops,
+        calling the sweep again with the same arguments, e.g. after reconnecting, resumes it from the first step not completed
 
         Output is a numpy array of the form
         [v_set, A2, A3, A4, A5, D2]
+        the array is allocated before the sweep starts, see IBM4_Sweep.Sweep_Engine
         """
 
         # Notes on syntax for passing a class as an argument
@@ -1527,30 +2444,17 @@ class Ser_Iface(object):
                 fixed_channel = 'A1' if swp_channel == 'A0' else 'A0'
                 self.WriteVoltage(fixed_channel, v_fixed)
                 # Proceed with the single channel linear voltage sweep
-                DELAY = 0.25 # timed delay value in units of seconds
-                voltage_data = numpy.array([]) # instantiate an empty numpy array to store the sweep data
-                v_set = voltage_interval.start # initialise the set-voltage
+                DELAY = 0.25 # timed delay value in units of seconds, only used when settle = None
+                v_set_values = voltage_interval.Points() # set-voltage at each step of the sweep
                 # perform the sweep
                 print('\nLinear Sweep in Progress')
                 print('Sweeping voltage on Analog Output:',swp_channel)
                 print('Fixed voltage of',v_fixed,'(V) on Analog Output:',fixed_channel,'\n')
-                count = 0
-                #while v_set < voltage_interval.stop:
-                for i in range(0, voltage_interval.Nsteps, 1):
-                    step_data = numpy.array([]) # instantiate an empty numpy array to hold the data for each step of the sweep
-                    self.WriteVoltage(swp_channel, v_set) # set the voltage at the analog output channel
-                    time.sleep(DELAY) # Apply a fixed delay
-                    chnnl_values = self.ReadAverageVoltageAllChnnl(no_averages) # read the averaged voltages at all analog input channels
-                    # save the data
-                    step_data = numpy.append(step_data, v_set) # store the set-voltage value for this step
-                    step_data = numpy.append(step_data, chnnl_values) # store the  measured voltage values from all channels for this step
-                    # store the  set-voltage and the measured voltage values from all channels for this step
-                    # use append on the first step to initialise the voltage_data array
-                    # use vstack on subsequent steps to build up the 2D array of data
-                    voltage_data = numpy.append(voltage_data, step_data) if count == 0 else numpy.vstack([voltage_data, step_data])
-                    v_set = v_set + voltage_interval.delta # increment the set-voltage
-                    count = count + 1 if count == 0 else count # only need to increment count once to build up the array
+                meta = {"sweep":"SingleChannelSweepB", "device":self.Identity(), "swp_channel":swp_channel, "v_fixed":v_fixed, "no_averages":no_averages}
+                engine = self._SweepEngine(swp_channel, no_averages, DELAY, stream_file, settle, checkpoint_file, meta)
+                voltage_data = engine.Run(v_set_values) # each row is [v_set, A2, A3, A4, A5, D2]
                 print('Sweep complete')
+                engine.PrintSettle()
                 self.ZeroIBM4() # ground the analog outputs
                 return voltage_data
             else:
@@ -1568,4 +2472,246 @@ class Ser_Iface(object):
         except Exception as e:
             print(self.ERR_STATEMENT)
             print(e)    
-        
\ No newline at end of file
+        
+    def DualChannelSweep(self, a0_interval:Sweep_Interval.SweepSpace, a1_interval:Sweep_Interval.SweepSpace, no_averages = 10, stream_file = None, 
+                         settle = None, checkpoint_file = None):
+    
+        """
+        Enable the microcontroller to perform a two dimensional sweep of measurements over both analog outputs
+        every combination of the A0 and A1 set-voltages is visited, the voltage at every analog input is read at each point
+        
+        The grid is visited in serpentine order, A0 is swept up, A1 is stepped, A0 is swept down, ...
+        so consecutive points differ by a single step on one output, which keeps the slew and the settle time small
+    
+        Inputs:
+        a0_interval (type: Sweep_Interval.SweepSpace) describes the voltage sweep space of A0
+        a1_interval (type: Sweep_Interval.SweepSpace) describes the voltage sweep space of A1
+        no_averages (type: int) is the no. of averages taken at each analog input
+        stream_file is the name of a CSV file to which each point is written as soon as it is measured, None => no file is written
+        settle is an IBM4_Sweep.Settle_Criterion, when it is given the inputs are polled after each write until they settle
+        instead of waiting the fixed delay
+        checkpoint_file is the name of a file in which the completed points are saved periodically and when the sweep stops,
+        calling the sweep again with the same arguments, e.g. after reconnecting, resumes it from the first point not completed
+        
+        Outputs:
+        voltage_data (type: numpy array) has shape (len(a0_interval), len(a1_interval), 5), 
+        voltage_data[i, j] = [A2, A3, A4, A5, D2] with A0 at its i^th set-voltage and A1 at its j^th set-voltage
+        the set-voltages along each output are available from self.last_sweep.axes
+        """
+
+        self.FUNC_NAME = ".DualChannelSweep()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:       
+            c1 = self.instr_obj.isOpen() # confirm that the intstrument object has been instantiated
+            c3 = a0_interval.defined and a1_interval.defined # check that the parameters in the intervals have been defined correctly
+            # confirm that the voltage sweep bounds are in range
+            c4 = True if c3 and numpy.min(a0_interval.Points()) >= self.VMIN and numpy.max(a0_interval.Points()) <= self.VMAX else False
+            c5 = True if c3 and numpy.min(a1_interval.Points()) >= self.VMIN and numpy.max(a1_interval.Points()) <= self.VMAX else False
+            c7 = True if no_averages > 3 and no_averages < 103 else False # confirm that no. averages being taken is a sensible value
+            c10 = c1 and c3 and c4 and c5 and c7
+        
+            if c10:
+                DELAY = 0.25 # timed delay value in units of seconds, only used when settle = None
+                a0_values = a0_interval.Points() # set-voltages of A0
+                a1_values = a1_interval.Points() # set-voltages of A1
+                if settle is not None and settle.channel is not None and settle.channel not in self.Read_Chnnls:
+                    raise Exception('settle.channel outside range {A2, A3, A4, A5, D2}')
+                engine = IBM4_Sweep.Grid_Engine( (lambda v: self._SweepWrite('A0', v), lambda v: self._SweepWrite('A1', v)), 
+                                                 lambda: self.ReadAverageVoltageAllChnnl(no_averages), list(self.Read_Chnnls), DELAY, stream_file, 
+                                                 settle, None if settle is None else self._SettlePoll(settle.channel), checkpoint_file, 
+                                                 {"sweep":"DualChannelSweep", "device":self.Identity(), "no_averages":no_averages}, ('A0', 'A1') )
+                self.last_sweep = engine
+                # perform the sweep
+                print('\nDual Channel Sweep in Progress')
+                print('Sweeping voltage on Analog Outputs: A0 x A1,',len(a0_values),'x',len(a1_values),'points\n')
+                voltage_data = engine.Run(a0_values, a1_values) # shape (no. A0 values, no. A1 values, no. analog inputs)
+                print('Sweep complete')
+                engine.PrintSettle()
+                self.ZeroIBM4() # ground the analog outputs
+                return voltage_data
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nvoltage sweep bounds not defined'
+                if not c4 or not c5:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nvoltage sweep bounds not appropriate for range [0.0, 3.3]'
+                if not c7:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nn_averages not defined correctly'
+                raise Exception        
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def AdaptiveSweep(self, swp_channel, voltage_interval:Sweep_Interval.SweepSpace, response_channel = 'A2', v_fixed = 0.0, no_averages = 10, 
+                      tolerance = 0.02, max_points = 100, settle = None):
+    
+        """
+        Enable the microcontroller to perform a sweep of measurements using a single channel in which the steps are concentrated 
+        where the response at one input channel curves, e.g. at the knee of a diode curve
+        
+        voltage_interval is swept first as in SingleChannelSweepB, then the midpoints of the intervals over which the 
+        piecewise linear curve through the response_channel readings is estimated to be in error by more than tolerance 
+        are swept, see IBM4_Sweep.Refine, this is repeated until the curve is resolved, max_points steps have been made, 
+        or the intervals that need refining are DELTA_VMIN wide
+    
+        Inputs:
+        swp_channel is the channel being used as a voltage source
+        voltage_interval (type: Sweep_Interval.SweepSpace) describes the coarse voltage sweep space
+        response_channel is the analog input whose readings decide where the extra steps are placed
+        v_fixed is the constant voltage to be output by the channel that is NOT being swept
+        no_averages (type: int) is the no. of averages taken at each analog input
+        tolerance (type: float) is the largest acceptable error of the piecewise linear response curve, units of V
+        max_points (type: int) is the max. no. of steps in the sweep, including the coarse sweep
+        settle is an IBM4_Sweep.Settle_Criterion, when it is given the inputs are polled after each write until they settle
+        instead of waiting the fixed delay
+        
+        Outputs:
+        voltage_data (type: numpy array) has one row per step of the form [v_set, A2, A3, A4, A5, D2], sorted by v_set
+        """
+
+        self.FUNC_NAME = ".AdaptiveSweep()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:       
+            c1 = self.instr_obj.isOpen() # confirm that the intstrument object has been instantiated
+            c2 = True if swp_channel in self.Write_Chnnls else False # confirm that the output channel label is correct             
+            c3 = voltage_interval.defined # check that the parameters in the interval have been defined correctly
+            c4 = True if response_channel in self.Read_Chnnls else False # confirm that the input channel label is correct
+            c5 = True if max_points >= len(voltage_interval) and tolerance > 0 else False # confirm that the refinement parameters are sensible
+            c7 = True if no_averages > 3 and no_averages < 103 else False # confirm that no. averages being taken is a sensible value
+            c8 = True if v_fixed >= self.VMIN and v_fixed <= self.VMAX else False # confirm that the fixed voltage is in range
+            c10 = c1 and c2 and c3 and c4 and c5 and c7 and c8
+        
+            if c10:
+                # Set the voltage on the channel that is NOT sweeping
+                fixed_channel = 'A1' if swp_channel == 'A0' else 'A0'
+                self.WriteVoltage(fixed_channel, v_fixed)
+                DELAY = 0.25 # timed delay value in units of seconds, only used when settle = None
+                col = 1 + self.Read_Chnnls[response_channel] # column of the response channel in the sweep data
+                # perform the coarse sweep
+                print('\nAdaptive Sweep in Progress')
+                print('Sweeping voltage on Analog Output:',swp_channel)
+                print('Fixed voltage of',v_fixed,'(V) on Analog Output:',fixed_channel)
+                print('Refining on Analog Input:',response_channel,'to within',tolerance,'(V)\n')
+                v_set_values = numpy.unique( voltage_interval.Points() ) # set-voltage at each step of the coarse sweep, in ascending order
+                voltage_data = self._SweepEngine(swp_channel, no_averages, DELAY, None, settle).Run(v_set_values)
+                no_passes = 1
+                # sweep the new set-voltages of each refinement pass in ascending order, then merge them into the sorted data
+                while len(voltage_data) < max_points:
+                    new_values = IBM4_Sweep.Refine(voltage_data[:, 0], voltage_data[:, col], tolerance, self.DELTA_VMIN, max_points - len(voltage_data))
+                    if len(new_values) == 0:
+                        break
+                    new_data = self._SweepEngine(swp_channel, no_averages, DELAY, None, settle).Run(new_values)
+                    voltage_data = numpy.vstack( [voltage_data, new_data] )
+                    voltage_data = voltage_data[ numpy.argsort(voltage_data[:, 0], kind = 'stable') ]
+                    no_passes = no_passes + 1
+                print('Sweep complete:',len(voltage_data),'steps in',no_passes,'passes')
+                self.ZeroIBM4() # ground the analog outputs
+                return voltage_data
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
+                if not c2:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\noutput_channel outside range {A0, A1}'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nvoltage sweep bounds not defined'
+                if not c4:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nresponse_channel outside range {A2, A3, A4, A5, D2}'
+                if not c5:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nmax_points smaller than the coarse sweep or tolerance not positive'
+                if not c7:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nn_averages not defined correctly'
+                if not c8:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nv_fixed not in the correct range'
+                raise Exception        
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def _WritePWMs(self, pins, duties):
+        """
+        Set the duty cycle of each PWM pin in pins, the commands are written back-to-back in a single round trip
+        """
+
+        pipe = self.Pipeline()
+        for k in range(0, len(pins), 1):
+            pipe.Queue( str.encode( 'PWM%(v1)d:%(v2)d\r\n'%{"v1":self.PWM_Chnnls[pins[k]], "v2":duties[k]} ) )
+        self.zeroed = self.zeroed and not numpy.any(duties) # any non-zero output means the IBM4 is no longer grounded
+        pipe.Execute()
+
+    def PWMSweep(self, pins, duty_values, no_averages = 10, delay = 0.25, stream_file = None, settle = None, checkpoint_file = None):
+    
+        """
+        Enable the microcontroller to perform a sweep of the duty cycle at one or more PWM outputs 
+        the voltage at every analog input is read at each step
+        
+        At each step the PWM commands for all of the pins are written back-to-back in a single round trip, then the sweep waits
+        delay or, given settle, polls the inputs until they settle, which suits PWM outputs that drive an RC filter
+    
+        Inputs:
+        pins (type: str or list) contains the labels of the PWM outputs, e.g. 'D9' or ['D1', 'D9'], see PWM_Chnnls
+        duty_values (type: sequence) contains the duty cycle at each step in units of percent, 
+        a 1D sequence sets every pin to the same duty cycle, an array of shape (no_steps, no. pins) sets each pin independently
+        no_averages (type: int) is the no. of averages taken at each analog input
+        delay (type: float) is the time waited after the PWM commands before the inputs are read, units of second
+        stream_file is the name of a CSV file to which each step is written as soon as it is measured, None => no file is written
+        settle is an IBM4_Sweep.Settle_Criterion, when it is given the inputs are polled after each write until they settle
+        instead of waiting delay
+        checkpoint_file is the name of a file in which the completed steps are saved periodically and when the sweep stops,
+        calling the sweep again with the same arguments, e.g. after reconnecting, resumes it from the first step not completed
+        
+        Outputs:
+        pwm_data (type: numpy array) has one row per step of the form [duty at each pin, A2, A3, A4, A5, D2]
+        the same data with named columns, e.g. table['D9'], table['A2'], is available from self.last_sweep.table
+        """
+
+        self.FUNC_NAME = ".PWMSweep()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            pins = [pins] if isinstance(pins, str) else list(pins)
+            duties = numpy.asarray(duty_values, dtype = float)
+            if duties.ndim == 1:
+                duties = numpy.repeat(duties[:, None], len(pins), axis = 1) # same duty cycle at every pin
+            
+            c1 = self.instr_obj.isOpen() # confirm that the intstrument object has been instantiated
+            c2 = True if len(pins) > 0 and all(p in self.PWM_Chnnls for p in pins) and len(set(pins)) == len(pins) else False # confirm that the PWM channel labels are correct
+            c3 = True if duties.ndim == 2 and duties.shape[0] > 0 and duties.shape[1] == len(pins) else False # confirm that there is a duty cycle for each pin at each step
+            c4 = True if c3 and numpy.all(duties >= 0) and numpy.all(duties <= 100) else False # confirm that PWM percentages are sensible values
+            c5 = True if settle is None or settle.channel is None or settle.channel in self.Read_Chnnls else False # confirm that the settle channel label is correct
+            c7 = True if no_averages > 3 and no_averages < 103 else False # confirm that no. averages being taken is a sensible value
+            c10 = c1 and c2 and c3 and c4 and c5 and c7
+        
+            if c10:
+                meta = {"sweep":"PWMSweep", "device":self.Identity(), "pins":pins, "no_averages":no_averages}
+                engine = IBM4_Sweep.Sweep_Engine(lambda v: self._WritePWMs(pins, v), lambda: self.ReadAverageVoltageAllChnnl(no_averages), 
+                                                 list(self.Read_Chnnls), delay, stream_file, settle, None if settle is None else self._SettlePoll(settle.channel), 
+                                                 checkpoint_file, meta, pins)
+                self.last_sweep = engine
+                # perform the sweep
+                print('\nPWM Sweep in Progress')
+                print('Sweeping duty cycle on PWM Outputs:',', '.join(pins),'\n')
+                pwm_data = engine.Run(duties) # each row is [duty at each pin, A2, A3, A4, A5, D2]
+                print('Sweep complete')
+                engine.PrintSettle()
+                self.ZeroIBM4() # ground the analog and PWM outputs
+                return pwm_data
+            else:
+                if not c1:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
+                if not c2:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\npins must be distinct PWM channels {D0, D1, D7, D9, D10, D11, D12, D13}'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nduty_values must have one duty cycle per pin at each step'
+                if not c4:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nduty_values outside range [0, 100]'
+                if not c5:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nsettle.channel outside range {A2, A3, A4, A5, D2}'
+                if not c7:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nCould not write to instrument\nn_averages not defined correctly'
+                raise Exception        
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
@@ -14,6 +14,8 @@ import pyvisa
 import time
 import numpy
 import re
+import IBM4_Sweep
+import Sweep_Interval
 
 MOD_NAME_STR = "IBM4_library_VISA"
 
@@ -233,11 +235,10 @@ def Read_All_Chnnl(instrument_obj, no_averages = 10, loud = False):
         c10 = c1 and c3 # if all conditions are true then write can proceed
         
         if c10:
-            read_vals = numpy.array([]) # instantiate an empty numpy array
-            for item in Read_Chnnls:
-                value = Read_Single_Chnnl(instrument_obj, item, no_averages, loud)
-                read_vals = numpy.append(read_vals, value)
-                if loud: print('Voltages at AI: ',read_vals)
+            read_vals = numpy.full(len(Read_Chnnls), numpy.nan) # one entry per input channel, allocated once
+            for i, item in enumerate(Read_Chnnls):
+                read_vals[i] = Read_Single_Chnnl(instrument_obj, item, no_averages, loud)
+                if loud: print('Voltages at AI: ',read_vals[:i+1])
             return read_vals
         else:
             if not c1:
@@ -301,7 +302,7 @@ def Diff_Read(instrument_obj, pos_channel, neg_channel, no_averages, loud = Fals
         print(ERR_STATEMENT)
         print(e)
 
-def Write_Single_Chnnl(instrument_obj, output_channel, set_voltage = 0.0):
+def Write_Single_Chnnl(instrument_obj, output_channel, set_voltage = 0.0, delay = DELAY):
     
     # This method interfaces with the IBM4 to perform a write operation where a Voltage is output on one of the analog output pins of the IBM4.
     # The output channel must be 0 or 1, while the output value should be specified in Volts (thus, floating point)
@@ -309,6 +310,8 @@ def Write_Single_Chnnl(instrument_obj, output_channel, set_voltage = 0.0):
     # output_channel is one of A0, A1
     # set_voltage is the desired voltage output value from the channel
     # set_voltage must be in the range [0.0, 3.3)
+    # delay is the time waited after the write before the IBM4 buffer is cleared, units of second
+    # delay = None => read back the echo and the result line of the write instead of waiting a fixed time
 
     FUNC_NAME = ".Write_Single_Chnnl()" # use this in exception handling messages
     ERR_STATEMENT = "Error: " + MOD_NAME_STR + FUNC_NAME
@@ -321,9 +324,13 @@ def Write_Single_Chnnl(instrument_obj, output_channel, set_voltage = 0.0):
         
         if c10:
             write_cmd = 'Write%(v1)d:%(v2)0.2f'%{"v1":Write_Chnnls[output_channel], "v2":set_voltage}
-            instrument_obj.write(write_cmd)
-            time.sleep(DELAY)
-            instrument_obj.clear()
+            if delay is None:
+                instrument_obj.query(write_cmd) # the echo of the write command
+                instrument_obj.read() # the result line, the IBM4 has applied the voltage once it is received
+            else:
+                instrument_obj.write(write_cmd)
+                time.sleep(delay)
+                instrument_obj.clear()
         else:
             if not c1:
                 ERR_STATEMENT = ERR_STATEMENT + '\nCould not write to instrument\nNo comms established'
@@ -369,7 +376,7 @@ def Write_PWM(instrument_obj, percentage):
         print(ERR_STATEMENT)
         print(e)
         
-def Linear_Sweep(instrument_obj, output_channel, v_strt, v_end, no_steps, no_averages, loud = False):
+def Linear_Sweep(instrument_obj, output_channel, v_strt, v_end, no_steps, no_averages, loud = False, stream_file = None, settle = None):
     
     # Enable the microcontroller to perform a linear sweep of measurements using a single channel
     # start at v_strt, set voltage, read inputs, increment_voltage, return voltage readings at all inputs
@@ -381,6 +388,9 @@ def Linear_Sweep(instrument_obj, output_channel, v_strt, v_end, no_steps, no_ave
     # v_end is the final voltage
     # no_steps is the number of voltage steps
     # caveat emptor no_steps is constrained by fact that smallest voltage increment is 0.1V
+    # stream_file is the name of a CSV file to which each step is written as soon as it is measured, None => no file is written
+    # settle is an IBM4_Sweep.Settle_Criterion, when it is given each write waits for the reply of the IBM4 rather than DELAY
+    # and the inputs are polled until they settle rather than waiting 0.25*DELAY
     # R. Sheehan 30 - 5 - 2024
 
     FUNC_NAME = ".Linear_Sweep()" # use this in exception handling messages
@@ -394,33 +404,28 @@ def Linear_Sweep(instrument_obj, output_channel, v_strt, v_end, no_steps, no_ave
         c3 = True if v_strt >= 0.0 and v_strt < v_end else False # confirm that the voltage sweep bounds are in range
         c4 = True if v_end > v_strt and v_end < VMAX else False # confirm that the voltage sweep bounds are in range
         c5 = True if (v_end - v_strt) > delta_v_min else False # confirm that the voltage sweep bounds are in range
-        c6 = True if no_steps > 2 else False # confirm that the no. of steps is appropriate
+        c6 = True if no_steps > 3 else False # confirm that the no. of steps is appropriate, see Sweep_Interval.SweepSpace
         c7 = True if no_averages > 3 and no_averages < 103 else False # confirm that no. averages being taken is a sensible value
         c10 = c1 and c2 and c3 and c4 and c5 and c6 and c7
         
         if c10:
             # Proceed with the single channel linear voltage sweep
-            voltage_data = numpy.array([]) # instantiate an empty numpy array to store the sweep data
-            delta_v = max( (v_end - v_strt) / float(no_steps - 1), delta_v_min) # Determine the sweep voltage increment, this is bounded below by delta_v_min
-            v_set = v_strt # initialise the set-voltage
+            # list the set-voltages before the sweep starts so that the data array can be allocated once
+            # the increment is bounded below by delta_v_min, in which case the no. of steps is reduced so that no set-voltage lies past v_end
+            v_set_values = Sweep_Interval.SweepSpace(no_steps, v_strt, v_end).Points()
             # perform the sweep
             print('Sweeping voltage on Analog Output: ',output_channel)
-            count = 0
-            while v_set < v_end:
-                step_data = numpy.array([]) # instantiate an empty numpy array to hold the data for each step of the sweep
-                Write_Single_Chnnl(instrument_obj, output_channel, v_set) # set the voltage at the analog output channel
-                time.sleep(0.25*DELAY) # Apply a fixed delay
-                chnnl_values = Read_All_Chnnl(instrument_obj, no_averages, loud) # read the averaged voltages at all analog input channels
-                # save the data
-                step_data = numpy.append(step_data, v_set) # store the set-voltage value for this step
-                step_data = numpy.append(step_data, chnnl_values) # store the  measured voltage values from all channels for this step
-                # store the  set-voltage and the measured voltage values from all channels for this step
-                # use append on the first step to initialise the voltage_data array
-                # use vstack on subsequent steps to build up the 2D array of data
-                voltage_data = numpy.append(voltage_data, step_data) if count == 0 else numpy.vstack([voltage_data, step_data])
-                v_set = v_set + delta_v # increment the set-voltage
-                count = count + 1 if count == 0 else count # only need to increment count once to build up the array
+            write_delay = DELAY if settle is None else None
+            poll_func = None
+            if settle is not None and settle.channel is None:
+                poll_func = lambda: Read_All_Chnnl(instrument_obj, 4, False) # smallest no. of averages accepted by Read_All_Chnnl
+            elif settle is not None:
+                poll_func = lambda: [ Read_Single_Chnnl(instrument_obj, settle.channel, 3, False) ] # smallest no. of averages accepted by Read_Single_Chnnl
+            engine = IBM4_Sweep.Sweep_Engine(lambda v: Write_Single_Chnnl(instrument_obj, output_channel, v, write_delay), 
+                                             lambda: Read_All_Chnnl(instrument_obj, no_averages, loud), list(Read_Chnnls), 0.25*DELAY, stream_file, settle, poll_func)
+            voltage_data = engine.Run(v_set_values) # each row is [v_set, A2, A3, A4, A5, D2]
             print('Sweep complete')
+            engine.PrintSettle()
             return voltage_data
         else:
             if not c1:
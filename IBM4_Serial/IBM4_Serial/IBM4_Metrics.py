@@ -0,0 +1,251 @@
+"""
+Opt-in per-command latency instrumentation for the IBM4 serial link
+Enabled with Ser_Iface.EnableMetrics(), when it is not enabled the only cost is a check that the metrics object is None
+
+For each command type, e.g. Read, Average, Write, the following are recorded
+write: time from the reply being registered to the write call returning
+echo: time from the reply being registered to the echo of the command being received
+first: time from the reply being registered to the first byte of the result being received
+total: time from the reply being registered to the last result line being received
+plus the bytes written, the bytes received and the no. of replies abandoned because of a timeout
+
+Times are stored in HDR-style histograms, i.e. log-linear buckets with a fixed relative precision,
+so that recording is a handful of integer operations and the memory used does not grow with the no. of samples
+"""
+
+# HdrHistogram, the design the histogram below is based on
+# http://hdrhistogram.org/
+# https://github.com/HdrHistogram/HdrHistogram/blob/master/src/main/java/org/HdrHistogram/AbstractHistogram.java
+
+import re
+import time
+import numpy
+
+MOD_NAME_STR = "IBM4_Metrics"
+
+# the command type is the name at the start of the command, e.g. b'Diff_Average0:1:10' -> 'Diff_Average'
+CMD_NAME = re.compile(rb'[*A-Za-z_]+')
+
+class Latency_Histogram(object):
+    """
+    class for a log-linear histogram of times, values are stored in units of ns with a relative precision of 1 / sub_buckets
+    """
+
+    def __init__(self, sub_buckets = 128, max_exponent = 40):
+        """
+        Constructor for the Latency_Histogram object
+
+        sub_buckets (type: int) is the no. of linear buckets in each power of two, must be a power of two
+        max_exponent (type: int) values up to 2**max_exponent ns are recorded exactly, larger values go into the last bucket
+        """
+
+        self.sub_buckets = sub_buckets
+        self.half = sub_buckets // 2
+        self.shift = sub_buckets.bit_length() - 1 # log2(sub_buckets)
+        self.no_buckets = sub_buckets + (max_exponent - self.shift + 1) * self.half
+        self.counts = [0] * self.no_buckets # list is used because incrementing a single element is faster than with numpy
+        self.Reset()
+
+    def Reset(self):
+        """
+        Remove all recorded values
+        """
+
+        for i in range(0, self.no_buckets, 1):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0 # sum of the recorded values, units of ns
+        self.min = None
+        self.max = 0
+
+    def Index(self, v):
+        """
+        Return the bucket index of the value v in units of ns
+        """
+
+        if v < self.sub_buckets:
+            return v
+        e = v.bit_length() - self.shift # v >> e is in the range [half, sub_buckets)
+        return min( self.sub_buckets + (e - 1) * self.half + (v >> e) - self.half, self.no_buckets - 1 )
+
+    def Value(self, idx):
+        """
+        Return the value at the middle of the bucket idx in units of ns
+        """
+
+        if idx < self.sub_buckets:
+            return float(idx)
+        e = (idx - self.sub_buckets) // self.half + 1
+        m = (idx - self.sub_buckets) % self.half + self.half
+        return ((m << e) + ((1 << e) - 1) / 2.0)
+
+    def Record(self, t):
+        """
+        Record a time
+
+        t (type: float) is the time in units of second
+        """
+
+        v = int(t * 1.0e9)
+        if v < 0:
+            v = 0
+        self.counts[self.Index(v)] += 1
+        self.count += 1
+        self.total += v
+        if self.min is None or v < self.min:
+            self.min = v
+        if v > self.max:
+            self.max = v
+
+    def Merge(self, other):
+        """
+        Add the values recorded in another Latency_Histogram with the same bucket layout
+        """
+
+        for i in range(0, self.no_buckets, 1):
+            self.counts[i] += other.counts[i]
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def Percentile(self, p):
+        """
+        Return the value below which p percent of the recorded values lie, units of second, None if no values are recorded
+        """
+
+        if self.count == 0:
+            return None
+        cumulative = numpy.cumsum(self.counts)
+        idx = int( numpy.searchsorted(cumulative, max(1, numpy.ceil(p * self.count / 100.0))) )
+        return min(self.Value(idx), self.max) * 1.0e-9
+
+    def Mean(self):
+        """
+        Return the mean of the recorded values, units of second, None if no values are recorded
+        """
+
+        return None if self.count == 0 else self.total * 1.0e-9 / self.count
+
+    def Summary(self):
+        """
+        Return the count, mean, min, p50, p90, p99, p99.9 and max of the recorded values, times in units of second
+        """
+
+        if self.count == 0:
+            return {"count":0}
+        return {"count":self.count, "mean":self.Mean(), "min":self.min * 1.0e-9, "p50":self.Percentile(50), "p90":self.Percentile(90),
+                "p99":self.Percentile(99), "p99.9":self.Percentile(99.9), "max":self.max * 1.0e-9}
+
+class Cmd_Stats(object):
+    """
+    class for the latency histograms and counters of a single command type
+    """
+
+    def __init__(self):
+        self.write = Latency_Histogram()
+        self.echo = Latency_Histogram()
+        self.first = Latency_Histogram()
+        self.total = Latency_Histogram()
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.timeouts = 0
+
+    def Summary(self):
+        return {"write":self.write.Summary(), "echo":self.echo.Summary(), "first":self.first.Summary(), "total":self.total.Summary(),
+                "bytes_out":self.bytes_out, "bytes_in":self.bytes_in, "timeouts":self.timeouts}
+
+class Cmd_Metrics(object):
+    """
+    class for the per-command latency instrumentation of an IBM4 link
+
+    The Reply_Framer keeps a timing record for each expected reply while metrics are enabled
+    [t_expect, t_written, t_echo, t_first, bytes_out], times are time.perf_counter() values, 0.0 => not yet seen
+    """
+
+    def __init__(self):
+        self.stats = {} # command type -> Cmd_Stats
+        self.names = {} # echo -> command type, saves running the regex for every reply
+        self.started = time.time()
+
+    def Name(self, echo):
+        """
+        Return the command type of the command whose echo is given
+        """
+
+        name = self.names.get(echo)
+        if name is None:
+            m = CMD_NAME.match(echo)
+            # the two character commands a0, b0 and the command l are kept whole
+            name = m.group(0).decode() if m is not None and len(echo) > 2 else echo.decode(errors = 'replace')
+            if len(self.names) < 4096: # bounded, every distinct argument list is a distinct echo
+                self.names[echo] = name
+        return name
+
+    def Stats(self, name):
+        """
+        Return the Cmd_Stats of the command type name, it is created if it does not yet exist
+        """
+
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = Cmd_Stats()
+            self.stats[name] = stats
+        return stats
+
+    def Complete(self, echo, timing, lines, t_done):
+        """
+        Record a completed reply
+
+        echo (type: bytes) is the echo of the command
+        timing (type: list) is the timing record kept by the Reply_Framer
+        lines (type: list) contains the result lines of the reply
+        t_done (type: float) is the time.perf_counter() value when the last result line was received
+        """
+
+        stats = self.Stats( self.Name(echo) )
+        t0 = timing[0]
+        if timing[1] > 0:
+            stats.write.Record(timing[1] - t0)
+        stats.echo.Record(timing[2] - t0)
+        stats.first.Record((timing[3] if timing[3] > 0 else t_done) - t0)
+        stats.total.Record(t_done - t0)
+        stats.bytes_out += timing[4]
+        stats.bytes_in += len(echo) + 2 + sum(len(line) + 2 for line in lines)
+
+    def Abandoned(self, echo, timing):
+        """
+        Record a reply that was abandoned before it was completed, e.g. because of a timeout
+        """
+
+        stats = self.Stats( self.Name(echo) )
+        stats.timeouts += 1
+        stats.bytes_out += timing[4]
+
+    def Reset(self):
+        """
+        Remove all recorded values
+        """
+
+        self.stats = {}
+        self.started = time.time()
+
+    def Summary(self):
+        """
+        Return a dict with the Summary of every command type
+        """
+
+        return {k:v.Summary() for k, v in self.stats.items()}
+
+    def Print(self):
+        """
+        Print a table of the p50, p99 and max times for each command type, times in units of ms
+        """
+
+        print('%(v1)s %(v2)8s %(v3)20s %(v4)20s %(v5)20s %(v6)20s %(v7)9s'%{"v1":'Command'.ljust(14), "v2":'Count', "v3":'write p50/p99',
+              "v4":'echo p50/p99', "v5":'first p50/p99', "v6":'total p50/p99/max', "v7":'Timeouts'})
+        fmt = lambda h, *ps: '/'.join( '-' if h.count == 0 else '%0.3f'%(1000*h.Percentile(p)) for p in ps )
+        for k, v in sorted(self.stats.items()):
+            print('%(v1)s %(v2)8d %(v3)20s %(v4)20s %(v5)20s %(v6)20s %(v7)9d'%{"v1":k.ljust(14), "v2":v.total.count,
+                  "v3":fmt(v.write, 50, 99), "v4":fmt(v.echo, 50, 99), "v5":fmt(v.first, 50, 99), "v6":fmt(v.total, 50, 99, 100), "v7":v.timeouts})
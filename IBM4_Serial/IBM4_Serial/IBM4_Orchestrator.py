@@ -0,0 +1,220 @@
+"""
+Parallel orchestration of sweeps over several IBM4s, e.g. one IBM4 per DUT on a test rig
+
+Multi_Device runs one worker thread per IBM4, each worker owns its Ser_Iface and port, so N boards are swept in
+roughly the wall-clock time of one board. The sweeps spend almost all of their time waiting on the serial port,
+which releases the GIL, so threads are sufficient and the devices and results stay in the calling process
+
+Usage
+rig = IBM4_Orchestrator.Multi_Device() # open every IBM4 found by IBM4_Discovery.FindAllIBM4
+results = rig.Run('SingleChannelSweepB', 'A0', Sweep_Interval.SweepSpace(51, 0.0, 3.3))
+rig.Close()
+
+results is keyed by device identity, i.e. IBM4_Registry.Device_Registry.Key(idn, serial_number, port),
+which uses the port in place of the serial number when the IBM4 does not report a USB serial number
+A different sweep can be run on each IBM4 by passing a dict of callables keyed by device identity to Run
+The checkpoint_file and stream_file keyword arguments of a sweep are given a per-device suffix, e.g. x.npz -> x_<identity>.npz,
+so that the IBM4s do not write to the same file and a checkpoint is only resumed on the IBM4 that saved it
+"""
+
+# Thread pools
+# https://docs.python.org/3/library/concurrent.futures.html#threadpoolexecutor
+
+import os
+import re
+import time
+import threading
+import concurrent.futures
+import IBM4_Lib
+import IBM4_Discovery
+import IBM4_Registry
+
+MOD_NAME_STR = "IBM4_Orchestrator"
+
+# sweep keyword arguments that name a file, each IBM4 is given its own file
+FILE_KWARGS = ('checkpoint_file', 'stream_file')
+
+class Multi_Device(object):
+    """
+    class for running sweeps on several IBM4s in parallel
+    """
+
+    def __init__(self, devices = None, fast_open = True, loud = False):
+        """
+        Constructor for the Multi_Device object
+
+        devices (type: list) contains open Ser_Iface objects and / or the names of the ports to which IBM4s are attached
+        devices = None => every IBM4 found by IBM4_Discovery.FindAllIBM4 is opened
+        fast_open (type: bool) is passed to the Ser_Iface of each port that is opened here
+        """
+
+        self.MOD_NAME_STR = MOD_NAME_STR
+        self.FUNC_NAME = ".Multi_Device()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        self.devices = {} # device identity -> Ser_Iface
+        self.owned = [] # identities of the devices opened here, these are closed by Close
+        self.progress_interval = 5.0 # time between aggregate progress reports, units of second
+        self.errors = {} # device identity -> exception raised by the last Run on that device
+
+        try:
+            if devices is None:
+                found = IBM4_Discovery.FindAllIBM4(loud = loud)
+                devices = [item["port"] for item in found]
+                serials = {item["port"]:item["serial_number"] for item in found}
+            else:
+                serials = {}
+
+            # the ports are opened in parallel, each open takes a handshake with the IBM4
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers = max(1, len(devices)))
+            futs = [pool.submit(self._Open, dev, serials, fast_open) for dev in devices]
+            pool.shutdown(wait = True)
+            for dev, fut in zip(devices, futs):
+                key, the_dev, owned = fut.result()
+                if key is None:
+                    print(self.ERR_STATEMENT)
+                    print('No IBM4 at', dev)
+                    continue
+                self.devices[key] = the_dev
+                if owned:
+                    self.owned.append(key)
+            if loud:
+                print('IBM4s:', ', '.join(self.devices))
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def _Open(self, dev, serials, fast_open):
+        """
+        Open dev if it is a port name and return (identity, Ser_Iface, True if it was opened here), identity is None if no IBM4 responds
+        """
+
+        owned = isinstance(dev, str)
+        the_dev = IBM4_Lib.Ser_Iface(port_name = dev, fast_open = fast_open) if owned else dev
+        if getattr(the_dev, 'instr_obj', None) is None or not the_dev.instr_obj.isOpen():
+            return None, the_dev, owned
+        idn = the_dev.IdentifyIBM4()
+        if idn is None:
+            if owned:
+                the_dev.__del__() # close the port that was opened here
+            return None, the_dev, owned
+        port = the_dev.IBM4Port
+        serial_number = serials[port] if port in serials else IBM4_Registry.PortSerialNumber(port)
+        the_dev.device_key = IBM4_Registry.Device_Registry.Key(idn, serial_number, port)
+        return the_dev.device_key, the_dev, owned
+
+    def Keys(self):
+        """
+        Return the identities of the IBM4s
+        """
+
+        return list(self.devices)
+
+    def Progress(self):
+        """
+        Return (steps completed, steps in total) summed over the sweep currently or last run on each IBM4
+        """
+
+        done = 0
+        total = 0
+        for the_dev in self.devices.values():
+            engine = the_dev.last_sweep
+            if engine is not None and engine.settle_times is not None:
+                done = done + engine.rows
+                total = total + len(engine.settle_times)
+        return done, total
+
+    def Run(self, sweep, *args, **kwargs):
+        """
+        Run a sweep on every IBM4 in parallel, one worker thread per IBM4
+
+        Inputs:
+        sweep is the name of a Ser_Iface method, e.g. 'SingleChannelSweepB', which is called with args and kwargs on each IBM4,
+        or a callable taking the Ser_Iface as its first argument, which is called with args and kwargs on each IBM4,
+        or a dict of such callables / method names keyed by device identity, only the IBM4s in the dict are swept
+        checkpoint_file and stream_file must be passed as keyword arguments, each IBM4 is given a copy with its identity appended, see DeviceFile
+
+        Outputs:
+        results (type: dict) contains the value returned by the sweep on each IBM4, keyed by device identity
+        the sweep methods print their errors and return None, an exception raised by a sweep is kept in self.errors
+        """
+
+        jobs = sweep if isinstance(sweep, dict) else {key:sweep for key in self.devices}
+        unknown = [key for key in jobs if key not in self.devices]
+        if len(unknown) > 0:
+            raise KeyError('No IBM4 with identity %(v1)s'%{"v1":', '.join(unknown)})
+
+        for the_dev in self.devices.values():
+            the_dev.last_sweep = None # Progress only counts the sweeps of this Run
+        self.errors = {}
+        results = {}
+        start = time.monotonic()
+        finished = threading.Event()
+        monitor = threading.Thread(target = self._Monitor, args = (finished, len(jobs), results, start), daemon = True)
+
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers = max(1, len(jobs)), thread_name_prefix = 'IBM4')
+        futs = {pool.submit(self._Call, self.devices[key], job, args, self._DeviceKwargs(key, kwargs)):key for key, job in jobs.items()}
+        monitor.start()
+        try:
+            for fut in concurrent.futures.as_completed(futs):
+                key = futs[fut]
+                try:
+                    results[key] = fut.result()
+                except Exception as e:
+                    results[key] = None
+                    self.errors[key] = e
+        finally:
+            pool.shutdown(wait = True)
+            finished.set()
+            monitor.join()
+        print('All sweeps complete: %(v1)d IBM4s in %(v2)0.1f s, %(v3)d errors'%{"v1":len(jobs), "v2":time.monotonic() - start, "v3":len(self.errors)})
+        return results
+
+    def DeviceFile(self, key, file_name):
+        """
+        Return the name of the file used by the IBM4 with identity key in place of file_name, e.g. x.npz -> x_<identity>.npz
+        """
+
+        root, ext = os.path.splitext(file_name)
+        return '%(v1)s_%(v2)s%(v3)s'%{"v1":root, "v2":re.sub(r'[^A-Za-z0-9.-]+', '_', key).strip('_'), "v3":ext}
+
+    def _DeviceKwargs(self, key, kwargs):
+        """
+        Return a copy of kwargs in which the file names of FILE_KWARGS are replaced by the file names of the IBM4 with identity key
+        """
+
+        dev_kwargs = dict(kwargs)
+        for name in FILE_KWARGS:
+            if dev_kwargs.get(name) is not None:
+                dev_kwargs[name] = self.DeviceFile(key, dev_kwargs[name])
+        return dev_kwargs
+
+    def _Call(self, the_dev, job, args, kwargs):
+        """
+        Run a single job on the_dev
+        """
+
+        if isinstance(job, str):
+            return getattr(the_dev, job)(*args, **kwargs)
+        return job(the_dev, *args, **kwargs)
+
+    def _Monitor(self, finished, no_jobs, results, start):
+        """
+        Print the aggregate progress every progress_interval seconds until finished is set
+        """
+
+        while not finished.wait(self.progress_interval):
+            done, total = self.Progress()
+            print('Progress: %(v1)d of %(v2)d steps, %(v3)d of %(v4)d IBM4s finished, %(v5)0.1f s'%{"v1":done, "v2":total,
+                  "v3":len(results), "v4":no_jobs, "v5":time.monotonic() - start})
+
+    def Close(self):
+        """
+        Close the IBM4s that were opened by this object, devices that were passed in open are left open
+        """
+
+        for key in self.owned:
+            the_dev = self.devices.pop(key, None)
+            if the_dev is not None:
+                the_dev.__del__()
+        self.owned = []
@@ -0,0 +1,67 @@
+"""
+Parsers for the numeric replies returned by the IBM4
+The reply is parsed directly from the received bytes into a numpy array
+
+The read methods originally cast the reply bytes to str, split it into a list of str using re.findall
+and then converted the list using numpy.float64 or numpy.int_
+For a 10000 sample reply that builds tens of thousands of temporary python objects per call
+Here every byte that cannot be part of a number is mapped to a space using bytes.translate
+and the result is handed to the numpy text parser, both of which run in C in a single pass over the data
+"""
+
+# numpy.fromstring is only deprecated for binary data, text mode with sep != '' is supported
+# https://numpy.org/doc/stable/reference/generated/numpy.fromstring.html
+# https://docs.python.org/3/library/stdtypes.html#bytes.translate
+
+import re
+import warnings
+import numpy
+
+MOD_NAME_STR = "IBM4_Parse"
+
+# the regex used by the original read methods, kept as the fallback for replies the fast path cannot handle
+NUM_PATTERN = re.compile(rb'[-+]?\d+[\.]?\d*')
+
+# translation table that keeps the characters that can be part of a number and maps everything else to a space
+# the exponent characters e, E are not kept because the regex above does not accept them either
+KEEP_CHARS = b'0123456789.-+'
+NUM_TABLE = bytes( c if c in KEEP_CHARS else ord(' ') for c in range(256) )
+
+def ParseValues(data, no_vals = None, dtype = numpy.float64):
+    """
+    Parse the numeric values contained in an IBM4 reply
+
+    Inputs:
+    data (type: bytes or bytearray) is the reply received from the IBM4
+    no_vals (type: int) is the no. of values wanted, only the last no_vals values are returned, None => return all values
+    dtype is the numpy type of the returned values
+
+    Outputs:
+    vals (type: numpy array) contains the parsed values
+    """
+
+    cleaned = data.translate(NUM_TABLE)
+    try:
+        # a stray sign or a malformed number makes the numpy parser stop early, the warning is raised as an error so
+        # that a partially parsed reply is never returned
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            vals = numpy.fromstring(cleaned, dtype = dtype, sep = ' ')
+    except (ValueError, DeprecationWarning):
+        vals = numpy.array( NUM_PATTERN.findall(data) ).astype(dtype) # slow path that matches the original behaviour
+
+    return vals if no_vals is None else vals[-no_vals:]
+
+def ParseFloats(data, no_vals = None):
+    """
+    Parse an IBM4 voltage reply as a numpy array of floats
+    """
+
+    return ParseValues(data, no_vals, numpy.float64)
+
+def ParseInts(data, no_vals = None):
+    """
+    Parse an IBM4 binary reply as a numpy array of ints
+    """
+
+    return ParseValues(data, no_vals, numpy.int_)
@@ -0,0 +1,176 @@
+"""
+Background reader thread for the IBM4 serial link
+The thread continuously drains the serial port so that the OS serial buffer cannot overflow during long Read%d:%d bursts
+Samples are parsed by the reader thread and stored in a preallocated ring buffer of timestamped samples,
+the caller's thread only issues commands and consumes completed results
+"""
+
+# Notes on threading
+# https://docs.python.org/3/library/threading.html
+# The ring buffer has a single producer (the reader thread) and a single consumer (the caller)
+# The producer is the only thread that writes head and the consumer is the only thread that writes tail
+# Each index is published with a single assignment after the data it covers has been copied, so no lock is needed
+# https://en.wikipedia.org/wiki/Circular_buffer
+
+import time
+import threading
+import queue
+import numpy
+import IBM4_Parse
+
+MOD_NAME_STR = "IBM4_Reader"
+
+class Sample_Ring(object):
+    """
+    class for a single producer, single consumer ring buffer of timestamped samples
+    """
+
+    def __init__(self, size):
+        """
+        Constructor for the Sample_Ring object
+
+        size (type: int) is the no. of samples the ring can hold
+        """
+
+        self.size = size
+        self.data = numpy.zeros(size, dtype = [('t', numpy.float64), ('v', numpy.float64)]) # t is time.monotonic() in units of second
+        self.head = 0 # total no. of samples written, only changed by the producer
+        self.tail = 0 # total no. of samples consumed, only changed by the consumer
+        self.dropped = 0 # no. of samples discarded because the ring was full, only changed by the producer
+
+    def __len__(self):
+        """
+        no. of samples waiting to be consumed
+        """
+
+        return self.head - self.tail
+
+    def Push(self, t, vals):
+        """
+        Add samples to the ring, called by the producer only
+        If the ring does not have room for all of the samples the newest ones are dropped and counted
+
+        t (type: float) is the timestamp of the samples
+        vals (type: numpy array) contains the sample values
+        """
+
+        n = min( len(vals), self.size - (self.head - self.tail) )
+        self.dropped = self.dropped + len(vals) - n
+        start = self.head % self.size
+        first = min(n, self.size - start) # no. of samples that fit before the end of the array
+        self.data['t'][start:start+first] = t
+        self.data['v'][start:start+first] = vals[:first]
+        self.data['t'][:n-first] = t
+        self.data['v'][:n-first] = vals[first:n]
+        self.head = self.head + n # publish the samples
+
+    def Pop(self, max_n = None):
+        """
+        Remove samples from the ring, called by the consumer only
+
+        max_n (type: int) is the max. no. of samples to remove, None => remove all waiting samples
+
+        Outputs:
+        res (type: numpy structured array) has fields 't' and 'v' for each sample in the order they were received
+        """
+
+        n = self.head - self.tail
+        if max_n is not None:
+            n = min(n, max_n)
+        start = self.tail % self.size
+        idx = (start + numpy.arange(n)) % self.size
+        res = self.data[idx] # fancy indexing returns a copy, so the slots can be reused once tail moves on
+        self.tail = self.tail + n # release the slots
+        return res
+
+class Sample_Request(object):
+    """
+    tag for a read command whose samples are stored in the ring rather than returned to the caller
+    """
+
+    def __init__(self, no_reads, binary = False):
+        self.no_reads = no_reads
+        self.binary = binary
+
+class Reader_Thread(threading.Thread):
+    """
+    class for the thread that drains the serial port of an IBM4
+    """
+
+    def __init__(self, the_dev, ring_size = 1000000, depth = 4):
+        """
+        Constructor for the Reader_Thread object
+
+        the_dev (type: IBM4_Lib.Ser_Iface) is the open IBM4 whose port is drained
+        ring_size (type: int) is the no. of samples held by the ring buffer
+        depth (type: int) is the max. no. of sample requests outstanding on the IBM4 at any one time
+        """
+
+        threading.Thread.__init__(self, name = 'IBM4_Reader', daemon = True)
+        self.dev = the_dev
+        self.ring = Sample_Ring(ring_size)
+        self.replies = queue.Queue() # completed replies for commands issued by the caller, (tag, lines)
+        self.slots = threading.Semaphore(max(1, depth)) # bounds the outstanding sample requests
+        self.stop_event = threading.Event()
+        self.error = None # exception that stopped the thread, if any
+
+    def run(self):
+        """
+        Drain the port until Stop is called, parse sample replies into the ring and hand other replies to the caller
+        """
+
+        port = self.dev.instr_obj
+        framer = self.dev.framer
+        try:
+            while not self.stop_event.is_set():
+                waiting = port.in_waiting
+                data = port.read(waiting if waiting > 0 else 1) # read(1) blocks for at most the port poll_timeout
+                if len(data) == 0:
+                    continue
+                t = time.monotonic()
+                framer.Feed(data)
+                for tag, lines in framer.Replies():
+                    if isinstance(tag, Sample_Request):
+                        vals = IBM4_Parse.ParseInts(lines[-1], tag.no_reads) if tag.binary else IBM4_Parse.ParseFloats(lines[-1], tag.no_reads)
+                        self.ring.Push(t, vals)
+                        self.slots.release()
+                    else:
+                        self.replies.put( (tag, lines) )
+        except Exception as e:
+            self.error = e # the caller sees the error as a timeout followed by the value of error
+
+    def Stop(self):
+        """
+        Stop the thread and wait for it to finish
+        """
+
+        self.stop_event.set()
+        self.join()
+
+    def WaitReplies(self, no_replies, deadline):
+        """
+        Wait for the reader to complete no_replies replies to commands issued by the caller
+
+        deadline (type: float) is the time.monotonic() value at which the wait is abandoned
+
+        Outputs:
+        replies (type: list) contains (tag, lines) for each completed reply
+        """
+
+        replies = []
+        try:
+            while len(replies) < no_replies:
+                replies.append( self.replies.get( timeout = max(0.0, deadline - time.monotonic()) ) )
+                while not self.replies.empty() and len(replies) < no_replies:
+                    replies.append( self.replies.get_nowait() )
+        except queue.Empty:
+            # abandon every outstanding reply, the slots held by lost sample requests are returned
+            framer = self.dev.framer
+            with framer.lock:
+                lost = len( [entry for entry in framer._ClearLocked() if isinstance(entry[2], Sample_Request)] )
+            for i in range(0, lost, 1):
+                self.slots.release()
+            while not self.replies.empty():
+                self.replies.get_nowait()
+            raise TimeoutError('IBM4 reply not received by the reader thread' + ( '' if self.error is None else ': %(v1)s'%{"v1":self.error} ))
+        return replies
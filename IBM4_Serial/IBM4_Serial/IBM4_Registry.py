@@ -0,0 +1,243 @@
+"""
+Per-user registry of the IBM4s that have been attached to a PC
+Each IBM4 is identified by its ISBY identity string and its USB serial number, the registry stores the port
+at which each IBM4 was last found along with an optional user assigned name
+An IBM4 that does not report a USB serial number can only be told apart from other IBM4s by its port,
+so the port takes the place of the serial number in its identity
+
+A registered port is validated with a single *IDN before it is used, a port that fails validation is evicted
+and the IBM4 is searched for again using IBM4_Discovery.FindAllIBM4
+The identity and name of an evicted IBM4 are kept, so the name is restored when the IBM4 is found again
+
+This replaces the .portdata file that FindIBM4 wrote to the current working directory, which could only hold
+one port and had to be hidden on Windows using attrib
+"""
+
+# The registry is stored as JSON in the per-user configuration directory
+# https://docs.python.org/3/library/json.html
+# The file is written to a temporary file which then replaces the registry, so a reader never sees a partial file
+# https://docs.python.org/3/library/os.html#os.replace
+
+import os
+import sys
+import json
+import time
+import tempfile
+import serial.tools.list_ports
+import IBM4_Discovery
+
+MOD_NAME_STR = "IBM4_Registry"
+
+def RegistryPath():
+    """
+    Return the default location of the registry file
+    the environment variable IBM4_REGISTRY can be used to override the default
+    """
+
+    if 'IBM4_REGISTRY' in os.environ:
+        return os.environ['IBM4_REGISTRY']
+    if sys.platform.startswith('win'):
+        base = os.environ.get('APPDATA', os.path.expanduser('~'))
+    elif sys.platform.startswith('darwin'):
+        base = os.path.expanduser('~/Library/Application Support')
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME', os.path.expanduser('~/.config'))
+    return os.path.join(base, 'IBM4', 'registry.json')
+
+def PortSerialNumber(port):
+    """
+    Return the USB serial number reported by the OS for port, None if the port does not report one
+    """
+
+    for info in serial.tools.list_ports.comports():
+        if info.device == port:
+            return info.serial_number
+    return None
+
+class Device_Registry(object):
+    """
+    class for the per-user registry of IBM4 identities and their last known ports
+    """
+
+    def __init__(self, path = None):
+        """
+        Constructor for the Device_Registry object
+
+        path (type: str) is the location of the registry file, path = None => use RegistryPath()
+        """
+
+        self.MOD_NAME_STR = MOD_NAME_STR
+        self.FUNC_NAME = ".Device_Registry()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        self.path = RegistryPath() if path is None else path
+        self.entries = {} # key -> {"idn", "serial_number", "port", "name", "last_seen"}
+        self.Load()
+
+    def __str__(self):
+        """
+        return a string the describes the class
+        """
+
+        return "registry of IBM4 identities and their last known ports"
+
+    @staticmethod
+    def Key(idn, serial_number = None, port = None):
+        """
+        Return the registry key of an IBM4, idn|serial_number, or idn|@port when no serial number is reported
+
+        idn (type: bytes or str) is the ISBY identity string returned by *IDN
+        serial_number (type: str) is the USB serial number of the IBM4, None if it is not reported
+        port (type: str) is the port of the IBM4, it identifies an IBM4 that does not report a serial number
+        """
+
+        if isinstance(idn, bytes):
+            idn = idn.decode(errors = 'replace')
+        if serial_number is None:
+            return '%(v1)s|%(v2)s'%{"v1":idn, "v2":'' if port is None else '@' + port}
+        return '%(v1)s|%(v2)s'%{"v1":idn, "v2":serial_number}
+
+    def Load(self):
+        """
+        Read the registry file, a missing or unreadable file gives an empty registry
+        """
+
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        # entries without a serial number were once all keyed idn|, they are keyed by their port instead
+        for key in [k for k, v in self.entries.items() if k.endswith('|') and v["port"] is not None]:
+            entry = self.entries.pop(key)
+            self.entries.setdefault(self.Key(entry["idn"], None, entry["port"]), entry)
+
+    def Save(self):
+        """
+        Write the registry file
+        """
+
+        self.FUNC_NAME = ".Save()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            folder = os.path.dirname(self.path)
+            if folder != '':
+                os.makedirs(folder, exist_ok = True)
+            fd, tmp = tempfile.mkstemp(dir = folder if folder != '' else '.', suffix = '.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f, indent = 2)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def Record(self, port, idn, serial_number = None, name = None):
+        """
+        Store the port at which an IBM4 was found
+        the name of an IBM4 that is already registered is kept unless a new name is given
+
+        Outputs:
+        key (type: str) is the registry key of the IBM4
+        """
+
+        key = self.Key(idn, serial_number, port)
+        entry = self.entries.get(key, {"name":None})
+        entry.update({"idn":key.split('|')[0], "serial_number":serial_number, "port":port, "last_seen":time.time()})
+        if name is not None:
+            entry["name"] = name
+        # a port can only host one IBM4, the port of any other entry for the same port is out of date
+        for k, v in self.entries.items():
+            if v["port"] == port and k != key:
+                v["port"] = None
+        self.entries[key] = entry
+        return key
+
+    def Name(self, name, port):
+        """
+        Assign a name to the IBM4 registered at port, so that it can be opened with Ser_Iface(device_name = name)
+
+        Outputs:
+        key (type: str) is the registry key of the named IBM4, None if no IBM4 is registered at port
+        """
+
+        for key, entry in self.entries.items():
+            if entry["port"] == port:
+                entry["name"] = name
+                self.Save()
+                return key
+        return None
+
+    def Matches(self, name = None, serial_number = None):
+        """
+        Return the keys of the entries with a known port that match name and serial_number, most recently seen first
+        name = None, serial_number = None => any entry
+        """
+
+        keys = [k for k, v in self.entries.items() if v["port"] is not None
+                and (name is None or v["name"] == name) and (serial_number is None or v["serial_number"] == serial_number)]
+        keys.sort(key = lambda k: self.entries[k]["last_seen"], reverse = True)
+        return keys
+
+    def Validate(self, key, timeout = 0.5):
+        """
+        Confirm with a single *IDN that the IBM4 registered under key is still attached at its registered port
+        """
+
+        entry = self.entries[key]
+        reported = PortSerialNumber(entry["port"])
+        if entry["serial_number"] is not None and reported is not None and reported != entry["serial_number"]:
+            return False # a different USB device now has the port
+        idn = IBM4_Discovery.ProbePort(entry["port"], timeout)
+        return idn is not None and self.Key(idn, entry["serial_number"], entry["port"]) == key
+
+    def Locate(self, name = None, serial_number = None, scan = True, loud = False):
+        """
+        Return the port of a registered IBM4
+
+        The registered ports that match name and serial_number are validated, most recently seen first
+        Ports that fail validation are evicted
+        If no registered port is valid and scan = True the IBM4s attached to the PC are searched for and registered
+
+        Inputs:
+        name (type: str) is the user assigned name of the IBM4, None => any IBM4
+        serial_number (type: str) is the USB serial number of the IBM4, None => any IBM4
+        scan (type: bool) search the attached IBM4s when no registered port is valid
+
+        Outputs:
+        port (type: str) is the port of the IBM4, None if the IBM4 cannot be found
+        """
+
+        self.FUNC_NAME = ".Locate()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            port = None
+            changed = False
+            for key in self.Matches(name, serial_number):
+                if loud: print('Trying registered port: ',self.entries[key]["port"])
+                if self.Validate(key):
+                    port = self.entries[key]["port"]
+                    self.entries[key]["last_seen"] = time.time()
+                    changed = True
+                    break
+                else:
+                    if loud: print('Evicting stale port: ',self.entries[key]["port"],'for',key)
+                    self.entries[key]["port"] = None
+                    changed = True
+
+            if port is None and scan:
+                # registering the new ports keeps the user assigned names, which are stored by identity
+                for item in IBM4_Discovery.FindAllIBM4(serial_number = serial_number, loud = loud):
+                    key = self.Record(item["port"], item["idn"], item["serial_number"])
+                    changed = True
+                    if port is None and (name is None or self.entries[key]["name"] == name):
+                        port = item["port"]
+
+            if changed:
+                self.Save()
+            return port
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+            return None
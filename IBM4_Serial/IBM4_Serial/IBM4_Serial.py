@@ -30,6 +30,7 @@ import matplotlib.pyplot as plt
 #import IBM4_Library_VISA # IBM4 interface based on VISA, 
 import Sweep_Interval
 import IBM4_Lib # IBM4 interface based on Serial
+import IBM4_Discovery
 
 MOD_NAME_STR = "IBM4_Serial"
 HOME = False
@@ -183,48 +184,18 @@ def FHP_Serial():
         print(e)
         
 def FindIBM4(loud = False):
-    # Goes through all listed serial ports looking for an IBM4
-    # Once a port is found, return the port name
+    # Looks for an IBM4 attached to the PC, the candidate ports are probed in parallel
+    # Once a port is found, return the port name, None if no IBM4 is found
     # FHP 30 - 5 - 2024
     
     FUNC_NAME = ".FindIBM4()" # use this in exception handling messages
     ERR_STATEMENT = "Error: " + MOD_NAME_STR + FUNC_NAME
     
     try:
-        if sys.platform.startswith('win'):
-            ports = ['COM%s'%(i+1) for i in range(256)]
-        elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-            # this excludes your current terminal "/dev/tty"
-            ports = glob.glob('/dev/tty[A-Za-z]*')
-        elif sys.platform.startswith('darwin'):
-            ports = glob.glob('/dev/tty.*')
-        else:
-            ERR_STATEMENT = ERR_STATEMENT + '\nUnsupported platform'
-            raise EnvironmentError('Unsupported platform')
-        
-        baud_rate = 9600
+        found = IBM4_Discovery.FindAllIBM4(loud = loud)
         
-        IBM4Port = None # assign IBM4Port to None 
-
-        for port in ports:
-            try:
-                if loud: print('Trying: ',port)
-                s = serial.Serial(port, baud_rate, timeout = 0.05, write_timeout = 0.1, inter_byte_timeout = 0.1, stopbits=serial.STOPBITS_ONE)
-                s.write(b'*IDN\r\n')
-                response = s.read_until('\n',size=None)
-                Code=response.rsplit(b'\r\n')
-                if len(Code) > 2:
-                    #if Code[1]==b'ISBY-UCC-RevA.1':
-                    # test to see if Code[1] contains "ISBY" this is more generic
-                    # will allow for updated rev. no. without necessitating a change in code
-                    if "ISBY" in Code[1]:
-                        if loud: print(f'IBM4 found at {port}')
-                        IBM4Port = port
-                        s.close()
-                        break # stop the search for an IBM4 at the first one you find   
-            except(OSError, serial.SerialException):
-                # Ignore the errors that arise from non-IBM4 serial ports
-                pass
+        IBM4Port = found[0]["port"] if len(found) > 0 else None
+        if loud and IBM4Port is not None: print(f'IBM4 found at {IBM4Port}')
         
         return IBM4Port
     except Exception as e:
@@ -722,17 +693,17 @@ def Class_Testing():
     if SIMP_READ:
         the_dev.WriteAnyPWM('D7',0.0)
         the_dev.WriteAnyPWM('D11',0.0)
-        #the_dev.ReadSimple()
+        #print(the_dev.ReadAllChnnlSnapshot())
         print(the_dev.ReadAverageVoltageAllChnnl())
 
         the_dev.WriteAnyPWM('D7',50)
         the_dev.WriteAnyPWM('D11',25)
-        #the_dev.ReadSimple()
+        #print(the_dev.ReadAllChnnlSnapshot())
         print(the_dev.ReadAverageVoltageAllChnnl())
         
         the_dev.WriteAnyPWM('D7',0.0)
         the_dev.WriteAnyPWM('D11',0.0)
-        #the_dev.ReadSimple()
+        #print(the_dev.ReadAllChnnlSnapshot())
         print(the_dev.ReadAverageVoltageAllChnnl())
 
     del the_dev # destructor for the IBM4 object, closes comms
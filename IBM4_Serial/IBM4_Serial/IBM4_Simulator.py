@@ -0,0 +1,364 @@
+"""
+Simulator for an IBM4 running the UCC circuit python source code
+Lets the library be exercised without a physical IBM4 attached to the PC
+
+IBM4_Firmware interprets the command set used by Ser_Iface and generates the replies that the IBM4 prints
+Pty_Simulator serves an IBM4_Firmware on a pseudo-terminal, so that it can be opened by name like a real IBM4,
+e.g. Ser_Iface(port_name = sim.port_name), this is only available on POSIX systems
+Sim_Port is a serial.Serial-like object that can be passed to Ser_Iface(instr_obj = ...) on any platform
+
+The simulated IBM4 has a virtual loopback from the analog outputs to the analog inputs,
+by default A0 is connected to A2 and A4 and A1 is connected to A3 and A5, D2 is grounded
+so a sweep of A0 reads back at A2 as it would on a bench with the outputs wired to the inputs
+
+The time taken by the IBM4 to process a command is modelled by a fixed cost per command,
+a cost per sample taken by the ADC and a cost per byte of the reply
+"""
+
+# Notes on pseudo-terminals
+# https://docs.python.org/3/library/pty.html
+# https://docs.python.org/3/library/os.html#os.openpty
+# The slave side of the pty is put into raw mode so that the line discipline neither echoes nor translates the commands,
+# the echo of each command is generated by the simulator in the same way as the IBM4
+
+import os
+import sys
+import re
+import time
+import threading
+import numpy
+
+MOD_NAME_STR = "IBM4_Simulator"
+
+# regex for the commands that carry arguments, the name of the command is group 1 and the arguments follow
+CMD_PATTERN = re.compile(rb'^(Mode|Write|PWM|Read|BRead|Average|Diff_Read|Diff_BRead|Diff_Average)([-+.:\d]*)$')
+
+class IBM4_Firmware(object):
+    """
+    class that interprets IBM4 commands and generates the replies printed by the IBM4
+    """
+
+    def __init__(self, idn = b'ISBY-UCC-RevA.1', loopback = None, noise = 0.002, per_cmd = 0.0005, per_sample = 2.0e-5, per_byte = 1.0e-6, seed = None):
+        """
+        Constructor for the IBM4_Firmware object
+
+        idn (type: bytes) is the identity string returned by *IDN
+        loopback (type: dict) maps each analog input index to the analog output index it is connected to,
+        loopback = None => {A2:A0, A3:A1, A4:A0, A5:A1}, inputs that are not listed are grounded
+        noise (type: float) is the standard deviation of the noise added to every reading, units of V
+        per_cmd (type: float) is the time taken to process a command, units of second
+        per_sample (type: float) is the time taken by the ADC to take one sample, units of second
+        per_byte (type: float) is the time taken to send one byte of the reply, units of second
+        seed (type: int) is the seed of the random no. generator used for the noise
+        """
+
+        self.idn = idn
+        self.loopback = {0:0, 1:1, 2:0, 3:1} if loopback is None else loopback
+        self.noise = noise
+        self.per_cmd = per_cmd
+        self.per_sample = per_sample
+        self.per_byte = per_byte
+        self.rng = numpy.random.default_rng(seed)
+
+        self.VMAX = 3.3 # Max output voltage from IBM4
+        self.VMIN = 0.0 # Min output voltage from IBM4
+        self.AC_RANGE = 8.0 # inputs are in the range [-8, +8] in AC mode
+        self.BMAX = 65535 # binary readings are 16 bit
+        self.NO_INPUTS = 5 # A2, A3, A4, A5, D2
+        self.MAX_READS = 10000
+
+        self.mode = 0 # 0 => DC, 1 => AC
+        self.outputs = [0.0, 0.0] # A0, A1
+        self.pwm = {} # pin -> duty cycle in percent
+        self.commands = 0 # no. of commands processed
+
+    def Inputs(self, channel, no_reads):
+        """
+        Return no_reads voltage samples taken at input channel
+        """
+
+        if channel < 0 or channel >= self.NO_INPUTS:
+            raise ValueError('input channel out of range')
+        v = self.outputs[self.loopback[channel]] if channel in self.loopback else 0.0
+        vals = v + self.noise*self.rng.standard_normal(no_reads) if self.noise > 0 else numpy.full(no_reads, v)
+        lo, hi = (-self.AC_RANGE, self.AC_RANGE) if self.mode == 1 else (self.VMIN, self.VMAX)
+        return numpy.clip(vals, lo, hi)
+
+    def Binary(self, vals):
+        """
+        Convert voltage samples to the 16 bit values returned by the BRead commands
+        """
+
+        lo, hi = (-self.AC_RANGE, self.AC_RANGE) if self.mode == 1 else (self.VMIN, self.VMAX)
+        return numpy.rint( (vals - lo) * self.BMAX / (hi - lo) ).astype(numpy.int64)
+
+    def Execute(self, line):
+        """
+        Process a single command
+
+        Inputs:
+        line (type: bytes) is the command without its line terminator
+
+        Outputs:
+        reply (type: bytes) is everything the IBM4 prints in response, starting with the echo of the command
+        cost (type: float) is the time taken by the IBM4 to produce the reply, units of second
+        """
+
+        cmd = line.strip()
+        if cmd == b'':
+            return b'', 0.0 # blank lines are ignored
+        self.commands = self.commands + 1
+        reply = [cmd]
+        no_samples = 0
+        try:
+            m = CMD_PATTERN.match(cmd)
+            if cmd == b'*IDN':
+                reply.append(self.idn)
+            elif cmd in (b'a0', b'b0'):
+                self.outputs[0 if cmd == b'a0' else 1] = 0.0 # grounds the output and prints no result line
+            elif cmd == b'l':
+                vals = [self.Inputs(i, 1)[0] for i in range(self.NO_INPUTS)]
+                no_samples = self.NO_INPUTS
+                reply.append(b'A2 A3 A4 A5 D2')
+                reply.append(self.Format(vals))
+            elif m is not None:
+                name = m.group(1)
+                args = [a for a in m.group(2).split(b':') if a != b'']
+                if name == b'Mode':
+                    self.mode = int(args[0]) if int(args[0]) in (0, 1) else self.mode
+                    reply.append(b'AC Mode' if self.mode == 1 else b'DC Mode')
+                elif name == b'Write':
+                    chnnl, v = int(args[0]), float(args[1])
+                    self.outputs[chnnl] = min(max(v, self.VMIN), self.VMAX)
+                    reply.append(b'A%(v1)d: %(v2)0.2f V'%{b"v1":chnnl, b"v2":self.outputs[chnnl]})
+                elif name == b'PWM':
+                    pin, duty = int(args[0]), int(args[1])
+                    self.pwm[pin] = min(max(duty, 0), 100)
+                    reply.append(b'PWM%(v1)d: %(v2)d%%'%{b"v1":pin, b"v2":self.pwm[pin]})
+                else:
+                    diff = name.startswith(b'Diff_')
+                    no_reads = int(args[2 if diff else 1]) if len(args) > (2 if diff else 1) else 1
+                    if no_reads < 1 or no_reads > self.MAX_READS:
+                        raise ValueError('no. of reads out of range')
+                    vals = self.Inputs(int(args[0]), no_reads)
+                    if diff:
+                        vals = vals - self.Inputs(int(args[1]), no_reads)
+                    no_samples = no_reads * (2 if diff else 1)
+                    if name.endswith(b'Average'):
+                        reply.append(self.Format([numpy.mean(vals)]))
+                    elif name.endswith(b'BRead'):
+                        reply.append(b', '.join(b'%d'%b for b in self.Binary(vals)))
+                    else:
+                        reply.append(self.Format(vals))
+            else:
+                reply.append(b'Error: unrecognised command')
+        except (ValueError, IndexError, KeyError):
+            reply.append(b'Error: invalid arguments')
+
+        data = b'\r\n'.join(reply) + b'\r\n'
+        cost = self.per_cmd + self.per_sample*no_samples + self.per_byte*len(data)
+        return data, cost
+
+    def Format(self, vals):
+        """
+        Format voltage samples as the IBM4 prints them
+        """
+
+        return b', '.join(b'%0.4f'%v for v in vals)
+
+class Pty_Simulator(object):
+    """
+    class that serves an IBM4_Firmware on a pseudo-terminal
+    """
+
+    def __init__(self, firmware = None, realtime = True):
+        """
+        Constructor for the Pty_Simulator object
+
+        firmware (type: IBM4_Firmware) is the simulated IBM4, firmware = None => IBM4_Firmware with default arguments
+        realtime = True => each reply is delayed by the cost given by the firmware latency model
+        """
+
+        self.MOD_NAME_STR = MOD_NAME_STR
+        self.FUNC_NAME = ".Pty_Simulator()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        self.firmware = IBM4_Firmware() if firmware is None else firmware
+        self.realtime = realtime
+        self.master = None
+        self.slave = None
+        self.port_name = None # name of the port to be opened by Ser_Iface
+        self.thread = None
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Stop()
+
+    def __del__(self):
+        self.Stop()
+
+    def Start(self):
+        """
+        Create the pseudo-terminal and start serving commands
+
+        Outputs:
+        port_name (type: str) is the name of the port at which the simulated IBM4 is attached
+        """
+
+        self.FUNC_NAME = ".Start()" # use this in exception handling messages
+        self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
+
+        try:
+            if sys.platform.startswith('win'):
+                self.ERR_STATEMENT = self.ERR_STATEMENT + '\nPseudo-terminals are not available on Windows, use Sim_Port'
+                raise EnvironmentError('Unsupported platform')
+            import tty
+            self.master, self.slave = os.openpty()
+            tty.setraw(self.slave) # the slave is held open so that the port survives clients opening and closing it
+            self.port_name = os.ttyname(self.slave)
+            self.thread = threading.Thread(target = self._Serve, name = 'IBM4_Simulator', daemon = True)
+            self.thread.start()
+            return self.port_name
+        except Exception as e:
+            print(self.ERR_STATEMENT)
+            print(e)
+
+    def Stop(self):
+        """
+        Stop serving commands and remove the pseudo-terminal
+        """
+
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master = None
+        self.slave = None
+        if self.thread is not None:
+            self.thread.join(timeout = 1.0)
+            self.thread = None
+
+    def _Serve(self):
+        """
+        Read commands from the pseudo-terminal and write the replies, runs until the pseudo-terminal is closed
+        """
+
+        buffer = b''
+        master = self.master
+        while True:
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                return # the pseudo-terminal has been closed
+            if len(data) == 0:
+                return
+            buffer = buffer + data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                reply, cost = self.firmware.Execute(line)
+                try:
+                    if self.realtime and cost > 0:
+                        # the echo is sent as soon as the command is received, the result follows once it has been produced
+                        end = reply.find(b'\n') + 1
+                        os.write(master, reply[:end])
+                        time.sleep(cost)
+                        reply = reply[end:]
+                    os.write(master, reply)
+                except OSError:
+                    return
+
+class Sim_Port(object):
+    """
+    class for a serial.Serial-like port attached to an IBM4_Firmware, works on any platform
+    replies become readable once the modelled time taken by the IBM4 to produce them has passed
+    """
+
+    def __init__(self, firmware = None, realtime = True, name = 'IBM4_Simulator'):
+        """
+        Constructor for the Sim_Port object
+
+        firmware (type: IBM4_Firmware) is the simulated IBM4, firmware = None => IBM4_Firmware with default arguments
+        realtime = True => each reply is delayed by the cost given by the firmware latency model
+        """
+
+        self.firmware = IBM4_Firmware() if firmware is None else firmware
+        self.realtime = realtime
+        self.name = name
+        self.timeout = 0.05 # longest time that read may block, units of second
+        self.is_open = True
+        self.tx = b'' # partial command written by the host
+        self.rx = bytearray() # reply bytes that have become readable
+        self.scheduled = [] # (time.monotonic() at which the reply is ready, reply)
+        self.busy_until = 0.0 # the IBM4 processes one command at a time
+
+    def isOpen(self):
+        return self.is_open
+
+    def _Release(self):
+        """
+        Move the replies whose modelled processing time has passed into the receive buffer
+        """
+
+        now = time.monotonic()
+        while len(self.scheduled) > 0 and self.scheduled[0][0] <= now:
+            self.rx += self.scheduled.pop(0)[1]
+
+    @property
+    def in_waiting(self):
+        self._Release()
+        return len(self.rx)
+
+    def write(self, data):
+        self.tx = self.tx + bytes(data)
+        while b'\n' in self.tx:
+            line, self.tx = self.tx.split(b'\n', 1)
+            reply, cost = self.firmware.Execute(line)
+            if self.realtime:
+                # the echo is sent as soon as the command is received, the result follows once it has been produced
+                end = reply.find(b'\n') + 1
+                start = max(self.busy_until, time.monotonic())
+                self.busy_until = start + cost
+                self.scheduled.append( (start, reply[:end]) )
+                self.scheduled.append( (self.busy_until, reply[end:]) )
+            else:
+                self.rx += reply
+        return len(data)
+
+    def read(self, size = 1):
+        self._Release()
+        if len(self.rx) == 0:
+            # block until the next reply is ready, for at most timeout
+            wait = self.timeout if len(self.scheduled) == 0 else min(self.scheduled[0][0] - time.monotonic(), self.timeout)
+            time.sleep( max(0.0, wait) )
+            self._Release()
+        data = bytes(self.rx[:size])
+        del self.rx[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self.rx.clear()
+        self.scheduled.clear()
+
+    def close(self):
+        self.is_open = False
+
+def main():
+    # serve a simulated IBM4 until interrupted
+    sim = Pty_Simulator()
+    port = sim.Start()
+    if port is not None:
+        print('Simulated IBM4 attached at',port)
+        print('Press Ctrl-C to stop')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            sim.Stop()
+
+if __name__ == '__main__':
+    main()
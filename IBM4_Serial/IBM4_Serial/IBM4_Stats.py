@@ -0,0 +1,196 @@
+"""
+Streaming statistics for IBM4 readings
+
+Running_Stats keeps the count, mean, variance, min and max of a stream of readings and is updated one chunk at a time,
+so the readings themselves can be dropped as soon as they have been counted and the memory used does not grow with
+the no. of readings, e.g. when an input is monitored for days
+Percentiles are optional, they are estimated from a Range_Sketch, i.e. a fixed-bin histogram over the input range
+
+Usage
+acc = the_dev.RunningStats() # sketch range is set by the read mode of the IBM4
+while monitoring:
+    the_dev.ReadMultipleVoltage('A2', 1000, stats = acc) # the returned readings can be discarded
+print(acc.Summary())
+
+The standard error of the mean assumes the readings are independent, for correlated noise it is an underestimate
+"""
+
+# Welford's algorithm and its parallel form, used to combine the statistics of two chunks
+# https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Welford's_online_algorithm
+# https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+
+import numpy
+
+MOD_NAME_STR = "IBM4_Stats"
+
+class Range_Sketch(object):
+    """
+    class for a fixed-bin histogram of readings over the range [lo, hi], used to estimate percentiles
+    readings outside the range are counted in the end bins
+    """
+
+    def __init__(self, lo, hi, bins = 4096):
+        """
+        Constructor for the Range_Sketch object
+
+        lo, hi (type: float) are the limits of the range of the readings, e.g. [0, 3.3] for voltages in DC mode
+        bins (type: int) is the no. of bins, the percentiles are resolved to (hi - lo) / bins
+        """
+
+        self.lo = float(lo)
+        self.hi = float(hi)
+        self.bins = bins
+        self.width = (self.hi - self.lo) / bins
+        self.counts = numpy.zeros(bins, dtype = numpy.int64)
+
+    def Reset(self):
+        """
+        Remove all recorded readings
+        """
+
+        self.counts[:] = 0
+
+    def Update(self, vals):
+        """
+        Record the readings in vals
+        """
+
+        idx = numpy.clip( ((numpy.asarray(vals, dtype = numpy.float64) - self.lo) / self.width).astype(numpy.int64), 0, self.bins - 1 )
+        self.counts += numpy.bincount(idx, minlength = self.bins)
+
+    def Merge(self, other):
+        """
+        Add the readings recorded by other, a Range_Sketch with the same range and no. of bins
+        """
+
+        if other.bins != self.bins or other.lo != self.lo or other.hi != self.hi:
+            raise ValueError('Range_Sketch objects with different bins cannot be merged')
+        self.counts += other.counts
+
+    def Percentile(self, p):
+        """
+        Return the value below which p percent of the recorded readings lie, None if no readings are recorded
+        The value is the middle of the bin that contains the percentile
+        """
+
+        cumulative = numpy.cumsum(self.counts)
+        if cumulative[-1] == 0:
+            return None
+        idx = int( numpy.searchsorted(cumulative, max(1, numpy.ceil(p * cumulative[-1] / 100.0))) )
+        return self.lo + (idx + 0.5) * self.width
+
+class Running_Stats(object):
+    """
+    class for the count, mean, variance, min and max of a stream of readings, updated chunk by chunk in O(1) memory
+    """
+
+    def __init__(self, sketch = None):
+        """
+        Constructor for the Running_Stats object
+
+        sketch (type: Range_Sketch) is updated with every chunk so that percentiles can be estimated, None => no percentiles
+        """
+
+        self.sketch = sketch
+        self.Reset()
+
+    def Reset(self):
+        """
+        Remove all recorded readings
+        """
+
+        self.count = 0
+        self.mean = 0.0
+        self.M2 = 0.0 # sum of the squared deviations from the mean
+        self.min = numpy.inf
+        self.max = -numpy.inf
+        if self.sketch is not None:
+            self.sketch.Reset()
+
+    def _Combine(self, n, mean, M2, vmin, vmax):
+        """
+        Combine the statistics of n readings with mean, M2, vmin, vmax into the running statistics
+        """
+
+        n_a = self.count
+        self.count = n_a + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / self.count
+        self.M2 = self.M2 + M2 + delta * delta * n_a * n / self.count
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+
+    def Update(self, vals):
+        """
+        Add a chunk of readings, vals is a numpy array, a list or a single reading
+        """
+
+        chunk = numpy.asarray(vals, dtype = numpy.float64).ravel()
+        n = len(chunk)
+        if n == 0:
+            return
+        mean = float(numpy.mean(chunk))
+        self._Combine(n, mean, float(numpy.sum( (chunk - mean)**2 )), float(numpy.min(chunk)), float(numpy.max(chunk)))
+        if self.sketch is not None:
+            self.sketch.Update(chunk)
+
+    def Merge(self, other):
+        """
+        Add the readings recorded by other, e.g. the statistics of the same input on another thread or IBM4
+        """
+
+        if other.count == 0:
+            return
+        self._Combine(other.count, other.mean, other.M2, other.min, other.max)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.Merge(other.sketch)
+
+    def Variance(self, ddof = 0):
+        """
+        Return the variance of the readings, ddof = 0 => population variance, ddof = 1 => sample variance, None if there are too few readings
+        """
+
+        return None if self.count <= ddof else self.M2 / (self.count - ddof)
+
+    def Std(self, ddof = 0):
+        """
+        Return the standard deviation of the readings, None if there are too few readings
+        """
+
+        var = self.Variance(ddof)
+        return None if var is None else float(numpy.sqrt(var))
+
+    def StdErr(self):
+        """
+        Return the standard error of the mean, i.e. sample standard deviation / sqrt(count), None if there are fewer than two readings
+        """
+
+        std = self.Std(ddof = 1)
+        return None if std is None else std / float(numpy.sqrt(self.count))
+
+    def Amplitude(self):
+        """
+        Return half the range of the readings, the uncertainty reported by the Ser_Iface multiple read methods
+        """
+
+        return None if self.count == 0 else 0.5*( self.max - self.min )
+
+    def Percentile(self, p):
+        """
+        Return the estimated value below which p percent of the readings lie, None if there is no sketch
+        """
+
+        return None if self.sketch is None else self.sketch.Percentile(p)
+
+    def Summary(self):
+        """
+        Return the count, mean, standard deviation, standard error, min and max of the readings,
+        plus p1, p50 and p99 when there is a sketch
+        """
+
+        if self.count == 0:
+            return {"count":0}
+        res = {"count":self.count, "mean":self.mean, "std":self.Std(ddof = 1), "stderr":self.StdErr(), "min":self.min, "max":self.max}
+        if self.sketch is not None:
+            res.update( {"p1":self.Percentile(1), "p50":self.Percentile(50), "p99":self.Percentile(99)} )
+        return res
@@ -0,0 +1,453 @@
+"""
+Sweep engine used by the IBM4 sweep methods
+The engine sets each value of a swept output, waits, reads the inputs and stores the readings in a buffer that is
+allocated once before the sweep starts, every row is filled in place so the cost of a sweep is linear in the no. of steps
+
+The sweeps originally grew their result with numpy.append on the first step and numpy.vstack on every later step,
+which copies the whole array at every step
+
+The engine only needs a function that sets the swept value and a function that reads the inputs,
+so the same engine is used with Ser_Iface and with the module functions in IBM4_Library_VISA
+
+After each step the engine either waits a fixed delay or, given a Settle_Criterion and a poll function, polls the inputs
+until two consecutive readings agree within a tolerance, so a circuit that settles quickly is swept at the speed of the IBM4
+and a slow circuit is given up to max_wait to settle, the settle time observed at each step is kept in settle_times
+
+Grid_Engine sweeps two outputs over a grid in serpentine order and stores the readings in a 3D array indexed by the two set-values
+
+Given a checkpoint_file the engine periodically saves the completed rows and the sweep metadata, and saves them again when the sweep
+stops for any reason, e.g. a USB disconnect. Running the same sweep with the same checkpoint_file, e.g. after reconnecting,
+restores the completed rows and continues from the first step that was not completed
+The checkpoint is removed when the sweep completes, so running the same sweep again measures it again
+"""
+
+# A 2D float array whose columns all have the same type can be viewed as a 1D structured array without a copy,
+# so the data can be accessed either by column no. or by column name, e.g. table['A3']
+# https://numpy.org/doc/stable/user/basics.rec.html
+# The checkpoint is a .npz file written to a temporary file which then replaces the checkpoint, so a crash never leaves a partial file
+# https://numpy.org/doc/stable/reference/generated/numpy.savez.html
+
+import os
+import json
+import time
+import tempfile
+import numpy
+
+MOD_NAME_STR = "IBM4_Sweep"
+
+class Settle_Criterion(object):
+    """
+    class for the parameters of the adaptive settling used between the steps of a sweep
+    """
+
+    def __init__(self, tolerance = 0.01, max_wait = 0.25, min_wait = 0.0, poll_interval = 0.0, channel = None):
+        """
+        Constructor for the Settle_Criterion object
+
+        tolerance (type: float) the inputs are settled when consecutive readings differ by at most tolerance at every polled input, units of V
+        max_wait (type: float) longest time spent polling before the step is read anyway, units of second
+        min_wait (type: float) time waited after the write before the first poll, units of second
+        poll_interval (type: float) time waited between polls, units of second, 0.0 => poll back-to-back
+        channel (type: str) is the label of the input that is polled, None => poll every input
+        """
+
+        self.tolerance = tolerance
+        self.max_wait = max_wait
+        self.min_wait = min_wait
+        self.poll_interval = poll_interval
+        self.channel = channel
+
+class Sweep_Engine(object):
+    """
+    class for a sweep that stores its readings in a preallocated buffer
+    by default a single output is swept, given set_columns the outputs named in set_columns are set together at each step
+    """
+
+    def __init__(self, write_func, read_func, channels, delay = 0.25, stream_file = None, settle = None, poll_func = None, 
+                 checkpoint_file = None, meta = None, set_columns = None):
+        """
+        Constructor for the Sweep_Engine object
+
+        write_func is a callable that sets the swept output, write_func(v_set), 
+        with set_columns v_set is an array holding the set-value of each output in the order of set_columns
+        read_func is a callable that returns the readings at every input channel, in the order of channels
+        channels (type: list) contains the labels of the input channels, e.g. ['A2', 'A3', 'A4', 'A5', 'D2']
+        delay (type: float) is the time waited between setting the output and reading the inputs, units of second
+        stream_file (type: str) is the name of a file to which each row is appended as a line of CSV as soon as it is read,
+        None => the rows are only kept in memory
+        settle (type: Settle_Criterion) replaces the fixed delay by adaptive settling, None => wait the fixed delay
+        poll_func is a callable that returns the readings at the polled inputs, it must be given when settle is given
+        checkpoint_file (type: str) is the name of the file to which the completed rows are saved, None => no checkpoint is kept
+        a sweep that finds a checkpoint of the same sweep in checkpoint_file resumes from it, delete the file to start afresh
+        meta (type: dict) describes the sweep, e.g. the channels and no. of averages, it is saved in the checkpoint
+        and a checkpoint is only resumed by a sweep with the same meta
+        set_columns (type: list) contains the labels of the outputs that are set at each step, e.g. ['D1', 'D9'], None => ['v_set']
+        """
+
+        self.write_func = write_func
+        self.read_func = read_func
+        self.no_set = 1 if set_columns is None else len(set_columns) # no. of columns holding set-values
+        self.columns = (['v_set'] if set_columns is None else list(set_columns)) + list(channels)
+        self.dtype = numpy.dtype( [(k, numpy.float64) for k in self.columns] )
+        self.delay = delay
+        self.stream_file = stream_file
+        self.data = None # (no_steps, no. set-values + no. channels) array of the sweep data
+        self.table = None # structured view of data with one named field per column
+        self.rows = 0 # no. of rows that have been filled
+        if settle is not None and poll_func is None:
+            raise Exception('Sweep_Engine: adaptive settling needs a poll_func')
+        self.settle = settle
+        self.poll_func = poll_func
+        self.settle_times = None # time from the write to the inputs being settled at each step, units of second
+        self.settled = None # settled[i] = False => step i was read after max_wait without the inputs settling
+        self.polls = None # no. of polls made at each step
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = 10.0 # time between checkpoints, units of second
+        self.t_checkpoint = 0.0 # time.monotonic() value when the last checkpoint was written
+        self.meta = {} if meta is None else json.loads( json.dumps(meta) ) # as it will read back from the checkpoint
+        self.set_values = [] # set-values of each swept output
+        self.start_row = 0 # no. of rows restored from the checkpoint
+
+    def Allocate(self, no_steps):
+        """
+        Allocate the buffer for a sweep of no_steps steps, unfilled entries are NaN
+        """
+
+        self.data = numpy.full( (no_steps, len(self.columns)), numpy.nan )
+        self.table = self.data.view(self.dtype).reshape(no_steps)
+        self.rows = 0
+        self.settle_times = numpy.full(no_steps, numpy.nan)
+        self.settled = numpy.zeros(no_steps, dtype = bool)
+        self.polls = numpy.zeros(no_steps, dtype = int)
+        return self.data
+
+    def Settle(self, t_write):
+        """
+        Poll the inputs until consecutive readings agree within settle.tolerance or until settle.max_wait has passed since t_write
+
+        Outputs:
+        t_settle (type: float) is the time from t_write to the last poll, units of second
+        settled (type: bool) settled = False => max_wait passed before the inputs settled
+        polls (type: int) is the no. of polls made
+        """
+
+        crit = self.settle
+        if crit.min_wait > 0:
+            time.sleep(crit.min_wait)
+        prev = self.poll_func()
+        polls = 1
+        while True:
+            if crit.poll_interval > 0:
+                time.sleep(crit.poll_interval)
+            vals = self.poll_func()
+            polls = polls + 1
+            t_settle = time.perf_counter() - t_write
+            if prev is not None and vals is not None and numpy.max( numpy.abs( numpy.asarray(vals) - prev ) ) <= crit.tolerance:
+                return t_settle, True, polls
+            if t_settle >= crit.max_wait:
+                return t_settle, False, polls
+            prev = None if vals is None else numpy.asarray(vals)
+
+    def Wait(self, k):
+        """
+        Wait the fixed delay, or settle and record the settle time as that of step k, after the outputs have been written
+        """
+
+        if self.settle is not None:
+            t_write = time.perf_counter()
+            self.settle_times[k], self.settled[k], self.polls[k] = self.Settle(t_write)
+        elif self.delay > 0:
+            time.sleep(self.delay)
+
+    def Step(self, i, v_set):
+        """
+        Set the output to v_set, wait or settle, read the inputs and store the readings in row i
+        """
+
+        self.write_func(v_set)
+        self.Wait(i)
+        vals = self.read_func()
+        if vals is None or len(vals) != len(self.columns) - self.no_set:
+            raise Exception('Sweep_Engine: readings at v_set = %(v1)s not received'%{"v1":v_set})
+        self.data[i, :self.no_set] = v_set
+        self.data[i, self.no_set:] = vals
+        self.rows = i + 1
+
+    def Run(self, v_set_values):
+        """
+        Perform the sweep
+
+        Inputs:
+        v_set_values (type: sequence) contains the value of the swept output at each step, 
+        with set_columns it has shape (no_steps, len(set_columns))
+
+        Outputs:
+        data (type: numpy array) has one row per step of the form [v_set, readings at each channel], with set_columns v_set is replaced by the set-values
+        the same data is available as a structured array with named columns from table
+        """
+
+        self.Allocate( len(v_set_values) )
+        self.set_values = [ numpy.asarray(v_set_values, dtype = float) ]
+        start = self.Restore()
+        stream = self.OpenStream(start)
+        try:
+            for i in range(start, len(v_set_values), 1):
+                self.Step(i, v_set_values[i])
+                self.Completed(stream, i, list(self.data[i]))
+        finally:
+            self.Finish(stream, len(v_set_values))
+        return self.data
+
+    def OpenStream(self, start):
+        """
+        Open the stream file, the rows are appended to an existing stream file when the sweep resumes at row start > 0
+        """
+
+        if self.stream_file is None:
+            return None
+        if start > 0 and os.path.exists(self.stream_file):
+            return open(self.stream_file, 'a')
+        stream = open(self.stream_file, 'w')
+        stream.write( ','.join(self.columns + (['settle_time'] if self.settle is not None else [])) + '\n' )
+        return stream
+
+    def Completed(self, stream, k, row):
+        """
+        Write row, the values of step k, to the stream file and write a checkpoint if checkpoint_interval has passed since the last one
+        """
+
+        if stream is not None:
+            row = row + ([self.settle_times[k]] if self.settle is not None else [])
+            stream.write( ','.join( '%(v1)0.6f'%{"v1":v} for v in row ) + '\n' )
+            stream.flush() # the row is on disk before the next step starts
+        if self.checkpoint_file is not None and time.monotonic() - self.t_checkpoint >= self.checkpoint_interval:
+            self.Checkpoint()
+
+    def Finish(self, stream, no_steps):
+        """
+        Close the stream file and write the final checkpoint, called whether or not the sweep completed
+        The checkpoint of a completed sweep is removed, there is nothing left to resume
+        """
+
+        if stream is not None:
+            stream.close()
+        if self.checkpoint_file is not None:
+            if self.rows < no_steps:
+                self.Checkpoint()
+                print('Sweep stopped after %(v1)d of %(v2)d steps, completed steps saved to %(v3)s'%{"v1":self.rows, "v2":no_steps, "v3":self.checkpoint_file})
+            elif os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+
+    def Checkpoint(self):
+        """
+        Save the completed rows and the sweep metadata to checkpoint_file
+        """
+
+        folder = os.path.dirname(self.checkpoint_file)
+        info = {"engine":type(self).__name__, "columns":self.columns, "meta":self.meta, "rows":self.rows, "delay":self.delay, 
+                "settle":None if self.settle is None else vars(self.settle), "saved":time.time()}
+        arrays = {"values_%(v1)d"%{"v1":k}:v for k, v in enumerate(self.set_values)}
+        fd, tmp = tempfile.mkstemp(dir = folder if folder != '' else '.', suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            numpy.savez(f, data = self.data, settle_times = self.settle_times, settled = self.settled, polls = self.polls, 
+                        info = numpy.array( json.dumps(info) ), **arrays)
+        os.replace(tmp, self.checkpoint_file)
+        self.t_checkpoint = time.monotonic()
+
+    def Restore(self):
+        """
+        Restore the completed rows from checkpoint_file when it holds a checkpoint of this sweep that was not completed
+
+        Outputs:
+        start (type: int) is the no. of completed rows, i.e. the step at which the sweep continues
+        """
+
+        self.start_row = 0
+        self.t_checkpoint = time.monotonic()
+        if self.checkpoint_file is None or not os.path.exists(self.checkpoint_file):
+            return 0
+        info, arrays = LoadCheckpoint(self.checkpoint_file)
+        c1 = info["engine"] == type(self).__name__ and info["columns"] == self.columns and info["meta"] == self.meta
+        c2 = len(self.set_values) == len([k for k in arrays if k.startswith('values_')])
+        c3 = c2 and all( numpy.array_equal(arrays["values_%(v1)d"%{"v1":k}], v) for k, v in enumerate(self.set_values) )
+        if not (c1 and c3):
+            raise Exception('%(v1)s holds a checkpoint of a different sweep, delete it or use another checkpoint_file'%{"v1":self.checkpoint_file})
+        if info["rows"] >= len(self.settle_times):
+            return 0 # the checkpointed sweep was completed, the sweep starts again and the checkpoint is replaced
+        self.data[...] = arrays["data"]
+        self.settle_times[:] = arrays["settle_times"]
+        self.settled[:] = arrays["settled"]
+        self.polls[:] = arrays["polls"]
+        self.rows = info["rows"]
+        self.start_row = self.rows
+        print('Resuming sweep at step %(v1)d of %(v2)d from %(v3)s'%{"v1":self.rows, "v2":len(self.settle_times), "v3":self.checkpoint_file})
+        return self.rows
+
+    def SettleSummary(self):
+        """
+        Return the mean and max. settle time in units of second and the no. of steps that did not settle within max_wait
+        None if adaptive settling was not used
+        """
+
+        if self.settle is None or self.rows == 0:
+            return None
+        t = self.settle_times[:self.rows]
+        return {"mean":float(numpy.mean(t)), "max":float(numpy.max(t)), "unsettled":int(self.rows - numpy.count_nonzero(self.settled[:self.rows])), 
+                "polls":int(numpy.sum(self.polls[:self.rows]))}
+
+    def PrintSettle(self):
+        """
+        Print the settle time summary
+        """
+
+        res = self.SettleSummary()
+        if res is not None:
+            print('Settle time mean %(v1)0.1f ms, max %(v2)0.1f ms, %(v3)d steps not settled within %(v4)0.3f s'%{"v1":1000*res["mean"], 
+                  "v2":1000*res["max"], "v3":res["unsettled"], "v4":self.settle.max_wait})
+
+def Serpentine(no_inner, no_outer):
+    """
+    Return the order in which the points of a no_inner x no_outer grid are visited by a serpentine sweep
+    the inner index runs up on even outer steps and down on odd outer steps, so consecutive points differ by one step on one axis
+
+    Outputs:
+    order (type: numpy array) has shape (no_inner * no_outer, 2), each row is (inner index, outer index)
+    """
+
+    inner = numpy.tile( numpy.arange(no_inner), (no_outer, 1) )
+    inner[1::2] = inner[1::2, ::-1] # reverse the direction of every second pass
+    outer = numpy.repeat( numpy.arange(no_outer), no_inner )
+    return numpy.column_stack( [inner.reshape(-1), outer] )
+
+class Grid_Engine(Sweep_Engine):
+    """
+    class for a sweep of two outputs over a grid of set-values that stores its readings in a preallocated 3D buffer
+
+    The grid is visited in serpentine order, the inner output is swept up, the outer output is stepped, the inner output is swept down, ...
+    so only one output changes between consecutive points and it changes by a single step, which keeps the slew and the settle time small
+    """
+
+    def __init__(self, write_funcs, read_func, channels, delay = 0.25, stream_file = None, settle = None, poll_func = None, 
+                 checkpoint_file = None, meta = None, axes = ('A0', 'A1')):
+        """
+        Constructor for the Grid_Engine object
+
+        write_funcs (type: tuple) contains a callable that sets the inner output and a callable that sets the outer output
+        axes (type: tuple) contains the labels of the inner and the outer output, used as column names in the stream file
+        the remaining inputs are as for Sweep_Engine
+        """
+
+        Sweep_Engine.__init__(self, None, read_func, channels, delay, stream_file, settle, poll_func, checkpoint_file, meta)
+        self.write_funcs = write_funcs
+        self.channels = list(channels)
+        self.columns = list(axes) + self.channels
+        self.axes = [None, None] # set-values along the inner and the outer axis
+        self.order = None # (inner index, outer index) of each step in the order the steps are made
+
+    def Allocate(self, no_inner, no_outer):
+        """
+        Allocate the buffer for a no_inner x no_outer grid, unfilled entries are NaN
+        settle_times, settled and polls are indexed by step, i.e. in the order given by self.order
+        """
+
+        no_steps = no_inner * no_outer
+        self.data = numpy.full( (no_inner, no_outer, len(self.channels)), numpy.nan )
+        self.table = None
+        self.rows = 0
+        self.settle_times = numpy.full(no_steps, numpy.nan)
+        self.settled = numpy.zeros(no_steps, dtype = bool)
+        self.polls = numpy.zeros(no_steps, dtype = int)
+        self.order = Serpentine(no_inner, no_outer)
+        return self.data
+
+    def Run(self, inner_values, outer_values):
+        """
+        Perform the sweep
+
+        Inputs:
+        inner_values (type: sequence) contains the set-values of the inner output
+        outer_values (type: sequence) contains the set-values of the outer output
+
+        Outputs:
+        data (type: numpy array) has shape (len(inner_values), len(outer_values), no. channels),
+        data[i, j] holds the readings at each channel with the inner output at inner_values[i] and the outer output at outer_values[j]
+        """
+
+        self.Allocate( len(inner_values), len(outer_values) )
+        self.axes = [ numpy.asarray(inner_values, dtype = float), numpy.asarray(outer_values, dtype = float) ]
+        self.set_values = self.axes
+        start = self.Restore()
+        stream = self.OpenStream(start)
+        try:
+            last = (-1, -1)
+            for k in range(start, len(self.order), 1):
+                i, j = self.order[k]
+                # only the output whose index has changed is written
+                if j != last[1]:
+                    self.write_funcs[1](self.axes[1][j])
+                if i != last[0]:
+                    self.write_funcs[0](self.axes[0][i])
+                last = (i, j)
+                self.Wait(k)
+                vals = self.read_func()
+                if vals is None or len(vals) != len(self.channels):
+                    raise Exception('Grid_Engine: readings at (%(v1)0.3f, %(v2)0.3f) not received'%{"v1":self.axes[0][i], "v2":self.axes[1][j]})
+                self.data[i, j] = vals
+                self.rows = k + 1
+                self.Completed(stream, k, [self.axes[0][i], self.axes[1][j]] + list(self.data[i, j]))
+        finally:
+            self.Finish(stream, len(self.order))
+        return self.data
+
+def LoadCheckpoint(file_name):
+    """
+    Read a sweep checkpoint file
+
+    Outputs:
+    info (type: dict) contains the sweep metadata and the no. of completed rows
+    arrays (type: dict) contains the data array, the settle arrays and the set-values of each swept output, values_0, values_1, ...
+    """
+
+    with numpy.load(file_name) as f:
+        arrays = {k:f[k] for k in f.files}
+    info = json.loads( str(arrays.pop("info")) )
+    return info, arrays
+
+def Refine(v_set, response, tolerance, delta_min = 0.01, max_new = None):
+    """
+    Choose the set-values to add to a sweep so that the points are concentrated where the response curves
+
+    The error of the piecewise linear curve through the measured points is estimated at each interior point k as the distance
+    of response[k] from the chord joining its neighbours, each interval is scored by the larger error at its two ends
+    and the midpoint of every interval whose score exceeds tolerance is added, largest score first
+
+    Inputs:
+    v_set (type: numpy array) contains the set-values measured so far in ascending order
+    response (type: numpy array) contains the response measured at each set-value
+    tolerance (type: float) is the largest acceptable error of the piecewise linear curve, in the units of response
+    delta_min (type: float) is the resolution of the set-value, midpoints are rounded to a multiple of delta_min and an interval
+    that cannot be split into two intervals of at least delta_min is not refined
+    max_new (type: int) is the max. no. of set-values returned, None => no limit
+
+    Outputs:
+    new_values (type: numpy array) contains the set-values to be measured in ascending order, empty when the curve is resolved
+    """
+
+    v_set = numpy.asarray(v_set, dtype = float)
+    response = numpy.asarray(response, dtype = float)
+    if len(v_set) < 3:
+        return numpy.array([])
+
+    # distance of each interior point from the chord joining its neighbours
+    err = numpy.zeros(len(v_set))
+    frac = (v_set[1:-1] - v_set[:-2]) / (v_set[2:] - v_set[:-2])
+    err[1:-1] = numpy.abs( response[1:-1] - (response[:-2] + frac * (response[2:] - response[:-2])) )
+    score = numpy.maximum(err[:-1], err[1:]) # score of the interval [v_set[k], v_set[k+1]]
+
+    mid = numpy.round( 0.5 * (v_set[:-1] + v_set[1:]) / delta_min ) * delta_min
+    splittable = (mid - v_set[:-1] > 0.5 * delta_min) & (v_set[1:] - mid > 0.5 * delta_min)
+    candidates = numpy.nonzero( (score > tolerance) & splittable )[0]
+    candidates = candidates[ numpy.argsort(-score[candidates], kind = 'stable') ]
+    if max_new is not None:
+        candidates = candidates[:max(0, max_new)]
+    return numpy.sort( mid[candidates] )
@@ -0,0 +1,244 @@
+"""
+Wire-level recording and replay of an IBM4 session
+
+Trace_Recorder wraps an open port and writes every byte sent to and received from the IBM4 to a binary trace file,
+each chunk is stored with its direction and a monotonic timestamp
+Trace_Replay is a serial.Serial-like port that plays a trace file back to Ser_Iface, either at full speed or at the recorded pace
+so that a session recorded in the field can be reproduced, and the host side code profiled, with no IBM4 attached
+
+Recording
+the_dev = IBM4_Lib.Ser_Iface(instr_obj = IBM4_Trace.OpenRecorder('COM4', 'session.ibm4trace'))
+
+Replay
+the_dev = IBM4_Lib.Ser_Iface(instr_obj = IBM4_Trace.Trace_Replay('session.ibm4trace', paced = False))
+
+The replay hands each recorded chunk of received bytes to the host once the host has written all of the bytes that were
+written before that chunk was received, so the host must make the same calls in the same order as the recorded session
+"""
+
+# Binary file layout, all integers little-endian
+# header: MAGIC, then a record for every chunk
+# record: direction (uint8), time since the start of the recording in ns (uint64), no. of bytes (uint32), bytes
+# https://docs.python.org/3/library/struct.html
+
+import time
+import bisect
+import struct
+import serial # this package is actually called pyserial, install using py -m pip install pyserial
+
+MOD_NAME_STR = "IBM4_Trace"
+
+MAGIC = b'IBM4TRC1'
+RECORD = struct.Struct('<BQI')
+
+# record directions
+TX = 0 # bytes written to the IBM4
+RX = 1 # bytes received from the IBM4
+RESET = 2 # the host cleared its input buffer, no bytes
+
+class Trace_Recorder(object):
+    """
+    class for a port wrapper that records all traffic on the port to a trace file
+    every attribute that is not defined here is passed through to the wrapped port
+    """
+
+    def __init__(self, port, file_name):
+        """
+        Constructor for the Trace_Recorder object
+
+        port is the open port object, e.g. a serial.Serial
+        file_name (type: str) is the name of the trace file, an existing file is overwritten
+        """
+
+        self.port = port
+        self.file_name = file_name
+        self.trace = open(file_name, 'wb')
+        self.trace.write(MAGIC)
+        self.start = time.monotonic_ns()
+        self.records = 0
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def _Record(self, direction, data):
+        self.trace.write( RECORD.pack(direction, time.monotonic_ns() - self.start, len(data)) )
+        self.trace.write(data)
+        self.records = self.records + 1
+
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
+
+    def write(self, data):
+        self._Record(TX, bytes(data))
+        return self.port.write(data)
+
+    def read(self, size = 1):
+        data = self.port.read(size)
+        if len(data) > 0:
+            self._Record(RX, data)
+        return data
+
+    def reset_input_buffer(self):
+        self._Record(RESET, b'')
+        self.port.reset_input_buffer()
+
+    def close(self):
+        if not self.trace.closed:
+            self.trace.close()
+        self.port.close()
+
+def OpenRecorder(port_name, file_name, baud_rate = 9600, timeout = 0.05, write_timeout = 0.5):
+    """
+    Open port_name with the settings used by Ser_Iface and record its traffic to file_name
+
+    Outputs:
+    port (type: Trace_Recorder) can be passed to Ser_Iface(instr_obj = port)
+    """
+
+    return Trace_Recorder( serial.Serial(port_name, baud_rate, timeout = timeout, write_timeout = write_timeout, stopbits = serial.STOPBITS_ONE), file_name )
+
+def LoadTrace(file_name):
+    """
+    Read a trace file
+
+    Outputs:
+    records (type: list) contains (direction, time in units of second, bytes) for each record in the order they were recorded
+    """
+
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('%(v1)s is not an IBM4 trace file'%{"v1":file_name})
+
+    records = []
+    pos = len(MAGIC)
+    while pos + RECORD.size <= len(data):
+        direction, t, n = RECORD.unpack_from(data, pos)
+        pos = pos + RECORD.size
+        records.append( (direction, t * 1.0e-9, data[pos:pos+n]) )
+        pos = pos + n
+    return records
+
+class Trace_Replay(object):
+    """
+    class for a serial.Serial-like port that replays a trace file
+    """
+
+    def __init__(self, file_name, paced = False, strict = False, name = None):
+        """
+        Constructor for the Trace_Replay object
+
+        file_name (type: str) is the name of the trace file
+        paced = False => received bytes are available as soon as the host has written the bytes that preceded them
+        paced = True => received bytes are also delayed by the time that separated them from the preceding write in the recording
+        strict = True => raise ValueError when the host writes bytes that differ from the recording
+        name (type: str) is the port name reported to Ser_Iface, default is the trace file name
+        """
+
+        self.file_name = file_name
+        self.name = file_name if name is None else name
+        self.paced = paced
+        self.strict = strict
+        self.timeout = 0.05 # longest time that read may block, units of second
+        self.is_open = True
+
+        # expected host writes, concatenated, and the received chunks gated by the no. of bytes written before them
+        tx = bytearray()
+        self.chunks = [] # (tx bytes written before the chunk, delay after the last write, units of second, bytes)
+        t_write = 0.0
+        for direction, t, data in LoadTrace(file_name):
+            if direction == TX:
+                tx += data
+                t_write = t
+            elif direction == RX:
+                self.chunks.append( (len(tx), t - t_write, data) )
+        self.expected = bytes(tx)
+
+        self.written = 0 # no. of bytes written by the host
+        self.mismatches = 0 # no. of writes that differ from the recording
+        self.write_log = [] # (total bytes written after each write, time.monotonic() of the write), used when paced
+        self.next_chunk = 0 # index of the next chunk to be made available
+        self.rx = bytearray() # bytes available to the host
+
+    def isOpen(self):
+        return self.is_open
+
+    def _Release(self):
+        """
+        Make available the chunks whose preceding writes have been made and, when paced, whose delay has passed
+        """
+
+        now = time.monotonic()
+        while self.next_chunk < len(self.chunks):
+            gate, delay, data = self.chunks[self.next_chunk]
+            if gate > self.written:
+                return # the host has not yet written the command that this chunk is the reply to
+            if self.paced and gate > 0:
+                # time at which the host write that completed the gate was made
+                t_gate = self.write_log[ bisect.bisect_left(self.write_log, (gate, 0.0)) ][1]
+                if now < t_gate + delay:
+                    return
+            self.rx += data
+            self.next_chunk = self.next_chunk + 1
+
+    def _Wait(self):
+        """
+        Return the time until the next chunk becomes available, None if it cannot become available without more writes
+        """
+
+        if self.next_chunk >= len(self.chunks):
+            return None
+        gate, delay, data = self.chunks[self.next_chunk]
+        if gate > self.written:
+            return None
+        if not self.paced or gate == 0:
+            return 0.0
+        t_gate = self.write_log[ bisect.bisect_left(self.write_log, (gate, 0.0)) ][1]
+        return max(0.0, t_gate + delay - time.monotonic())
+
+    @property
+    def in_waiting(self):
+        self._Release()
+        return len(self.rx)
+
+    def write(self, data):
+        data = bytes(data)
+        if self.expected[self.written:self.written + len(data)] != data:
+            self.mismatches = self.mismatches + 1
+            if self.strict:
+                raise ValueError('write %(v1)s differs from the recording at byte %(v2)d'%{"v1":data, "v2":self.written})
+        self.written = self.written + len(data)
+        self.write_log.append( (self.written, time.monotonic()) )
+        return len(data)
+
+    def read(self, size = 1):
+        self._Release()
+        if len(self.rx) == 0:
+            # block for at most timeout, as a serial port would
+            wait = self._Wait()
+            time.sleep( self.timeout if wait is None else min(wait, self.timeout) )
+            self._Release()
+        data = bytes(self.rx[:size])
+        del self.rx[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self._Release()
+        self.rx.clear()
+
+    def close(self):
+        self.is_open = False
+
+def main():
+    # print a summary of each trace file named on the command line
+    import sys
+    for file_name in sys.argv[1:]:
+        records = LoadTrace(file_name)
+        tx = sum(len(r[2]) for r in records if r[0] == TX)
+        rx = sum(len(r[2]) for r in records if r[0] == RX)
+        duration = records[-1][1] if len(records) > 0 else 0.0
+        print('%(v1)s: %(v2)d records, %(v3)d bytes written, %(v4)d bytes received, %(v5)0.3f s'%{"v1":file_name, "v2":len(records), "v3":tx, "v4":rx, "v5":duration})
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,42 @@
 """
 Definition of a class that describes the bounds of a parameter sweep space
 e.g. sweep from start-value to stop-value in steps of delta
+
+The points of the sweep space are generated from their index rather than by accumulating v_set = v_set + delta,
+so there is no floating point drift and the last point is never past stop-value
+Points() returns every point as a numpy array, iterating over the sweep space generates the points one at a time
+so that a huge grid need not be held in memory, len() and indexing / slicing allow a sweep to preallocate its data
 """
 # R. Sheehan 1 - 3 - 2019
 
+# numpy.linspace and numpy.geomspace compute the points in the same way
+# https://numpy.org/doc/stable/reference/generated/numpy.linspace.html
+# https://numpy.org/doc/stable/reference/generated/numpy.geomspace.html
+
+import numpy
+
+SPACINGS = ('linear', 'log', 'list')
+
 
 class SweepSpace(object):
     """
     Class that describes the bounds of a parameter sweep space
     """
 
-    def __init__(self, no_points, start_value, stop_value):
+    def __init__(self, no_points, start_value, stop_value, spacing = 'linear', values = None, bidirectional = False, quantum = None):
         """
         Constructor for the SweepSpace object
         
         no_points (type:int) is number of distinct points within the sweep space
         start_value (type:float) is start of sweep space
         stop_value (type:float) is end of sweep space
+        spacing (type:str) is 'linear' for points in steps of delta, 'log' for points in a constant ratio, 
+        'list' for the points given in values
+        values (type:sequence) contains the points of the sweep space when spacing = 'list', the points are swept in the order given, 
+        no_points, start_value and stop_value are taken from values
+        bidirectional (type:bool) bidirectional = True => the points are swept from start to stop and back to start, e.g. to observe hysteresis
+        quantum (type:float) is the resolution of the swept output, e.g. 0.01 V for the IBM4 analog outputs, 
+        each point is rounded to a multiple of quantum and consecutive repeated points are removed, None => no rounding
         """   
 
         try:
@@ -31,46 +51,144 @@ class SweepSpace(object):
             self.delta = 0.0
             self.delta_min = 0.01
             self.defined = False
+            self.spacing = spacing
+            self.values = None # points of the sweep space, None => points are computed from their index
+            self.bidirectional = bidirectional
+            self.quantum = quantum
+            self.no_points = 0 # no. of points in the sweep space, including the return sweep when bidirectional
+
+            if spacing == 'list' and values is not None:
+                values = numpy.asarray(values, dtype = float).reshape(-1)
+                no_points, start_value, stop_value = len(values), numpy.min(values), numpy.max(values)
 
-            self.SetVals(no_points, start_value, stop_value) # assign values to the class members
+            self.SetVals(no_points, start_value, stop_value, values) # assign values to the class members
             
         except Exception as e:
             print(self.ERR_STATEMENT)
             print(e)
             
-    def SetVals(self, no_points, start_value, stop_value):
+    def SetVals(self, no_points, start_value, stop_value, values = None):
         """
         Define the values for the sweep interval
         
         no_points (type:int) is number of distinct points within the sweep space
         start_value (type:float) is start of sweep space
         stop_value (type:float) is end of sweep space
+        values (type:numpy array) contains the points when spacing = 'list'
+
+        When delta is bounded below by delta_min the no. of points is reduced so that the last point is not past stop_value
         """
         
         self.FUNC_NAME = ".SetVals()" # use this in exception handling messages
         self.ERR_STATEMENT = "Error: " + self.MOD_NAME_STR + self.FUNC_NAME
         
         try:
-            c1 = True if no_points > 3 else False
-            c2 = True if abs(stop_value - start_value) > 0 else False
-            c10 = c1 and c2
+            c1 = True if no_points > 3 or (self.spacing == 'list' and no_points > 0) else False
+            c2 = True if self.spacing == 'list' or abs(stop_value - start_value) > 0 else False
+            c3 = True if self.spacing in SPACINGS else False
+            c4 = True if self.spacing != 'log' or min(start_value, stop_value) > 0 else False # a log spaced interval cannot include zero
+            c5 = True if self.spacing != 'list' or values is not None else False
+            c6 = True if self.quantum is None or self.quantum > 0 else False
+            c10 = c1 and c2 and c3 and c4 and c5 and c6
 
             if c10:
                 self.Nsteps = no_points # no steps inside the interval
                 self.start = min(start_value, stop_value)
                 self.stop = max(stop_value, start_value)
-                self.delta = max( (self.stop - self.start) / float(self.Nsteps - 1), self.delta_min) # Determine the sweep voltage increment, this is bounded below by delta_v_min
+                clamped = (self.stop - self.start) / float(max(self.Nsteps - 1, 1)) < self.delta_min # True when delta is bounded below by delta_min
+                self.delta = max( (self.stop - self.start) / float(max(self.Nsteps - 1, 1)), self.delta_min) # Determine the sweep voltage increment, this is bounded below by delta_v_min
+                self.ends_at_stop = True # the last linear point is exactly stop
+                if self.spacing == 'linear' and clamped:
+                    # when delta has been bounded below keep only the points that lie inside the interval
+                    span = (self.stop - self.start) / self.delta
+                    self.Nsteps = min(self.Nsteps, int( numpy.floor(span + 1.0e-9) ) + 1)
+                    self.ends_at_stop = abs(span - (self.Nsteps - 1)) < 1.0e-9 # the reduced points only reach stop when delta divides the interval
+                self.values = values
+                self.no_points = 2 * self.Nsteps - 1 if self.bidirectional else self.Nsteps
+                if self.quantum is not None:
+                    # rounding can make consecutive points equal so the points are computed once and stored
+                    pts = numpy.round( numpy.array( [self._Point(k) for k in range(0, self.no_points, 1)] ) / self.quantum ) * self.quantum
+                    keep = numpy.concatenate( [[True], numpy.abs( numpy.diff(pts) ) > 0.5 * self.quantum] )
+                    self.values = pts[keep]
+                    self.no_points = len(self.values)
                 self.defined = True
             else:
                 if not c1:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nno_points in interval is too small'
                 if not c2:
                     self.ERR_STATEMENT = self.ERR_STATEMENT + '\nlength of interval is not defined'
+                if not c3:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nspacing must be one of linear, log, list'
+                if not c4:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nlog spaced interval must have start_value > 0'
+                if not c5:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nvalues must be given for a list spaced interval'
+                if not c6:
+                    self.ERR_STATEMENT = self.ERR_STATEMENT + '\nquantum must be positive'
                 raise Exception
         except Exception as e:
             print(self.ERR_STATEMENT)
             print(e)
         
 
+    def _Point(self, k):
+        """
+        Return point k of the sweep space before rounding to quantum, k in the range [0, no. of points including the return sweep)
+        """
+
+        if self.bidirectional and k >= self.Nsteps:
+            k = 2 * (self.Nsteps - 1) - k # the return sweep retraces the points in reverse order
+        if self.spacing == 'list':
+            return float(self.values[k])
+        if k == self.Nsteps - 1 and self.spacing == 'log':
+            return float(self.stop)
+        if self.spacing == 'log':
+            return self.start * (self.stop / self.start) ** (k / float(self.Nsteps - 1))
+        if k == self.Nsteps - 1 and self.ends_at_stop:
+            return float(self.stop) # the last point is exactly stop, not the accumulated start + delta * k
+        return float(self.start + self.delta * k)
+
+    def __len__(self):
+        return self.no_points
 
+    def __getitem__(self, idx):
+        """
+        Return a point of the sweep space, or a numpy array of points when idx is a slice
+        """
+
+        if isinstance(idx, slice):
+            return numpy.array( [self[k] for k in range(*idx.indices(self.no_points))], dtype = float )
+        if idx < 0:
+            idx = idx + self.no_points
+        if idx < 0 or idx >= self.no_points:
+            raise IndexError('SweepSpace index out of range')
+        if self.quantum is not None:
+            return float(self.values[idx])
+        return self._Point(idx)
+
+    def __iter__(self):
+        """
+        Generate the points of the sweep space one at a time
+        """
+
+        for k in range(0, self.no_points, 1):
+            yield self[k]
+
+    def Points(self):
+        """
+        Return every point of the sweep space as a numpy array, in the order in which they are swept
+        """
 
+        if self.quantum is not None:
+            return numpy.array(self.values, dtype = float)
+        if self.spacing == 'list':
+            pts = numpy.array(self.values, dtype = float)
+        elif self.spacing == 'log':
+            pts = numpy.geomspace(self.start, self.stop, self.Nsteps)
+        else:
+            pts = self.start + self.delta * numpy.arange(self.Nsteps)
+            if self.ends_at_stop:
+                pts[-1] = self.stop
+        if self.bidirectional:
+            pts = numpy.concatenate( [pts, pts[-2::-1]] )
+        return pts
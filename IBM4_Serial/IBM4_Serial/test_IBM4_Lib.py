@@ -0,0 +1,148 @@
+"""
+Tests for IBM4_Lib that run against the simulated IBM4 in IBM4_Simulator, no physical IBM4 is needed
+
+Run from this folder using py -m pytest
+Each test opens a Ser_Iface on an IBM4_Simulator.Sim_Port, realtime = False so the replies are available as soon as a command is written
+"""
+
+import os
+import numpy
+import IBM4_Lib
+import IBM4_Simulator
+import Sweep_Interval
+
+class Dropping_Firmware(IBM4_Simulator.IBM4_Firmware):
+    """
+    simulated IBM4 that ignores one Write command, as if the command was lost on the USB link
+    """
+
+    def __init__(self, drop_write = None, **kwargs):
+        """
+        drop_write (type: int) is the no. of the Write command that is ignored, counting from 1, None => no command is ignored
+        """
+
+        IBM4_Simulator.IBM4_Firmware.__init__(self, **kwargs)
+        self.drop_write = drop_write
+        self.writes = 0
+
+    def Execute(self, line):
+        if line.strip().startswith(b'Write'):
+            self.writes = self.writes + 1
+            if self.writes == self.drop_write:
+                return b'', 0.0 # no echo and no result, the reply never arrives
+        return IBM4_Simulator.IBM4_Firmware.Execute(self, line)
+
+def Open_Sim(firmware = None):
+    """
+    Return a Ser_Iface attached to a simulated IBM4
+    """
+
+    firmware = IBM4_Simulator.IBM4_Firmware(seed = 1) if firmware is None else firmware
+    the_dev = IBM4_Lib.Ser_Iface(instr_obj = IBM4_Simulator.Sim_Port(firmware, realtime = False))
+    the_dev.read_timeout = 0.5 # a lost reply is detected quickly
+    return the_dev
+
+def test_framer_discards_stale_lines():
+    framer = IBM4_Lib.Reply_Framer()
+    framer.Expect(b'Read0:3\r\n', 1, 'first')
+    framer.Expect(b'a0\r\n', 0, 'second')
+    framer.Expect(b'l\r\n', 2, 'third')
+
+    # a stale line, then the replies split across arbitrary chunk boundaries
+    for chunk in [b'0.1000\r\nRea', b'd0:3\r\n0.1, 0.2', b', 0.3\r\na0\r\nl\r\nA2 A3 A4 A5 D2\r', b'\n0, 0, 0, 0, 0\r\n']:
+        framer.Feed(chunk)
+    replies = list(framer.Replies())
+
+    assert framer.discarded == 1
+    assert replies == [('first', [b'0.1, 0.2, 0.3']), ('second', []), ('third', [b'A2 A3 A4 A5 D2', b'0, 0, 0, 0, 0'])]
+
+def test_framer_waits_for_complete_reply():
+    framer = IBM4_Lib.Reply_Framer()
+    framer.Expect(b'Read0:3\r\n', 1, 'first')
+    framer.Feed(b'Read0:3\r\n0.1, 0.2')
+
+    assert list(framer.Replies()) == []
+    framer.Feed(b', 0.3\r\n')
+    assert list(framer.Replies()) == [('first', [b'0.1, 0.2, 0.3'])]
+
+def test_pipeline_replies_in_order():
+    the_dev = Open_Sim()
+    pipe = the_dev.Pipeline(depth = 2)
+    futures = [pipe.Queue(b'Write0:1.5\r\n'), pipe.Queue(b'Read0:4\r\n'), pipe.Queue(b'*IDN\r\n'), pipe.Queue(b'Average2:10\r\n')]
+    results = pipe.Execute()
+
+    assert results == [f.result() for f in futures]
+    assert results[0] == [b'A0: 1.50 V']
+    assert len(IBM4_Lib.IBM4_Parse.ParseFloats(results[1][-1])) == 4
+    assert results[2] == [b'ISBY-UCC-RevA.1']
+    assert abs(float(results[3][-1]) - 1.5) < 0.01
+
+def test_read_chunked_statistics():
+    the_dev = Open_Sim()
+    the_dev.WriteVoltage('A0', 1.0)
+    stats = the_dev.RunningStats()
+    mean, amplitude, vals, variance, stderr = the_dev.ReadChunked('A2', 25000, stats = stats)
+
+    assert len(vals) == 25000
+    assert abs(mean - numpy.mean(vals)) < 1.0e-12
+    assert abs(amplitude - 0.5*( numpy.max(vals) - numpy.min(vals) )) < 1.0e-12
+    assert abs(variance - numpy.var(vals)) < 1.0e-12
+    assert abs(stderr - numpy.std(vals, ddof = 1) / numpy.sqrt(25000)) < 1.0e-12
+    assert stats.count == 25000 and abs(stats.mean - mean) < 1.0e-12
+
+def test_read_chunked_without_samples():
+    the_dev = Open_Sim()
+    the_dev.WriteVoltage('A1', 2.0)
+    res = the_dev.ReadChunked('A3', 12000, chunk_size = 5000, keep_samples = False)
+
+    assert res[2] is None
+    assert abs(res[0] - 2.0) < 0.01
+
+def test_large_average_is_chunked():
+    the_dev = Open_Sim()
+    the_dev.WriteVoltage('A0', 1.0)
+    the_dev.WriteVoltage('A1', 0.5)
+
+    assert abs(the_dev.ReadVoltage('A2', 'Average Voltage', 20000) - 1.0) < 0.01
+    assert abs(the_dev.DifferentialRead('A2', 'A3', 'Average Voltage', 20000) - 0.5) < 0.01
+
+def test_sweep_space_endpoints():
+    for no_points, start, stop in [(5, 0.0, 1.0), (11, 0.1, 3.3), (4, 1.0, 0.1)]:
+        pts = Sweep_Interval.SweepSpace(no_points, start, stop).Points()
+        assert len(pts) == no_points
+        assert pts[0] == min(start, stop) and pts[-1] == max(start, stop)
+
+def test_sweep_space_clamped_delta():
+    # delta is bounded below by 0.01, fewer points are taken and none lies past stop
+    space = Sweep_Interval.SweepSpace(20, 3.2, 3.3)
+    pts = space.Points()
+    assert len(pts) == 11 and space.ends_at_stop
+    assert abs(pts[-1] - 3.3) < 1.0e-9
+
+    space = Sweep_Interval.SweepSpace(50, 0.0, 0.105)
+    pts = space.Points()
+    assert pts[-1] <= 0.105 and not space.ends_at_stop
+
+def test_sweep_space_iteration_matches_points():
+    space = Sweep_Interval.SweepSpace(7, 0.5, 2.0, bidirectional = True)
+
+    assert numpy.array_equal(numpy.array(list(space)), space.Points())
+    assert len(space) == 13 and space[-1] == 0.5
+
+def test_sweep_resumes_from_checkpoint(tmp_path):
+    checkpoint_file = os.path.join(str(tmp_path), 'sweep.npz')
+    firmware = Dropping_Firmware(drop_write = 5, seed = 2) # the 1st write sets v_fixed, the 5th is the 4th step of the sweep
+    the_dev = Open_Sim(firmware)
+
+    assert the_dev.SingleChannelSweepA('A0', 0.0, 1.0, 6, checkpoint_file = checkpoint_file) is None
+    assert the_dev.last_sweep.rows == 3
+    assert os.path.exists(checkpoint_file)
+
+    firmware.drop_write = None
+    data = the_dev.SingleChannelSweepA('A0', 0.0, 1.0, 6, checkpoint_file = checkpoint_file)
+
+    assert the_dev.last_sweep.start_row == 3
+    assert data.shape == (6, 6)
+    assert numpy.allclose(data[:, 0], numpy.linspace(0.0, 1.0, 6))
+    assert numpy.allclose(data[:, 1], data[:, 0], atol = 0.02) # A0 is looped back to A2
+    assert not os.path.exists(checkpoint_file) # the checkpoint of a completed sweep is removed